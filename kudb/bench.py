@@ -0,0 +1,641 @@
+"""
+kudb benchmark suite
+
+Measure every public function of kudb at several scales:
+
+    python -m kudb.bench run --sizes 1k,100k --storage memory,file -o result.json
+    python -m kudb.bench run --sizes 10m --only find,get_all
+    python -m kudb.bench diff old.json new.json
+
+Each case reports ops/s, p50/p99 latency (microseconds) and peak RSS as JSON.
+Read-only functions are also measured with several threads (--threads 1,4).
+"""
+
+from typing import Optional, Callable, Any, Dict, List, Tuple
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import kudb
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+SCALES: Dict[str, int] = {"1k": 1000, "100k": 100_000, "10m": 10_000_000}
+DEFAULT_SIZES = "1k,100k"
+CITIES = ["Tokyo", "Osaka", "Nagoya", "Sapporo", "Fukuoka"]
+FILL_CHUNK = 10_000
+
+
+class Case:
+    """one benchmark case (op is timed, before/after are not)"""
+
+    def __init__(
+        self,
+        name: str,
+        op: Callable[[int], Any],
+        before: Optional[Callable[[int], Any]] = None,
+        after: Optional[Callable[[int], Any]] = None,
+        threads_ok: bool = False,
+        max_iter: Optional[int] = None,
+    ):
+        self.name = name
+        self.op = op
+        self.before = before
+        self.after = after
+        self.threads_ok = threads_ok
+        self.max_iter = max_iter
+
+
+def parse_size(text: str) -> int:
+    """
+    '1k' / '100k' / '10m' / '5000' -> number of rows
+
+    >>> parse_size('100k'), parse_size('10m'), parse_size('250')
+    (100000, 10000000, 250)
+    """
+    text = text.strip().lower()
+    if text in SCALES:
+        return SCALES[text]
+    if text.endswith("k"):
+        return int(float(text[:-1]) * 1000)
+    if text.endswith("m"):
+        return int(float(text[:-1]) * 1_000_000)
+    return int(text)
+
+
+def make_doc(i: int) -> Dict[str, Any]:
+    """test document"""
+    return {
+        "name": f"user{i}",
+        "age": i % 100,
+        "city": CITIES[i % len(CITIES)],
+        "score": i * 7 % 1000,
+        "title": f"item {i} from {CITIES[i % len(CITIES)]}",
+    }
+
+
+def fill(size: int) -> None:
+    """insert size docs and size keys into the current database"""
+    kudb.set_tag_name("name")
+    for start in range(0, size, FILL_CHUNK):
+        end = min(size, start + FILL_CHUNK)
+        with kudb.batch():
+            kudb.insert_many([make_doc(i) for i in range(start, end)])
+            kudb.set_keys_from_dict({f"key{i}": i for i in range(start, end)})
+
+
+def peak_rss_kb() -> Optional[int]:
+    """peak resident set size of this process (KB)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes on macOS
+        rss //= 1024
+    return int(rss)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    percentile of sorted values
+
+    >>> percentile([1.0, 2.0, 3.0, 4.0], 0.5)
+    2.0
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[int(p * (len(sorted_values) - 1))]
+
+
+def is_adult(v: Any) -> bool:
+    """predicate for `find` (module level so that it is picklable)"""
+    return v["age"] >= 20
+
+
+def make_cases(size: int, target: Dict[str, Any]) -> List[Case]:
+    """benchmark cases for every public function, in execution order"""
+    rnd = random.Random(1234)
+
+    def rid(_: int = 0) -> int:
+        return rnd.randint(1, size)
+
+    def reconnect(_: int = 0) -> None:
+        kudb.connect(target["filename"], target["table"])
+
+    scratch = {"id": 0}
+    snapshot: Dict[str, Any] = {}
+
+    def insert_scratch(_: int) -> None:
+        scratch["id"] = kudb.insert({"name": "scratch", "age": 0}) or 0
+
+    def fill_scratch(_: int) -> None:
+        kudb.connect(target["filename"], target["table"] + "_scratch")
+        fill(min(size, FILL_CHUNK))
+
+    cases = [
+        # connection
+        Case("connect", reconnect, threads_ok=True),
+        Case(
+            "change_db", lambda i: kudb.change_db(target["filename"], target["table"])
+        ),
+        Case("batch", lambda i: _batch_op()),
+        Case("connect_sharded", lambda i: _sharded_op(i), max_iter=20),
+        Case("backup", lambda i: _backup_op(), max_iter=5),
+        Case("snapshot_to_memory", lambda i: kudb.snapshot_to_memory(), max_iter=5),
+        Case(
+            "restore_from",
+            lambda i: kudb.restore_from(snapshot["conn"]),
+            before=lambda i: snapshot.update(conn=kudb.snapshot_to_memory()),
+            after=lambda i: snapshot["conn"].close(),
+            max_iter=5,
+        ),
+        # kvs
+        Case("get_key", lambda i: kudb.get_key(f"key{rid()}"), threads_ok=True),
+        Case("set_key", lambda i: kudb.set_key(f"key{rid()}", i)),
+        Case(
+            "set_keys_from_dict",
+            lambda i: kudb.set_keys_from_dict({f"key{rid()}": i for _ in range(100)}),
+        ),
+        Case("incr", lambda i: kudb.incr("bench_counter")),
+        Case("decr", lambda i: kudb.decr("bench_counter")),
+        Case(
+            "compare_and_set",
+            lambda i: kudb.compare_and_set("bench_cas", None if i == 0 else i - 1, i),
+        ),
+        Case(
+            "delete_key",
+            lambda i: kudb.delete_key(f"del{i}"),
+            before=lambda i: kudb.set_key(f"del{i}", i),
+        ),
+        Case("get_keys", lambda i: kudb.get_keys(True), threads_ok=True),
+        Case("scan", lambda i: kudb.scan(prefix=f"key{rid()}"), threads_ok=True),
+        Case(
+            "items",
+            lambda i: list(kudb.items(prefix=f"key{rid()}", limit=100)),
+            threads_ok=True,
+        ),
+        Case("get_info", lambda i: kudb.get_info(f"key{rid()}"), threads_ok=True),
+        Case("kvs_json", lambda i: kudb.kvs_json(), max_iter=3),
+        # doc (read)
+        Case("count_doc", lambda i: kudb.count_doc(), threads_ok=True),
+        Case("get_all", lambda i: kudb.get_all(), threads_ok=True),
+        Case("recent", lambda i: kudb.recent(100), threads_ok=True),
+        Case(
+            "get_range",
+            lambda i: kudb.get_range(created_after=time.time() - 3600, limit=100),
+            threads_ok=True,
+        ),
+        Case("get_by_id", lambda i: kudb.get_by_id(rid()), threads_ok=True),
+        Case(
+            "get_by_ids",
+            lambda i: kudb.get_by_ids([rid() for _ in range(500)]),
+            threads_ok=True,
+        ),
+        Case(
+            "get_by_tag", lambda i: kudb.get_by_tag(f"user{rid() - 1}"), threads_ok=True
+        ),
+        Case("get", lambda i: kudb.get(id=rid()), threads_ok=True),
+        Case(
+            "get_one", lambda i: kudb.get_one(tag=f"user{rid() - 1}"), threads_ok=True
+        ),
+        Case("find", lambda i: kudb.find(is_adult), threads_ok=True),
+        Case(
+            "find_one",
+            lambda i: kudb.find_one(keys={"name": f"user{rid() - 1}"}),
+            threads_ok=True,
+        ),
+        Case(
+            "to_columns", lambda i: kudb.to_columns(["age", "score"]), threads_ok=True
+        ),
+        Case(
+            "aggregate",
+            lambda i: kudb.aggregate(
+                group_by="city", metrics={"n": "count", "avg": ("avg", "age")}
+            ),
+            threads_ok=True,
+        ),
+        Case("get_tag_name", lambda i: kudb.get_tag_name(), threads_ok=True),
+        Case("get_high_score", lambda i: kudb.get_high_score(10), threads_ok=True),
+        # doc (write)
+        Case("set_tag_name", lambda i: kudb.set_tag_name("name")),
+        Case("insert", lambda i: kudb.insert(make_doc(size + i))),
+        Case(
+            "insert_many",
+            lambda i: kudb.insert_many([make_doc(size + i) for _ in range(100)]),
+        ),
+        Case(
+            "upsert",
+            lambda i: kudb.upsert({"sku": f"sku{i % 1000}", "stock": i}, on="sku"),
+            before=lambda i: kudb.create_index("sku", unique=True),
+        ),
+        Case(
+            "upsert_many",
+            lambda i: kudb.upsert_many(
+                [{"sku": f"sku{(i * 100 + n) % 1000}", "stock": i} for n in range(100)],
+                on="sku",
+            ),
+            before=lambda i: kudb.create_index("sku", unique=True),
+        ),
+        Case("insert_score", lambda i: kudb.insert_score(i, f"player{i}")),
+        Case("update", lambda i: kudb.update(id=rid(), new_value=make_doc(i))),
+        Case("update_by_id", lambda i: kudb.update_by_id(rid(), make_doc(i))),
+        Case(
+            "update_by_tag",
+            lambda i: kudb.update_by_tag(f"user{rid() - 1}", make_doc(i)),
+        ),
+        Case("delete", lambda i: kudb.delete(id=scratch["id"]), before=insert_scratch),
+        Case(
+            "purge_expired",
+            lambda i: kudb.purge_expired(),
+            before=lambda i: kudb.insert_many([make_doc(i)] * 100, ttl=1e-6),
+        ),
+        Case(
+            "start_sweeper",
+            lambda i: kudb.start_sweeper(interval=3600),
+            after=lambda i: kudb.stop_sweeper(),
+        ),
+        Case(
+            "stop_sweeper",
+            lambda i: kudb.stop_sweeper(),
+            before=lambda i: kudb.start_sweeper(interval=3600),
+        ),
+        Case("compact", lambda i: kudb.compact(max_pages=100), max_iter=20),
+        Case(
+            "start_compactor",
+            lambda i: kudb.start_compactor(interval=3600),
+            after=lambda i: kudb.stop_compactor(),
+        ),
+        Case(
+            "stop_compactor",
+            lambda i: kudb.stop_compactor(),
+            before=lambda i: kudb.start_compactor(interval=3600),
+        ),
+        # full-text
+        Case(
+            "enable_fulltext",
+            lambda i: kudb.enable_fulltext(["title"]),
+            before=lambda i: kudb.disable_fulltext(),
+            max_iter=3,
+        ),
+        Case(
+            "search",
+            lambda i: kudb.search(CITIES[i % len(CITIES)], limit=20),
+            threads_ok=True,
+        ),
+        Case(
+            "disable_fulltext",
+            lambda i: kudb.disable_fulltext(),
+            before=lambda i: kudb.enable_fulltext(["title"]),
+            max_iter=3,
+        ),
+        # expression index
+        Case(
+            "create_index",
+            lambda i: kudb.create_index("age"),
+            before=lambda i: kudb.drop_index("age"),
+            max_iter=3,
+        ),
+        Case(
+            "drop_index",
+            lambda i: kudb.drop_index("age"),
+            before=lambda i: kudb.create_index("age"),
+            max_iter=3,
+        ),
+        # change feed
+        Case(
+            "enable_changes",
+            lambda i: kudb.enable_changes(),
+            before=lambda i: kudb.disable_changes(),
+            max_iter=3,
+        ),
+        Case(
+            "changes_since",
+            lambda i: kudb.changes_since(0, limit=1000),
+            before=lambda i: kudb.update_by_id(rid(), make_doc(i)),
+        ),
+        Case(
+            "disable_changes",
+            lambda i: kudb.disable_changes(),
+            before=lambda i: kudb.enable_changes(),
+            max_iter=3,
+        ),
+        # instrumentation
+        Case(
+            "enable_metrics",
+            lambda i: kudb.enable_metrics(),
+            after=lambda i: kudb.disable_metrics(),
+        ),
+        Case(
+            "disable_metrics",
+            lambda i: kudb.disable_metrics(),
+            before=lambda i: kudb.enable_metrics(),
+        ),
+        Case("get_metrics", lambda i: kudb.get_metrics(), threads_ok=True),
+        Case(
+            "metrics_text",
+            lambda i: kudb.metrics_text(),
+            before=lambda i: kudb.enable_metrics() and kudb.get_key("key1"),
+            after=lambda i: kudb.disable_metrics(),
+        ),
+        Case(
+            "enable_slow_log",
+            lambda i: kudb.enable_slow_log(1.0),
+            after=lambda i: kudb.disable_slow_log(),
+        ),
+        Case(
+            "disable_slow_log",
+            lambda i: kudb.disable_slow_log(),
+            before=lambda i: kudb.enable_slow_log(1.0),
+        ),
+        # destructive (run on a scratch table, the last cases for a dataset)
+        Case(
+            "create_collection",
+            lambda i: kudb.create_collection(target["table"] + "_scratch", capped=100),
+            before=fill_scratch,
+            after=lambda i: kudb.create_collection(target["table"] + "_scratch")
+            or reconnect(),
+            max_iter=3,
+        ),
+        Case(
+            "clear_keys",
+            lambda i: kudb.clear_keys(),
+            before=fill_scratch,
+            after=reconnect,
+            max_iter=3,
+        ),
+        Case(
+            "clear_doc",
+            lambda i: kudb.clear_doc(),
+            before=fill_scratch,
+            after=reconnect,
+            max_iter=3,
+        ),
+        Case(
+            "clear",
+            lambda i: kudb.clear(),
+            before=fill_scratch,
+            after=reconnect,
+            max_iter=3,
+        ),
+        Case(
+            "close",
+            lambda i: kudb.close(),
+            before=fill_scratch,
+            after=reconnect,
+            max_iter=3,
+        ),
+    ]
+    return cases
+
+
+def _batch_op() -> None:
+    """ten counter updates in one transaction"""
+    with kudb.batch():
+        for _ in range(10):
+            kudb.incr("bench_batch")
+
+
+def _backup_op() -> None:
+    """online backup of the whole database to a temporary file"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.backup(os.path.join(tmp, "backup.db"))
+
+
+def _sharded_op(i: int) -> None:
+    """open four shards, write 100 keys and close"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = kudb.connect_sharded(tmp, shards=4)
+        for n in range(100):
+            sdb.set_key(f"key{n}", i)
+        sdb.close()
+
+
+def missing_cases() -> List[str]:
+    """public functions that have no benchmark case"""
+    names = {c.name for c in make_cases(1, {"filename": ":memory:", "table": "x"})}
+    return [
+        name
+        for name in kudb.kudb.__all__
+        if callable(getattr(kudb, name)) and name not in names
+    ]
+
+
+def run_case(case: Case, threads: int, budget: float, max_iter: int) -> Dict[str, Any]:
+    """run one case and return its statistics"""
+    if case.max_iter is not None:
+        max_iter = min(max_iter, case.max_iter)
+    latencies: List[float] = []
+    lock = threading.Lock()
+    counter = {"i": 0, "spent": 0.0}
+
+    def worker() -> None:
+        while True:
+            with lock:
+                i = counter["i"]
+                if i >= max_iter or (i > 0 and counter["spent"] >= budget):
+                    return
+                counter["i"] += 1
+            if case.before is not None:
+                case.before(i)
+            t = time.perf_counter()
+            case.op(i)
+            spent = time.perf_counter() - t
+            if case.after is not None:
+                case.after(i)
+            with lock:
+                latencies.append(spent)
+                counter["spent"] += spent / threads
+
+    start = time.perf_counter()
+    if threads == 1:
+        worker()
+    else:
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for th in pool:
+            th.start()
+        for th in pool:
+            th.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    # single thread: only the timed part, threads: throughput of the whole pool
+    busy = wall if threads > 1 else sum(latencies)
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / busy if busy > 0 else 0.0,
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+        "wall_sec": wall,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def run(
+    sizes: List[int],
+    storages: List[str],
+    threads_list: List[int],
+    only: Optional[List[str]] = None,
+    budget: float = 1.0,
+    max_iter: int = 10000,
+    verbose: bool = False,
+) -> Dict[str, Any]:
+    """run the benchmark suite and return the result as a dict"""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in storages:
+            for size in sizes:
+                if storage == "memory":
+                    filename = kudb.MEMORY_FILE
+                else:
+                    filename = os.path.join(tmp, f"bench{size}.db")
+                target = {"filename": filename, "table": f"bench{size}"}
+                kudb.connect(filename, target["table"])
+                fill(size)
+                for case in make_cases(size, target):
+                    if only is not None and case.name not in only:
+                        continue
+                    for threads in threads_list:
+                        if threads > 1 and not case.threads_ok:
+                            continue
+                        stat = run_case(case, threads, budget, max_iter)
+                        stat.update(
+                            {
+                                "name": case.name,
+                                "size": size,
+                                "storage": storage,
+                                "threads": threads,
+                            }
+                        )
+                        results.append(stat)
+                        if verbose:
+                            print(format_result(stat), file=sys.stderr)
+                kudb.stop_sweeper()
+                kudb.close()
+    return {
+        "meta": {
+            "kudb": getattr(kudb, "__version__", ""),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "time": int(time.time()),
+        },
+        "results": results,
+    }
+
+
+def format_result(stat: Dict[str, Any]) -> str:
+    """one line summary of a result"""
+    return (
+        f"{stat['name']:<20} {stat['storage']:<6} n={stat['size']:<9} "
+        f"t={stat['threads']:<2} {stat['ops_per_sec']:>12.1f} ops/s "
+        f"p50={stat['p50_us']:.1f}us p99={stat['p99_us']:.1f}us"
+    )
+
+
+def _case_key(stat: Dict[str, Any]) -> Tuple[str, int, str, int]:
+    return (stat["name"], stat["size"], stat["storage"], stat["threads"])
+
+
+def diff(
+    old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.1
+) -> List[Dict[str, Any]]:
+    """
+    compare two results, `regression` is set when ops/s dropped more than threshold
+
+    >>> a = {'results': [{'name': 'get_key', 'size': 1, 'storage': 'memory', 'threads': 1, 'ops_per_sec': 100.0, 'p99_us': 10.0}]}
+    >>> b = {'results': [{'name': 'get_key', 'size': 1, 'storage': 'memory', 'threads': 1, 'ops_per_sec': 50.0, 'p99_us': 20.0}]}
+    >>> d = diff(a, b)
+    >>> d[0]['change'], d[0]['regression']
+    (-0.5, True)
+    """
+    old_map = {_case_key(r): r for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        o = old_map.get(_case_key(r))
+        if o is None or not o["ops_per_sec"]:
+            continue
+        change = r["ops_per_sec"] / o["ops_per_sec"] - 1.0
+        rows.append(
+            {
+                "name": r["name"],
+                "size": r["size"],
+                "storage": r["storage"],
+                "threads": r["threads"],
+                "old_ops_per_sec": o["ops_per_sec"],
+                "new_ops_per_sec": r["ops_per_sec"],
+                "old_p99_us": o["p99_us"],
+                "new_p99_us": r["p99_us"],
+                "change": round(change, 4),
+                "regression": change < -threshold,
+            }
+        )
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """command line entry point"""
+    parser = argparse.ArgumentParser(
+        prog="python -m kudb.bench",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    sub = parser.add_subparsers(dest="command")
+    p_run = sub.add_parser("run", help="run benchmarks")
+    p_run.add_argument("--sizes", default=DEFAULT_SIZES, help="ex: 1k,100k,10m")
+    p_run.add_argument("--storage", default="memory,file", help="memory,file")
+    p_run.add_argument("--threads", default="1,4", help="ex: 1,4")
+    p_run.add_argument("--only", default=None, help="comma separated function names")
+    p_run.add_argument("--budget", type=float, default=1.0, help="seconds per case")
+    p_run.add_argument("--max-iter", type=int, default=10000)
+    p_run.add_argument("-o", "--output", default=None, help="result JSON file")
+    p_diff = sub.add_parser("diff", help="compare two result files")
+    p_diff.add_argument("old")
+    p_diff.add_argument("new")
+    p_diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        result = run(
+            sizes=[parse_size(s) for s in args.sizes.split(",")],
+            storages=args.storage.split(","),
+            threads_list=[int(t) for t in args.threads.split(",")],
+            only=args.only.split(",") if args.only else None,
+            budget=args.budget,
+            max_iter=args.max_iter,
+            verbose=True,
+        )
+        text = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as fp:
+                fp.write(text)
+        else:
+            print(text)
+        return 0
+    if args.command == "diff":
+        with open(args.old, encoding="utf-8") as fp:
+            old = json.load(fp)
+        with open(args.new, encoding="utf-8") as fp:
+            new = json.load(fp)
+        rows = diff(old, new, args.threshold)
+        for row in rows:
+            mark = "  REGRESSION" if row["regression"] else ""
+            print(
+                f"{row['name']:<20} {row['storage']:<6} n={row['size']:<9} "
+                f"t={row['threads']:<2} {row['old_ops_per_sec']:>12.1f} -> "
+                f"{row['new_ops_per_sec']:>12.1f} ops/s ({row['change']:+.1%}){mark}"
+            )
+        return 1 if any(r["regression"] for r in rows) else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
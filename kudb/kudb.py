@@ -25,10 +25,24 @@ Insert and find:
 'Sabu'
 """
 
-from typing import Optional, Callable, Any, Dict, List
+from typing import Optional, Callable, Any, Dict, List, Iterator, Union, Tuple, Set
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import functools
+import heapq
+import importlib
+import itertools
+import logging
+import pickle
+import re
 import sqlite3
+import sys
+import threading
 import time
 import json
+import zlib
 
 
 class KudbError(Exception):
@@ -37,14 +51,61 @@ class KudbError(Exception):
 
 db: Optional[sqlite3.Connection] = None
 cache_db: Dict[str, sqlite3.Connection] = {}
-CACHE_KEYS: Dict[str, bool] = {}
+# key -> expires_at (0 = no TTL)
+CACHE_KEYS: Dict[str, float] = {}
+# settings stored in the kvs (ex: "_tag") -> value
+CACHE_META: Dict[str, Any] = {}
+# unique indexes known to exist (checked by `upsert`)
+unique_indexes: Set[str] = set()
+# SQLS keys of the lazily made indexes known to exist (see `_ensure_index`)
+built_indexes: Set[str] = set()
+# (cache_db key, table name) -> (CACHE_META, unique_indexes, built_indexes)
+# of every open connection, so reconnecting with `file=` keeps them
+conn_caches: Dict[Tuple[str, str], Tuple[Dict[str, Any], Set[str], Set[str]]] = {}
+# indexes made with new tables, or at first use for files of older versions
+LAZY_INDEXES = ("create_time_index", "create_doc_tag_index", "create_doc_time_index")
 SQLS: Dict[str, str] = {}
 MEMORY_FILE: str = ":memory:"
 cur_filename: str = MEMORY_FILE
 cur_tablename: str = "kudb"
+# `PRAGMA data_version` when CACHE_KEYS was checked (changes on commits by others)
+cache_version: Optional[int] = None
+# another connection has committed since CACHE_KEYS was fully loaded:
+# a key missing from CACHE_KEYS may exist (no negative cache)
+cache_stale: bool = False
+# largest key_id loaded into CACHE_KEYS (`get_keys` loads only newer keys)
+cache_key_id: int = 0
+# opened with `connect(readonly=True)` (no key cache)
+cur_readonly: bool = False
 SQLITE_MAX_INT: int = 9223372036854775807
+# RETURNING (incr, compare_and_set, upsert, purge_expired) needs SQLite 3.35;
+# the rest needs INSERT ... ON CONFLICT DO UPDATE (3.24)
+SQLITE_RETURNING_VERSION = (3, 35, 0)
+# deterministic=True (Python 3.8+) lets SQLite use regexp in indexes
+FUNCTION_FLAGS: Dict[str, Any] = (
+    {"deterministic": True} if sys.version_info >= (3, 8) else {}
+)
+# `batch()` nesting depth and the thread running it (it holds db_lock)
+batch_depth: int = 0
+batch_thread: Optional[int] = None
+db_lock = threading.RLock()
+# SQL condition for rows that are not expired (expires_at=0 means no TTL)
+SQL_LIVE = "(expires_at = 0 OR expires_at > (julianday('now') - 2440587.5) * 86400.0)"
+SQL_EXPIRED = (
+    "(expires_at > 0 AND expires_at <= (julianday('now') - 2440587.5) * 86400.0)"
+)
+# pages freed by one `PRAGMA incremental_vacuum` in `compact`
+COMPACT_STEP = 128
+# triggers that fill the change log (see `enable_changes`)
+CHANGE_TRIGGERS = ("key_ai", "key_au", "key_ad", "doc_ai", "doc_au", "doc_ad")
+# triggers that keep a capped collection in size (see `create_collection`)
+CAP_TRIGGERS = ("ai", "au", "ad")
+# oldest docs looked at (and deleted at most) by one trim of a capped collection
+CAP_STEP = 64
 # SQL template
 SQLS_TEMPLATE = {
+    # condition for rows that are not expired (used in queries built at run time)
+    "live": "__LIVE__",
     # kvs
     "create": """
     CREATE TABLE IF NOT EXISTS __TABLE_NAME__ (
@@ -52,16 +113,76 @@ SQLS_TEMPLATE = {
         key TEXT UNIQUE,
         value TEXT DEFAULT '',
         ctime INTEGER DEFAULT 0,
-        mtime INTEGER DEFAULT 0
+        mtime INTEGER DEFAULT 0,
+        expires_at REAL DEFAULT 0
     )
     """,
-    "select": "SELECT value FROM __TABLE_NAME__ WHERE key=?",
-    "select_info": "SELECT * FROM __TABLE_NAME__ WHERE key=?",
-    "keys": "SELECT key FROM __TABLE_NAME__",
-    "insert": "INSERT INTO __TABLE_NAME__ (key, value, ctime, mtime) VALUES (?, ?, ?, ?)",
-    "update": "UPDATE __TABLE_NAME__ SET value=?, mtime=? WHERE key=?",
+    "create_index": """
+    CREATE INDEX IF NOT EXISTS __TABLE_NAME___expires
+        ON __TABLE_NAME__ (expires_at) WHERE expires_at > 0
+    """,
+    # made with new tables; for older files at first use (see `_ensure_index`)
+    "create_time_index": """
+    CREATE INDEX IF NOT EXISTS __TABLE_NAME___ctime ON __TABLE_NAME__ (ctime);
+    CREATE INDEX IF NOT EXISTS __TABLE_NAME___mtime ON __TABLE_NAME__ (mtime)
+    """,
+    "select": "SELECT value, expires_at FROM __TABLE_NAME__ WHERE key=? AND __LIVE__",
+    "select_info": """
+    SELECT key_id, key, value, ctime, mtime, expires_at FROM __TABLE_NAME__
+    WHERE key=? AND __LIVE__
+    """,
+    "keys": "SELECT key, expires_at FROM __TABLE_NAME__",
+    "keys_after": "SELECT key, expires_at, key_id FROM __TABLE_NAME__ WHERE key_id > ?",
+    "insert": "INSERT INTO __TABLE_NAME__ (key, value, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)",
+    "update": "UPDATE __TABLE_NAME__ SET value=?, mtime=?, expires_at=? WHERE key=?",
+    "upsert": """
+    INSERT INTO __TABLE_NAME__ (key, value, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        value=excluded.value, mtime=excluded.mtime, expires_at=excluded.expires_at
+    """,
     "delete": "DELETE FROM __TABLE_NAME__ WHERE key=?",
     "clear": "DELETE FROM __TABLE_NAME__",
+    # ?6 is n; reals keep 17 digits (round trip), integer overflow and inf are refused
+    "incr": """
+    INSERT INTO __TABLE_NAME__ (key, value, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        value=CASE
+            WHEN NOT __LIVE__ THEN excluded.value
+            WHEN typeof(__TABLE_NAME__.value + ?6) = 'real'
+                THEN printf('%!.17g', __TABLE_NAME__.value + ?6)
+            ELSE __TABLE_NAME__.value + ?6 END,
+        mtime=excluded.mtime,
+        expires_at=CASE WHEN __LIVE__ THEN expires_at ELSE excluded.expires_at END
+    WHERE NOT __LIVE__ OR (
+        json_type(__TABLE_NAME__.value) IN ('integer', 'real')
+        AND NOT (typeof(__TABLE_NAME__.value + ?6) = 'real' AND (
+            (json_type(__TABLE_NAME__.value) = 'integer' AND typeof(?6) = 'integer')
+            OR abs(__TABLE_NAME__.value + ?6) > 1.7976931348623157e308)))
+    RETURNING value, expires_at
+    """,
+    # numbers are compared by value (the stored text may have more digits)
+    "cas": """
+    UPDATE __TABLE_NAME__ SET value=?1, mtime=?2 WHERE key=?3 AND __LIVE__ AND (
+        value=?4 OR (
+            json_type(value) IN ('integer', 'real')
+            AND json_type(?4) IN ('integer', 'real')
+            AND value + 0 = ?4 + 0))
+    RETURNING expires_at
+    """,
+    "cas_absent": """
+    INSERT INTO __TABLE_NAME__ (key, value, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, 0)
+    ON CONFLICT(key) DO UPDATE SET
+        value=excluded.value,
+        mtime=excluded.mtime,
+        expires_at=CASE WHEN __LIVE__ THEN expires_at ELSE 0 END
+    WHERE __TABLE_NAME__.value='null' OR NOT __LIVE__
+    RETURNING expires_at
+    """,
+    "purge": """
+    DELETE FROM __TABLE_NAME__ WHERE key_id IN (
+        SELECT key_id FROM __TABLE_NAME__ WHERE __EXPIRED__ LIMIT ?
+    ) RETURNING key
+    """,
     # doc
     "create_doc": """
     CREATE TABLE IF NOT EXISTS doc__TABLE_NAME__ (
@@ -69,45 +190,151 @@ SQLS_TEMPLATE = {
         tag TEXT DEFAULT '',
         value TEXT DEFAULT '',
         ctime INTEGER DEFAULT 0,
-        mtime INTEGER DEFAULT 0
+        mtime INTEGER DEFAULT 0,
+        expires_at REAL DEFAULT 0
     )
     """,
-    "select_doc": "SELECT value, id FROM doc__TABLE_NAME__",
-    "select_doc_desc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id <= ? ORDER BY id DESC LIMIT ?",
-    "select_doc_asc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id >= ? ORDER BY id ASC LIMIT ?",
-    "recent_doc": "SELECT value, id FROM doc__TABLE_NAME__ ORDER BY id DESC LIMIT ? OFFSET ?",
-    "get_doc_by_id": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id=?",
-    "get_doc_by_tag": "SELECT value, id FROM doc__TABLE_NAME__ WHERE tag=? LIMIT ?",
-    "insert_doc": "INSERT INTO doc__TABLE_NAME__ (value, tag, ctime, mtime) VALUES (?, ?, ?, ?)",
+    "create_doc_index": """
+    CREATE INDEX IF NOT EXISTS doc__TABLE_NAME___expires
+        ON doc__TABLE_NAME__ (expires_at) WHERE expires_at > 0
+    """,
+    "create_doc_tag_index": """
+    CREATE INDEX IF NOT EXISTS doc__TABLE_NAME___tag ON doc__TABLE_NAME__ (tag)
+    """,
+    "create_doc_time_index": """
+    CREATE INDEX IF NOT EXISTS doc__TABLE_NAME___ctime ON doc__TABLE_NAME__ (ctime);
+    CREATE INDEX IF NOT EXISTS doc__TABLE_NAME___mtime ON doc__TABLE_NAME__ (mtime)
+    """,
+    "select_doc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE __LIVE__",
+    "select_doc_desc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id <= ? AND __LIVE__ ORDER BY id DESC LIMIT ?",
+    "select_doc_asc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id >= ? AND __LIVE__ ORDER BY id ASC LIMIT ?",
+    "recent_doc": "SELECT value, id FROM doc__TABLE_NAME__ WHERE __LIVE__ ORDER BY id DESC LIMIT ? OFFSET ?",
+    "get_doc_by_id": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id=? AND __LIVE__",
+    "get_doc_by_ids": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id IN (SELECT value FROM json_each(?)) AND __LIVE__",
+    "get_doc_by_tag": "SELECT value, id FROM doc__TABLE_NAME__ WHERE tag=? AND __LIVE__ LIMIT ?",
+    "insert_doc": "INSERT INTO doc__TABLE_NAME__ (value, tag, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)",
+    "insert_doc_id": "INSERT INTO doc__TABLE_NAME__ (id, value, tag, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+    "upsert_doc": """
+    INSERT INTO doc__TABLE_NAME__ (value, tag, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT __TARGET__ DO UPDATE SET
+        value=excluded.value, tag=excluded.tag, mtime=excluded.mtime, expires_at=excluded.expires_at
+    RETURNING id
+    """,
+    "upsert_many_doc": """
+    INSERT INTO doc__TABLE_NAME__ (value, tag, ctime, mtime, expires_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT __TARGET__ DO UPDATE SET
+        value=excluded.value, tag=excluded.tag, mtime=excluded.mtime, expires_at=excluded.expires_at
+    """,
     "update_doc": "UPDATE doc__TABLE_NAME__ SET value=?, tag=?, mtime=? WHERE id=?",
+    "update_doc_value": "UPDATE doc__TABLE_NAME__ SET value=?, mtime=? WHERE id=?",
     "update_doc_by_tag": "UPDATE doc__TABLE_NAME__ SET value=?, tag=?, mtime=? WHERE tag=?",
     "delete_doc": "DELETE FROM doc__TABLE_NAME__ WHERE id=?",
     "delete_doc_by_tag": "DELETE FROM doc__TABLE_NAME__ WHERE tag=?",
     "clear_doc": "DELETE FROM doc__TABLE_NAME__",
-    "count_doc": "SELECT count(id) FROM doc__TABLE_NAME__",
+    # all minus expired: the expired ones are counted with the partial index
+    "count_doc": """
+    SELECT (SELECT count(id) FROM doc__TABLE_NAME__)
+        - (SELECT count(id) FROM doc__TABLE_NAME__ WHERE __EXPIRED__)
+    """,
+    "doc_id_range": "SELECT min(id), max(id) FROM doc__TABLE_NAME__",
+    "select_doc_range": "SELECT value, id FROM doc__TABLE_NAME__ WHERE id BETWEEN ? AND ? AND __LIVE__ ORDER BY id",
+    "purge_doc": """
+    DELETE FROM doc__TABLE_NAME__ WHERE id IN (
+        SELECT id FROM doc__TABLE_NAME__ WHERE __EXPIRED__ LIMIT ?
+    )
+    """,
 }
 
 
-def connect(filename: str = ":memory:", table_name: str = "kudb") -> sqlite3.Connection:
-    """Connect to database"""
-    global SQLS, cur_filename, db, cur_tablename
-    # generate sqls
-    SQLS = {}
-    for key, val in SQLS_TEMPLATE.items():
-        SQLS[key] = val.replace("__TABLE_NAME__", table_name)
+def connect(
+    filename: str = ":memory:",
+    table_name: str = "kudb",
+    readonly: bool = False,
+    immutable: bool = False,
+    mmap_size: Optional[int] = None,
+    auto_vacuum: Optional[str] = None,
+) -> sqlite3.Connection:
+    """
+    Connect to database
+
+    `readonly=True` opens the file with `mode=ro`: no schema is created,
+    the key cache is not loaded and the connection never takes a write lock.
+    `immutable=True` (implies readonly) is for snapshot files that no one
+    writes to; SQLite then skips locking and change detection entirely.
+    `mmap_size` sets `PRAGMA mmap_size` (bytes of the file to memory-map).
+    `auto_vacuum` ("none", "full" or "incremental") is applied to new files only;
+    with "incremental", `compact` gives the space of deleted rows back to the OS.
+    """
+    global SQLS, cur_filename, db, cur_tablename, cur_readonly
+    readonly = readonly or immutable
+    cache_key = filename + "?mode=ro" if readonly else filename
     # check cache
-    if (filename in cache_db) and (cur_tablename == table_name):  # already open?
-        db = cache_db[filename]  # use_cache
+    if (cache_key in cache_db) and (cur_tablename == table_name):  # already open?
+        switched = db is not cache_db[cache_key]
+        db = cache_db[cache_key]  # use_cache
+        _use_conn_caches(cache_key, table_name)
         cur_filename = filename
+        cur_readonly = readonly
+        SQLS = _make_sqls(
+            table_name, readonly and not _has_expires_column(db, table_name)
+        )
+        if readonly:
+            CACHE_KEYS.clear()
+        elif switched:
+            get_keys(True)  # the cache belonged to the previous file
         return db
     # connect to sqlite3
-    db = sqlite3.connect(filename, check_same_thread=False)
-    cache_db[filename] = db
+    try:
+        if readonly:
+            if filename == MEMORY_FILE:
+                raise KudbError("an in-memory database can not be opened readonly.")
+            uri = Path(filename).resolve().as_uri() + "?mode=ro"
+            if immutable:
+                uri += "&immutable=1"
+            # autocommit: a failed write must not leave a transaction open
+            conn = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, isolation_level=None
+            )
+        else:
+            conn = sqlite3.connect(filename, check_same_thread=False)
+        conn.create_function("regexp", 2, _regexp, **FUNCTION_FLAGS)
+        if mmap_size is not None:
+            conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        if readonly:
+            SQLS = _make_sqls(table_name, not _has_expires_column(conn, table_name))
+        else:
+            SQLS = _make_sqls(table_name)
+    except KudbError:
+        raise
+    except Exception as err:
+        raise KudbError("could not open database file: " + str(err)) from err
+    db = conn
+    if instrumented:
+        db.set_trace_callback(_trace_statement)
+    cache_db[cache_key] = db
+    _drop_conn_caches(cache_key)
+    _use_conn_caches(cache_key, table_name)
     cur_filename = filename
     cur_tablename = table_name
+    cur_readonly = readonly
+    if readonly:
+        # keys are looked up in the file on demand
+        CACHE_KEYS.clear()
+        return db
     try:
+        if auto_vacuum is not None:
+            _set_auto_vacuum(auto_vacuum)
         # create table
+        new_file = not _table_exists("doc" + table_name)
         db.executescript(SQLS["create"] + ";" + SQLS["create_doc"])
+        _add_expires_column(table_name)
+        _add_expires_column("doc" + table_name)
+        db.executescript(SQLS["create_index"] + ";" + SQLS["create_doc_index"])
+        if new_file:
+            # free on empty tables (older files build them at first use)
+            for kind in LAZY_INDEXES:
+                _ensure_index(kind)
+            db.commit()
         # make cache keys
         get_keys(True)
         return db
@@ -115,6 +342,101 @@ def connect(filename: str = ":memory:", table_name: str = "kudb") -> sqlite3.Con
         raise KudbError("could not initalize database file: " + str(err)) from err
 
 
+def _use_conn_caches(cache_key: str, table_name: str) -> None:
+    """switch CACHE_META / unique_indexes / built_indexes to those of a connection"""
+    global CACHE_META, unique_indexes, built_indexes
+    caches = conn_caches.setdefault((cache_key, table_name), ({}, set(), set()))
+    CACHE_META, unique_indexes, built_indexes = caches
+
+
+def _drop_conn_caches(cache_key: str) -> None:
+    """forget the caches of a connection that was closed or replaced"""
+    for key in [k for k in conn_caches if k[0] == cache_key]:
+        del conn_caches[key]
+
+
+def _set_auto_vacuum(mode: str) -> None:
+    """set `PRAGMA auto_vacuum` if the database is still empty"""
+    assert db is not None
+    if mode.lower() not in ("none", "full", "incremental"):
+        raise KudbError(f"unknown auto_vacuum mode: {mode}")
+    if db.execute("SELECT count(*) FROM sqlite_master").fetchone()[0] == 0:
+        db.execute(f"PRAGMA auto_vacuum={mode.upper()}")
+
+
+def _make_sqls(table_name: str, no_expires: bool = False) -> Dict[str, str]:
+    """render `SQLS_TEMPLATE` (`no_expires`: readonly file made by an older version)"""
+    live, expired = ("1", "0") if no_expires else (SQL_LIVE, SQL_EXPIRED)
+    sqls = {}
+    for key, val in SQLS_TEMPLATE.items():
+        sqls[key] = (
+            val.replace("__TABLE_NAME__", table_name)
+            .replace("__LIVE__", live)
+            .replace("__EXPIRED__", expired)
+        )
+    if no_expires:
+        sqls["keys"] = f"SELECT key, 0 FROM {table_name}"
+        sqls["select"] = f"SELECT value, 0 FROM {table_name} WHERE key=?"
+        sqls["select_info"] = (
+            f"SELECT key_id, key, value, ctime, mtime, 0 FROM {table_name} WHERE key=?"
+        )
+    return sqls
+
+
+def _need_returning(method: str) -> None:
+    """raise KudbError if SQLite is too old for RETURNING (used by `method`)"""
+    if sqlite3.sqlite_version_info < SQLITE_RETURNING_VERSION:
+        raise KudbError(
+            f"`{method}` needs SQLite 3.35 or higher (this is {sqlite3.sqlite_version})."
+        )
+
+
+def _table_exists(table: str) -> bool:
+    """check that `table` exists in the current database"""
+    assert db is not None
+    found = db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?", [table]
+    ).fetchone()
+    return found is not None
+
+
+def _ensure_index(kind: str) -> None:
+    """
+    make the indexes of SQLS[kind] once per connection; files made by older
+    versions lack them, and building them there is a one-time full scan
+    """
+    if kind in built_indexes or db is None or cur_readonly:
+        return
+    with db_lock:
+        for sql in SQLS[kind].split(";"):
+            db.execute(sql)
+    built_indexes.add(kind)
+
+
+def _has_expires_column(conn: sqlite3.Connection, table: str) -> bool:
+    """check that `table` has the `expires_at` column"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    return "expires_at" in columns
+
+
+def _add_expires_column(table: str) -> None:
+    """add `expires_at` column to tables made by older versions"""
+    if db is None:
+        return
+    if not _has_expires_column(db, table):
+        db.execute(f"ALTER TABLE {table} ADD COLUMN expires_at REAL DEFAULT 0")
+        db.commit()
+
+
+def _expires_at(ttl: Optional[float]) -> float:
+    """convert ttl (seconds) to `expires_at` (0 = never expires)"""
+    if ttl is None:
+        return 0
+    if ttl <= 0:
+        raise KudbError("ttl must be a positive number of seconds.")
+    return time.time() + ttl
+
+
 def change_db(filename: str = ":memory:", table_name: str = "kudb") -> None:
     """Change Database"""
     connect(filename, table_name)
@@ -123,13 +445,507 @@ def change_db(filename: str = ":memory:", table_name: str = "kudb") -> None:
 def close() -> None:
     """close database"""
     global db, cur_filename
+    stop_sweeper()
+    stop_compactor()
     if db is not None:
         db.close()
-        del cache_db[cur_filename]
+        for cache_key, conn in list(cache_db.items()):
+            if conn is db:
+                del cache_db[cache_key]
+                _drop_conn_caches(cache_key)
     db = None
     cur_filename = ""
 
 
+def _data_version() -> Optional[int]:
+    """`PRAGMA data_version` of the current connection"""
+    if db is None:
+        return None
+    return int(db.execute("PRAGMA data_version").fetchone()[0])
+
+
+def _sync_cache() -> None:
+    """mark CACHE_KEYS stale (and drop CACHE_META) if another connection has committed"""
+    global cache_version, cache_stale
+    if db is None or cur_readonly or cur_filename == MEMORY_FILE:
+        return  # no cache / no other connection can write
+    version = _data_version()
+    if cache_version == version:
+        return
+    cache_version = version
+    cache_stale = True
+    CACHE_META.clear()
+
+
+def _in_batch() -> bool:
+    """check that the current thread is inside `batch()`"""
+    return batch_depth > 0 and batch_thread == threading.get_ident()
+
+
+def _rollback() -> None:
+    """roll back a failed write unless inside `batch()` (so no lock stays held)"""
+    with db_lock:
+        if db is not None and not _in_batch():
+            db.rollback()
+
+
+def _commit() -> None:
+    """commit unless inside `batch()` (writers call it while holding db_lock)"""
+    with db_lock:
+        if db is not None and not _in_batch():
+            db.commit()
+            if instrumented:
+                _count_commit()
+
+
+@contextmanager
+def batch() -> Iterator[None]:
+    """
+    group writes into one transaction (one commit for the whole block)
+    writes from other threads wait until the block ends
+
+    >>> _ = connect()
+    >>> clear()
+    >>> with batch():
+    ...     for i in range(3):
+    ...         _ = incr('hits')
+    ...     insert_many([1, 2])
+    >>> get_key('hits'), count_doc()
+    (3, 2)
+    """
+    global batch_depth, batch_thread
+    if db is None:
+        raise KudbError("please connect before using `batch` method.")
+    with db_lock:
+        batch_depth += 1
+        batch_thread = threading.get_ident()
+        try:
+            yield
+        except BaseException:
+            batch_depth -= 1
+            if batch_depth == 0:
+                batch_thread = None
+                db.rollback()
+                get_keys(True)
+            raise
+        batch_depth -= 1
+        if batch_depth == 0:
+            batch_thread = None
+        _commit()
+
+
+def backup(
+    dest_path: str,
+    pages_per_step: int = 1024,
+    sleep: float = 0.0,
+    progress: Optional[Callable[[int, int, int], None]] = None,
+    file: Optional[str] = None,
+) -> None:
+    """
+    copy the database to `dest_path` while it stays in use
+    (`pages_per_step` pages at a time, waiting `sleep` seconds between steps;
+    progress(status, remaining, total) is called after every step)
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `backup` method.")
+    try:
+        dest = sqlite3.connect(dest_path)
+        try:
+            db.backup(dest, pages=pages_per_step, progress=progress, sleep=sleep)
+        finally:
+            dest.close()
+    except Exception as err:
+        raise KudbError("could not backup database: " + str(err)) from err
+
+
+def snapshot_to_memory(pages_per_step: int = -1) -> sqlite3.Connection:
+    """
+    copy the database into a new in-memory connection (for `restore_from`)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> set_key('name', 'Taro')
+    >>> snap = snapshot_to_memory()
+    >>> set_key('name', 'Jiro')
+    >>> restore_from(snap)
+    >>> get_key('name')
+    'Taro'
+    """
+    if db is None:
+        raise KudbError("please connect before using `snapshot_to_memory` method.")
+    try:
+        snap = sqlite3.connect(MEMORY_FILE, check_same_thread=False)
+        db.backup(snap, pages=pages_per_step)
+        return snap
+    except Exception as err:
+        raise KudbError("could not snapshot database: " + str(err)) from err
+
+
+def restore_from(
+    source: Union[str, sqlite3.Connection],
+    pages_per_step: int = -1,
+    progress: Optional[Callable[[int, int, int], None]] = None,
+) -> None:
+    """replace the current database with a backup file or a snapshot connection"""
+    if db is None:
+        raise KudbError("please connect before using `restore_from` method.")
+    if _in_batch():
+        raise KudbError("`restore_from` can not be used in `batch()`.")
+    try:
+        if isinstance(source, str):
+            # mode=ro: a mistyped path must fail, not restore an empty new file
+            uri = Path(source).resolve().as_uri() + "?mode=ro"
+            src = sqlite3.connect(uri, uri=True)
+        else:
+            src = source
+        try:
+            tables = {
+                row[0]
+                for row in src.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table'"
+                )
+            }
+            for table in (cur_tablename, _doc_table()):
+                if table not in tables:
+                    raise KudbError(f"the source has no `{table}` table.")
+            with db_lock:
+                src.backup(db, pages=pages_per_step, progress=progress)
+        finally:
+            if isinstance(source, str):
+                src.close()
+        CACHE_META.clear()
+        unique_indexes.clear()
+        get_keys(True)
+    except KudbError:
+        raise
+    except Exception as err:
+        raise KudbError("could not restore database: " + str(err)) from err
+
+
+# --- instrumentation ---
+# latency histogram buckets (seconds)
+METRICS_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)  # fmt: skip
+METRICS_FIELDS = (
+    "rows_scanned",
+    "rows_returned",
+    "bytes_serialized",
+    "commits",
+    "statements",
+)
+
+
+class Metrics:
+    """per-function counters collected by `enable_metrics`"""
+
+    def __init__(
+        self,
+        on_call: Optional[Callable[[str, float, Dict[str, Any]], None]] = None,
+        trace: Optional[Callable[[str], None]] = None,
+    ):
+        self.on_call = on_call
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.functions: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, seconds: float, stat: Dict[str, Any]) -> None:
+        """add one call"""
+        with self.lock:
+            f = self.functions.get(name)
+            if f is None:
+                f = {"calls": 0, "errors": 0, "seconds": 0.0}
+                f["buckets"] = [0] * (len(METRICS_BUCKETS) + 1)
+                for key in METRICS_FIELDS:
+                    f[key] = 0
+                self.functions[name] = f
+            f["calls"] += 1
+            f["errors"] += stat["error"]
+            f["seconds"] += seconds
+            i = 0
+            while i < len(METRICS_BUCKETS) and seconds > METRICS_BUCKETS[i]:
+                i += 1
+            f["buckets"][i] += 1
+            for key in METRICS_FIELDS:
+                f[key] += stat[key]
+        if self.on_call is not None:
+            self.on_call(name, seconds, stat)
+
+    def to_prometheus(self, prefix: str = "kudb") -> str:
+        """export in the Prometheus text format"""
+        lines = []
+        with self.lock:
+            items = sorted(self.functions.items())
+            counters = [("calls", "calls"), ("errors", "errors")]
+            counters += [(key, key) for key in METRICS_FIELDS]
+            for key, name in counters:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for func, f in items:
+                    lines.append(f'{prefix}_{name}_total{{function="{func}"}} {f[key]}')
+            lines.append(f"# TYPE {prefix}_call_duration_seconds histogram")
+            for func, f in items:
+                total = 0
+                for le, n in zip(METRICS_BUCKETS + ("+Inf",), f["buckets"]):
+                    total += n
+                    lines.append(
+                        f"{prefix}_call_duration_seconds_bucket"
+                        f'{{function="{func}",le="{le}"}} {total}'
+                    )
+                label = f'{{function="{func}"}}'
+                lines.append(
+                    f"{prefix}_call_duration_seconds_sum{label} {f['seconds']}"
+                )
+                lines.append(
+                    f"{prefix}_call_duration_seconds_count{label} {f['calls']}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+# public functions that are not wrapped by `_instrument`
+NOT_INSTRUMENTED = (
+    "batch",
+    "enable_metrics",
+    "disable_metrics",
+    "get_metrics",
+    "metrics_text",
+    "enable_slow_log",
+    "disable_slow_log",
+)
+metrics: Optional[Metrics] = None
+metrics_local = threading.local()
+# seconds, None = slow query log is disabled
+slow_log_threshold: Optional[float] = None
+slow_log_callback: Optional[Callable[[Dict[str, Any]], None]] = None
+# True while metrics or the slow query log is enabled
+instrumented: bool = False
+logger = logging.getLogger("kudb")
+logger.addHandler(logging.NullHandler())
+
+
+def _install_trace() -> None:
+    """(un)install the SQL trace callback on every open connection"""
+    global instrumented
+    instrumented = metrics is not None or slow_log_threshold is not None
+    for conn in cache_db.values():
+        conn.set_trace_callback(_trace_statement if instrumented else None)
+
+
+def enable_metrics(
+    on_call: Optional[Callable[[str, float, Dict[str, Any]], None]] = None,
+    trace: Optional[Callable[[str], None]] = None,
+) -> Metrics:
+    """
+    start collecting per-function metrics
+    on_call(name, seconds, stat) is called after each public function call
+    trace(sql) receives every SQL statement (sqlite3 set_trace_callback)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> m = enable_metrics()
+    >>> insert_many([{'name': 'A'}, {'name': 'B'}])
+    >>> len(find(lambda v: v['name'] == 'B'))
+    1
+    >>> f = m.functions['find']
+    >>> f['calls'], f['rows_scanned'], f['rows_returned']
+    (1, 2, 1)
+    >>> m.functions['insert_many']['commits']
+    1
+    >>> 'kudb_calls_total{function="find"} 1' in metrics_text()
+    True
+    >>> disable_metrics()
+    """
+    global metrics
+    metrics = Metrics(on_call=on_call, trace=trace)
+    _install_trace()
+    return metrics
+
+
+def disable_metrics() -> None:
+    """stop collecting metrics (the wrappers cost only a global lookup)"""
+    global metrics
+    metrics = None
+    _install_trace()
+
+
+def get_metrics() -> Optional[Metrics]:
+    """current Metrics object (None when disabled)"""
+    return metrics
+
+
+def metrics_text() -> str:
+    """metrics in the Prometheus text format ('' when disabled)"""
+    if metrics is None:
+        return ""
+    return metrics.to_prometheus()
+
+
+def enable_slow_log(
+    threshold: float = 0.1,
+    callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> None:
+    """
+    log public function calls slower than threshold (seconds) with their
+    parameters, SQL, rows examined and EXPLAIN QUERY PLAN
+    entries go to the `kudb` logger (WARNING) and to callback(entry) if given
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'name': 'A', 'age': 30}, {'name': 'B', 'age': 20}])
+    >>> entries = []
+    >>> enable_slow_log(threshold=0, callback=entries.append)
+    >>> _ = get_by_tag('A')
+    >>> _ = find(keys={'age': 20})
+    >>> disable_slow_log()
+    >>> entries[0]['function'], entries[0]['full_scan']
+    ('get_by_tag', False)
+    >>> entries[1]['function'], entries[1]['full_scan'], entries[1]['rows_scanned']
+    ('find', True, 2)
+    """
+    global slow_log_threshold, slow_log_callback
+    slow_log_threshold = threshold
+    slow_log_callback = callback
+    _install_trace()
+
+
+def disable_slow_log() -> None:
+    """stop the slow query log"""
+    global slow_log_threshold, slow_log_callback
+    slow_log_threshold = None
+    slow_log_callback = None
+    _install_trace()
+
+
+def _explain(sql: str) -> List[str]:
+    """EXPLAIN QUERY PLAN details of a traced statement"""
+    if db is None:
+        return []
+    try:
+        return [row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + sql)]
+    except sqlite3.Error:
+        return []
+
+
+def _log_slow(
+    name: str, args: Any, kwargs: Dict[str, Any], seconds: float, stat: Dict[str, Any]
+) -> None:
+    """write one slow query log entry"""
+    doc_table = _doc_table()
+    scan_re = re.compile(rf"SCAN (TABLE )?{re.escape(doc_table)}\b")
+    plans = []
+    full_scan = False
+    for sql in stat.get("sql", []):
+        head = sql.lstrip()[:6].upper()
+        if head not in ("SELECT", "UPDATE", "DELETE", "INSERT"):
+            continue
+        plan = _explain(sql)
+        # a SCAN of the doc table without an index reads every document
+        # (SQLite before 3.36 words it "SCAN TABLE <name>")
+        scan = any(scan_re.match(p) and "INDEX" not in p for p in plan)
+        full_scan = full_scan or scan
+        plans.append({"sql": sql, "plan": plan, "full_scan": scan})
+    entry = {
+        "function": name,
+        "args": [repr(a)[:200] for a in args],
+        "kwargs": {k: repr(v)[:200] for k, v in kwargs.items()},
+        "seconds": seconds,
+        "rows_scanned": stat["rows_scanned"],
+        "rows_returned": stat["rows_returned"],
+        "statements": plans,
+        "full_scan": full_scan,
+    }
+    if full_scan:
+        entry["hint"] = (
+            f"full scan of {doc_table}: filter by tag (indexed) "
+            "or move the condition into SQL"
+        )
+    logger.warning(
+        "slow %s %.3fs rows=%s full_scan=%s",
+        name,
+        seconds,
+        stat["rows_scanned"],
+        full_scan,
+        extra={"kudb_slow": entry},
+    )
+    if slow_log_callback is not None:
+        slow_log_callback(entry)
+
+
+def _current_stat() -> Optional[Dict[str, Any]]:
+    return getattr(metrics_local, "stat", None)
+
+
+def _trace_statement(sql: str) -> None:
+    stat = _current_stat()
+    if stat is not None:
+        stat["statements"] += 1
+        if slow_log_threshold is not None:
+            stat["sql"].append(sql)
+    m = metrics
+    if m is not None and m.trace is not None:
+        m.trace(sql)
+
+
+def _count_commit() -> None:
+    stat = _current_stat()
+    if stat is not None:
+        stat["commits"] += 1
+
+
+def _count_rows_scanned(n: int) -> None:
+    stat = _current_stat()
+    if stat is not None:
+        stat["rows_scanned"] = (stat["rows_scanned"] or 0) + n
+
+
+def _dumps(value: Any) -> str:
+    """json.dumps for stored values (counts serialized bytes)"""
+    text = json.dumps(value, ensure_ascii=False)
+    if instrumented:
+        stat = _current_stat()
+        if stat is not None:
+            stat["bytes_serialized"] += len(text.encode("utf-8"))
+    return text
+
+
+def _instrument(func: Callable[..., Any]) -> Callable[..., Any]:
+    """wrap a public function to record metrics (nested calls count for the outer one)"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not instrumented or getattr(metrics_local, "stat", None) is not None:
+            return func(*args, **kwargs)
+        stat: Dict[str, Any] = {key: 0 for key in METRICS_FIELDS}
+        stat["rows_scanned"] = None
+        stat["error"] = 0
+        stat["sql"] = []
+        metrics_local.stat = stat
+        t = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            if isinstance(result, list):
+                stat["rows_returned"] = len(result)
+            elif result is not None:
+                stat["rows_returned"] = 1
+            return result
+        except Exception:
+            stat["error"] = 1
+            raise
+        finally:
+            seconds = time.perf_counter() - t
+            metrics_local.stat = None
+            if stat["rows_scanned"] is None:
+                stat["rows_scanned"] = stat["rows_returned"]
+            m = metrics
+            if m is not None:
+                m.record(name, seconds, stat)
+            threshold = slow_log_threshold
+            if threshold is not None and seconds >= threshold:
+                _log_slow(name, args, kwargs, seconds, stat)
+
+    return wrapper
+
+
 def get_key(key: str, default: Any = "", file: Optional[str] = None) -> Any:
     """
     get data by key
@@ -153,13 +969,16 @@ def get_key(key: str, default: Any = "", file: Optional[str] = None) -> Any:
         connect(file)
     if db is None:
         raise KudbError("please connect before using `get` method.")
-    if key not in CACHE_KEYS:
+    _sync_cache()
+    if key not in CACHE_KEYS and not (cur_readonly or cache_stale):
         return default
     cur = db.cursor()
     try:
         sql = SQLS["select"]
         cur.execute(sql, [key])
         values = cur.fetchone()
+        if not cur_readonly:
+            _cache_key(key, values)
         if values is None:
             return default
         return json.loads(values[0])
@@ -172,17 +991,30 @@ def get_key(key: str, default: Any = "", file: Optional[str] = None) -> Any:
 
 
 def get_info(key: str, default: str = "") -> Any:
-    """get data and info"""
+    """
+    get data and info: (key_id, key, value, ctime, mtime)
+
+    >>> _ = connect()
+    >>> clear()
+    >>> set_key('a', 1, ttl=60)
+    >>> get_info('a')[1:3]
+    ('a', '1')
+    >>> len(get_info('a'))
+    5
+    """
     cur: Optional[sqlite3.Cursor] = None
     if db is None:
         raise KudbError("please connect before using `get` method.")
-    if key not in CACHE_KEYS:
+    _sync_cache()
+    if key not in CACHE_KEYS and not (cur_readonly or cache_stale):
         return default
     try:
         cur = db.cursor()
         cur.execute(SQLS["select_info"], [key])
         values = cur.fetchone()
-        return values
+        if not cur_readonly:
+            _cache_key(key, None if values is None else (None, values[5]))
+        return None if values is None else values[:5]
     except Exception as err:
         raise KudbError("could not read database: " + str(err)) from err
     finally:
@@ -190,7 +1022,9 @@ def get_info(key: str, default: str = "") -> Any:
             cur.close()
 
 
-def set_key(key: str, value: Any, file: Optional[str] = None) -> None:
+def set_key(
+    key: str, value: Any, file: Optional[str] = None, ttl: Optional[float] = None
+) -> None:
     """
     set data by key
     >>> set_key('hoge', 30, file=':memory:') # insert
@@ -202,23 +1036,32 @@ def set_key(key: str, value: Any, file: Optional[str] = None) -> None:
     >>> set_key('hoge', 35) # update
     >>> get_key('hoge')
     35
+
+    set data with ttl (seconds)
+    >>> set_key('session', 'abc', ttl=0.01)
+    >>> get_key('session')
+    'abc'
+    >>> time.sleep(0.02)
+    >>> get_key('session', 'expired')
+    'expired'
     """
     if file is not None:
         connect(file)
     if db is None:
         raise KudbError("please connect before using `set_key` method.")
     try:
-        value_json = json.dumps(value, ensure_ascii=False)
-        cur = db.cursor()
-        if key in CACHE_KEYS:
-            cur.execute(SQLS["update"], [value_json, int(time.time()), key])
-        else:
-            cur.execute(
-                SQLS["insert"], [key, value_json, int(time.time()), int(time.time())]
-            )
-            CACHE_KEYS[key] = True
-        cur.close()
-        db.commit()
+        with db_lock:
+            value_json = _dumps(value)
+            expires_at = _expires_at(ttl)
+            t = int(time.time())
+            _sync_cache()
+            cur = db.cursor()
+            # upsert: correct even if another process added or deleted the key
+            cur.execute(SQLS["upsert"], [key, value_json, t, t, expires_at])
+            CACHE_KEYS[key] = expires_at
+            CACHE_META.pop(key, None)
+            cur.close()
+            _commit()
     except Exception as err:
         raise KudbError("database could not write key: " + str(err)) from err
 
@@ -228,12 +1071,15 @@ def delete_key(key: str) -> None:
     if db is None:
         raise KudbError("please connect before using `delete_key` method.")
     try:
-        cur = db.cursor()
-        if key in CACHE_KEYS:
-            cur.execute(SQLS["delete"], [key])
-            del CACHE_KEYS[key]
-        cur.close()
-        db.commit()
+        with db_lock:
+            _sync_cache()
+            cur = db.cursor()
+            if key in CACHE_KEYS or cache_stale:
+                cur.execute(SQLS["delete"], [key])
+                CACHE_KEYS.pop(key, None)
+            CACHE_META.pop(key, None)
+            cur.close()
+            _commit()
     except Exception as err:
         raise KudbError("database could not delete key: " + str(err)) from err
 
@@ -267,33 +1113,128 @@ def set_keys_from_dict(data: Dict[str, Any], file: Optional[str] = None) -> None
         return
 
     try:
-        cur = db.cursor()
-        current_time = int(time.time())
+        with db_lock:
+            cur = db.cursor()
+            current_time = int(time.time())
+            _sync_cache()
 
-        # Separate keys for insert and update
-        insert_data = []
-        update_data = []
+            rows = []
+            for key, value in data.items():
+                rows.append([key, _dumps(value), current_time, current_time, 0])
+                CACHE_KEYS[key] = 0
+                CACHE_META.pop(key, None)
 
-        for key, value in data.items():
-            value_json = json.dumps(value, ensure_ascii=False)
-            if key in CACHE_KEYS:
-                update_data.append([value_json, current_time, key])
-            else:
-                insert_data.append([key, value_json, current_time, current_time])
-                CACHE_KEYS[key] = True
+            # Batch upsert (one statement for new and existing keys)
+            cur.executemany(SQLS["upsert"], rows)
+            cur.close()
+            _commit()
+    except Exception as err:
+        raise KudbError("database could not write keys: " + str(err)) from err
 
-        # Batch insert new keys
-        if insert_data:
-            cur.executemany(SQLS["insert"], insert_data)
 
-        # Batch update existing keys
-        if update_data:
-            cur.executemany(SQLS["update"], update_data)
+def incr(
+    key: str, n: Any = 1, file: Optional[str] = None, ttl: Optional[float] = None
+) -> Any:
+    """
+    atomically add n to a numeric key and return the new value
+    (a missing or expired key starts from 0, and gets ttl if given)
+
+    >>> _ = connect()
+    >>> clear()
+    >>> incr('count')
+    1
+    >>> incr('count', 10)
+    11
+    >>> decr('count')
+    10
+    >>> incr('rate', 0.5)
+    0.5
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `incr` method.")
+    _need_returning("incr")
+    if isinstance(n, bool) or not isinstance(n, (int, float)):
+        raise KudbError("n must be a number in `incr` method.")
+    with db_lock:
+        try:
+            t = int(time.time())
+            cur = db.cursor()
+            cur.execute(SQLS["incr"], [key, json.dumps(n), t, t, _expires_at(ttl), n])
+            row = cur.fetchone()
+            cur.close()
+        except Exception as err:
+            _rollback()
+            raise KudbError(
+                f"`incr({key})` could not write database: {str(err)}"
+            ) from err
+        if row is None:
+            _rollback()
+            found = db.execute(SQLS["select"], [key]).fetchone()
+            if found is not None and isinstance(json.loads(found[0]), (int, float)):
+                raise KudbError(f"`incr({key})` the result is out of range.")
+            raise KudbError(f"`incr({key})` the value is not a number.")
+        CACHE_KEYS[key] = row[1]
+        CACHE_META.pop(key, None)
+        _commit()
+    return json.loads(row[0])
 
-        cur.close()
-        db.commit()
-    except Exception as err:
-        raise KudbError("database could not write keys: " + str(err)) from err
+
+def decr(
+    key: str, n: Any = 1, file: Optional[str] = None, ttl: Optional[float] = None
+) -> Any:
+    """atomically subtract n from a numeric key and return the new value"""
+    if isinstance(n, bool) or not isinstance(n, (int, float)):
+        raise KudbError("n must be a number in `decr` method.")
+    return incr(key, -n, file=file, ttl=ttl)
+
+
+def compare_and_set(
+    key: str, expected: Any, new_value: Any, file: Optional[str] = None
+) -> bool:
+    """
+    set new_value only if the current value equals expected
+    (expected=None also matches a missing key)
+
+    >>> _ = connect()
+    >>> clear()
+    >>> compare_and_set('owner', None, 'Taro')
+    True
+    >>> compare_and_set('owner', None, 'Jiro')
+    False
+    >>> compare_and_set('owner', 'Taro', 'Jiro')
+    True
+    >>> get_key('owner')
+    'Jiro'
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `compare_and_set` method.")
+    _need_returning("compare_and_set")
+    with db_lock:
+        try:
+            t = int(time.time())
+            value_json = _dumps(new_value)
+            cur = db.cursor()
+            if expected is None:
+                cur.execute(SQLS["cas_absent"], [key, value_json, t, t])
+            else:
+                expected_json = json.dumps(expected, ensure_ascii=False)
+                cur.execute(SQLS["cas"], [value_json, t, key, expected_json])
+            row = cur.fetchone()
+            cur.close()
+        except Exception as err:
+            _rollback()
+            raise KudbError(
+                f"`compare_and_set({key})` could not write database: {str(err)}"
+            ) from err
+        if row is not None:
+            CACHE_KEYS[key] = row[0]
+            CACHE_META.pop(key, None)
+        _commit()
+    return row is not None
 
 
 def get_keys(clear_cache: bool = True) -> Any:
@@ -306,56 +1247,202 @@ def get_keys(clear_cache: bool = True) -> Any:
     >>> sorted(list(get_keys()))
     ['Ako', 'Iko']
     """
-    global CACHE_KEYS
+    global CACHE_KEYS, cache_version, cache_stale, cache_key_id
     if db is None:
         return []
-    # Use Cache?
-    if clear_cache or len(CACHE_KEYS) == 0:
-        cur = db.cursor()
-        cur.execute(SQLS["keys"])
+    if cur_readonly:
+        rows = db.execute(SQLS["keys"]).fetchall()
+        CACHE_KEYS = {key: exp for key, exp in rows}
+    elif clear_cache or len(CACHE_KEYS) == 0:
+        cache_version = _data_version()
+        cache_stale = False
         CACHE_KEYS = {}
-        for i in cur.fetchall():
-            CACHE_KEYS[i[0]] = True
-    return CACHE_KEYS.keys()
+        CACHE_META.clear()
+        cache_key_id = 0
+        _load_keys()
+    else:
+        _sync_cache()
+        if cache_stale:
+            _load_keys()  # keys added by other connections
+    # skip expired keys
+    now = time.time()
+    return [k for k, exp in CACHE_KEYS.items() if exp == 0 or exp > now]
 
 
-def kvs_json() -> str:
-    """dump key-value items to json"""
-    obj = {}
-    for key in get_keys():
-        obj[key] = get_key(key)
-    return json.dumps(obj, ensure_ascii=False)
+def _load_keys() -> None:
+    """add the keys newer than `cache_key_id` to CACHE_KEYS"""
+    global cache_key_id
+    assert db is not None
+    for key, exp, key_id in db.execute(SQLS["keys_after"], [cache_key_id]):
+        CACHE_KEYS[key] = exp
+        cache_key_id = max(cache_key_id, key_id)
 
 
-def clear_keys() -> None:
-    """clear all keys"""
-    global CACHE_KEYS
-    if db is None:
-        raise KudbError("please connect before using `clear_keys` method.")
-    try:
-        cur = db.cursor()
-        cur.execute(SQLS["clear"])
-        CACHE_KEYS = {}
-        cur.close()
-        db.commit()
-    except Exception as err:
-        raise KudbError("could not read database: " + str(err)) from err
+def _cache_key(key: str, row: Optional[Tuple[Any, float]]) -> None:
+    """update one CACHE_KEYS entry from (value, expires_at) read from the file"""
+    if row is None:
+        CACHE_KEYS.pop(key, None)
+    else:
+        CACHE_KEYS[key] = row[1]
 
 
-def count_doc(file: Optional[str] = None) -> int:
+def _key_range(
+    prefix: Optional[str],
+    start: Optional[str],
+    end: Optional[str],
+    after: Optional[str],
+) -> Tuple[str, List[Any]]:
     """
-    count doc
+    conditions on the `key` column (an index range on the unique key)
 
-    >>> clear(file=MEMORY_FILE)
-    >>> insert_many([{"name": "A"},{"name": "B"},{"name": "C"}])
-    >>> count_doc()
-    3
+    >>> _key_range("user:", None, None, "user:1")
+    (' AND key >= ? AND key < ? AND key > ?', ['user:', 'user;', 'user:1'])
     """
-    if file is not None:
-        connect(file)
-    if db is None:
-        raise KudbError("please connect before using `count_doc` method.")
-    try:
+    where = ""
+    params: List[Any] = []
+    if prefix:
+        where += " AND key >= ?"
+        params.append(prefix)
+        # the smallest string greater than every string with this prefix
+        upper = prefix
+        while upper and upper[-1] == chr(0x10FFFF):
+            upper = upper[:-1]
+        if upper:
+            where += " AND key < ?"
+            params.append(upper[:-1] + chr(ord(upper[-1]) + 1))
+    if start is not None:
+        where += " AND key >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND key < ?"
+        params.append(end)
+    if after is not None:
+        where += " AND key > ?"
+        params.append(after)
+    return where, params
+
+
+def scan(
+    prefix: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    file: Optional[str] = None,
+) -> List[str]:
+    """
+    get keys in key order: by prefix and/or in [start, end)
+    pass the last key as `after` to get the next page
+
+    >>> clear(file=MEMORY_FILE)
+    >>> set_keys_from_dict({'user:1:name': 'A', 'user:2:name': 'B', 'cfg:x': 1})
+    >>> scan(prefix='user:')
+    ['user:1:name', 'user:2:name']
+    >>> scan(start='a', end='u')
+    ['cfg:x']
+    >>> scan(limit=1, after='cfg:x')
+    ['user:1:name']
+    """
+    return [key for key, _ in _scan_keys(prefix, start, end, limit, after, file, False)]
+
+
+def items(
+    prefix: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    file: Optional[str] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    stream (key, value) in key order (same arguments as `scan`)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> set_keys_from_dict({'user:1:name': 'A', 'user:2:name': 'B', 'cfg:x': 1})
+    >>> list(items(prefix='user:'))
+    [('user:1:name', 'A'), ('user:2:name', 'B')]
+    """
+    return _scan_keys(prefix, start, end, limit, after, file, True)
+
+
+def _scan_keys(
+    prefix: Optional[str],
+    start: Optional[str],
+    end: Optional[str],
+    limit: Optional[int],
+    after: Optional[str],
+    file: Optional[str],
+    with_value: bool,
+) -> Iterator[Tuple[str, Any]]:
+    """run a key range query for `scan` / `items`"""
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `scan` method.")
+    where, params = _key_range(prefix, start, end, after)
+    columns = "key, value" if with_value else "key, NULL"
+    sql = f"SELECT {columns} FROM {cur_tablename} WHERE {SQLS['live']}{where}"
+    sql += " ORDER BY key LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    try:
+        cur = db.cursor()
+        cur.execute(sql, params)
+    except Exception as err:
+        raise KudbError("could not scan keys: " + str(err)) from err
+
+    def rows() -> Iterator[Tuple[str, Any]]:
+        try:
+            while True:
+                chunk = cur.fetchmany(1000)
+                if not chunk:
+                    break
+                for key, value in chunk:
+                    yield key, (json.loads(value) if with_value else None)
+        finally:
+            cur.close()
+
+    return rows()
+
+
+def kvs_json() -> str:
+    """dump key-value items to json"""
+    obj = {}
+    for key in get_keys():
+        obj[key] = get_key(key)
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def clear_keys() -> None:
+    """clear all keys"""
+    global CACHE_KEYS
+    if db is None:
+        raise KudbError("please connect before using `clear_keys` method.")
+    try:
+        with db_lock:
+            cur = db.cursor()
+            cur.execute(SQLS["clear"])
+            CACHE_KEYS = {}
+            CACHE_META.clear()
+            cur.close()
+            _commit()
+    except Exception as err:
+        raise KudbError("could not read database: " + str(err)) from err
+
+
+def count_doc(file: Optional[str] = None) -> int:
+    """
+    count doc
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{"name": "A"},{"name": "B"},{"name": "C"}])
+    >>> count_doc()
+    3
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `count_doc` method.")
+    try:
         cur = db.cursor()
         cur.execute(SQLS["count_doc"])
         val = cur.fetchone()
@@ -369,6 +1456,10 @@ def get_all(
     order_asc: bool = True,
     from_id: Optional[int] = None,
     file: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    lazy: bool = False,
+    order_by: Union[str, List[Any], None] = None,
+    desc: bool = False,
 ) -> List[Any]:
     """
     get all doc
@@ -384,6 +1475,25 @@ def get_all(
     ['D', 'C', 'B', 'A']
     >>> [a['name'] for a in get_all(limit=2,order_asc=False)]
     ['D', 'C']
+
+    select only some fields (in SQL; missing fields are None)
+    >>> clear()
+    >>> insert_many([{'name': 'A', 'price': 10, 'payload': 'x' * 1000}])
+    >>> get_all(fields=['name', 'price'])
+    [{'name': 'A', 'price': 10, 'id': 1}]
+
+    lazy rows (`LazyDoc`) decode the JSON text on access
+    >>> get_all(lazy=True)[0]['price']
+    10
+
+    order by fields (in SQL): 'price', ['city', 'age'] or [('city', 'asc'), ('age', 'desc')]
+    (`desc` is the order of plain field names; `order_asc` and `from_id` still filter by id)
+    >>> clear()
+    >>> insert_many([{'name': 'A', 'price': 30}, {'name': 'B', 'price': 10}, {'name': 'C', 'price': 20}])
+    >>> [a['name'] for a in get_all(order_by='price')]
+    ['B', 'C', 'A']
+    >>> [a['name'] for a in get_all(order_by='price', desc=True, limit=2)]
+    ['A', 'C']
     """
     # check parameters
     if file is not None:
@@ -391,7 +1501,7 @@ def get_all(
     if db is None:
         raise KudbError("please connect before using `get_all` method.")
     if limit is None:
-        limit = count_doc()
+        limit = -1  # no limit (SQLite), avoids counting every doc first
     sql = SQLS["select_doc_asc"]
     if order_asc:
         if from_id is None:
@@ -400,19 +1510,24 @@ def get_all(
         sql = SQLS["select_doc_desc"]
         if from_id is None:
             from_id = SQLITE_MAX_INT
+    if order_by is not None:
+        sql = _order_by(sql, order_by, desc)
     # select doc
     result = []
     cur = db.cursor()
+    sql = _project(_lazy_sql(sql, lazy), fields)
     for row in cur.execute(sql, [from_id, limit]):
-        values = json.loads(row[0])
-        if isinstance(values, dict):
-            values["id"] = row[1]
-        result.append(values)
+        result.append(_make_row(row, lazy))
     cur.close()
     return result
 
 
-def recent(limit: int = 100, offset: int = 0, order_asc: bool = True) -> List[Any]:
+def recent(
+    limit: int = 100,
+    offset: int = 0,
+    order_asc: bool = True,
+    fields: Optional[List[str]] = None,
+) -> List[Any]:
     """
     get recent docs
     >>> clear(file=MEMORY_FILE)
@@ -432,7 +1547,7 @@ def recent(limit: int = 100, offset: int = 0, order_asc: bool = True) -> List[An
         raise KudbError("please connect before using `recent` method.")
     cur = db.cursor()
     result = []
-    for row in cur.execute(SQLS["recent_doc"], [limit, offset]):
+    for row in cur.execute(_project(SQLS["recent_doc"], fields), [limit, offset]):
         values = json.loads(row[0])
         if isinstance(values, dict):
             values["id"] = row[1]
@@ -470,8 +1585,43 @@ def get_by_id(id: int, def_value: Any = None, file: Optional[str] = None) -> Any
     return values
 
 
+def get_by_ids(
+    ids: List[int],
+    missing: Any = None,
+    file: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    lazy: bool = False,
+) -> List[Any]:
+    """
+    get many docs by id in one query, in the order of ids (`missing` for unknown ids)
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many( [{'name': 'A'}, {'name': 'B'}, {'name': 'C'}] )
+    >>> [d['name'] if d else d for d in get_by_ids([3, 1, 9, 3])]
+    ['C', 'A', None, 'C']
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `get_by_ids` method.")
+    ids = [int(i) for i in ids]
+    if len(ids) == 0:
+        return []
+    # the ids are passed as one JSON array, so any number of ids is one statement
+    sql = _project(_lazy_sql(SQLS["get_doc_by_ids"], lazy), fields)
+    found = {}
+    cur = db.cursor()
+    for row in cur.execute(sql, [json.dumps(ids)]):
+        found[row[1]] = row
+    cur.close()
+    # decode each doc once per requested position (ids may repeat)
+    return [_make_row(found[i], lazy) if i in found else missing for i in ids]
+
+
 def get_by_tag(
-    tag: str, limit: Optional[int] = None, file: Optional[str] = None
+    tag: str,
+    limit: Optional[int] = None,
+    file: Optional[str] = None,
+    fields: Optional[List[str]] = None,
 ) -> List[Any]:
     """
     get doc by tag
@@ -479,16 +1629,19 @@ def get_by_tag(
     >>> insert_many( [{'name': 'A'}, {'name': 'B'}, {'name': 'C'}], tag_name='name' )
     >>> get_by_tag('B')[0]['name']
     'B'
+    >>> get_by_tag('B', fields=['name'])
+    [{'name': 'B', 'id': 2}]
     """
     if file is not None:
         connect(file)
     if db is None:
         raise KudbError("please connect before using `get` method.")
     if limit is None:
-        limit = count_doc()
+        limit = -1  # no limit (SQLite), avoids counting every doc first
     result = []
     cur = db.cursor()
-    for values, id in cur.execute(SQLS["get_doc_by_tag"], [tag, limit]):
+    sql = _project(SQLS["get_doc_by_tag"], fields)
+    for values, id in cur.execute(sql, [tag, limit]):
         values = json.loads(values)
         if isinstance(values, dict):
             values["id"] = id
@@ -552,6 +1705,7 @@ def insert(
     file: Optional[str] = None,
     tag_name: Optional[str] = None,
     tag: Optional[str] = None,
+    ttl: Optional[float] = None,
 ) -> Optional[int]:
     """
     insert doc
@@ -569,42 +1723,47 @@ def insert(
     1
     >>> get_by_tag("banana")[0]['price']
     30
+
+    insert doc with ttl (seconds)
+    >>> clear()
+    >>> insert({'name':'cache'}, ttl=0.01)
+    1
+    >>> time.sleep(0.02)
+    >>> get_by_id(1) is None
+    True
     """
     if file is not None:
         connect(file)
     if db is None:
         raise KudbError("please connect before using `insert` method.")
     try:
-        lastid = None
-        cur = db.cursor()
-        # check tag
-        if tag is None:
-            if tag_name is None:
-                tag_name = get_tag_name()
-            if isinstance(value, dict):
-                if tag_name in value:
-                    tag = value[tag_name]
-        # auto detect tag_name
-        if tag is None:
-            if isinstance(value, dict):
-                tag_name = list(value.keys())[0]
-                set_tag_name(tag_name)
-                tag = str(value[tag_name])
-            else:
-                tag = ""
-        cur.execute(
-            SQLS["insert_doc"],
-            [
-                json.dumps(value, ensure_ascii=False),
-                tag,
-                int(time.time()),
-                int(time.time()),
-            ],
-        )
-        lastid = cur.lastrowid
-        cur.close()
-        db.commit()
-        return lastid
+        with db_lock:
+            lastid = None
+            cur = db.cursor()
+            # check tag
+            if tag is None:
+                if tag_name is None:
+                    tag_name = get_tag_name()
+                if isinstance(value, dict):
+                    if tag_name in value:
+                        tag = value[tag_name]
+            # auto detect tag_name
+            if tag is None:
+                if isinstance(value, dict):
+                    tag_name = list(value.keys())[0]
+                    set_tag_name(tag_name)
+                    tag = str(value[tag_name])
+                else:
+                    tag = ""
+            t = int(time.time())
+            cur.execute(
+                SQLS["insert_doc"],
+                [_dumps(value), tag, t, t, _expires_at(ttl)],
+            )
+            lastid = cur.lastrowid
+            cur.close()
+            _commit()
+            return lastid
     except Exception as err:
         raise KudbError("database insert error:" + str(err)) from err
 
@@ -614,6 +1773,7 @@ def insert_many(
     file: Optional[str] = None,
     tag_name: Optional[str] = None,
     tag: Optional[str] = None,
+    ttl: Optional[float] = None,
 ) -> None:
     """
     insert many doc
@@ -634,6 +1794,7 @@ def insert_many(
         raise KudbError("please set the list type arguments to `insert_many` method.")
     # make many values
     t = int(time.time())
+    expires_at = _expires_at(ttl)
     # check tag
     if tag is None:
         if tag_name is None:
@@ -649,17 +1810,174 @@ def insert_many(
         elif isinstance(val, dict):
             if tag_name in val:
                 tag_value = val[tag_name]
-        rows.append([json.dumps(val, ensure_ascii=False), tag_value, t, t])
+        rows.append([_dumps(val), tag_value, t, t, expires_at])
     # insert
     try:
-        cur = db.cursor()
-        cur.executemany(SQLS["insert_doc"], rows)
-        cur.close()
-        db.commit()
+        with db_lock:
+            cur = db.cursor()
+            cur.executemany(SQLS["insert_doc"], rows)
+            cur.close()
+            _commit()
     except Exception as err:
         raise KudbError("database insert error:" + str(err)) from err
 
 
+def _unique_index_name(on: Optional[str]) -> str:
+    """name of the unique index on the tag (or the `on` field) used by `upsert`"""
+    if on is None:
+        return _doc_table() + "_utag"
+    return _doc_table() + "_uniq_" + re.sub(r"\W", "_", on)
+
+
+def _unique_target(on: Optional[str]) -> str:
+    """conflict target (indexed expression) of the unique index on the tag / `on`"""
+    if on is None:
+        return "(tag) WHERE tag <> ''"
+    return f"(json_extract(value, {_json_path(on)}))"
+
+
+def _unique_index(on: Optional[str]) -> str:
+    """check that the unique index for `upsert` exists and return its conflict target"""
+    assert db is not None
+    name = _unique_index_name(on)
+    if name not in unique_indexes:
+        found = db.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND name=?", [name]
+        ).fetchone()
+        if found is None:
+            args = "unique=True" if on is None else f"'{on}', unique=True"
+            raise KudbError(
+                f"`upsert` needs a unique index on {on or 'the tag'}: "
+                f"please call `create_index({args})` first."
+            )
+        unique_indexes.add(name)
+    return _unique_target(on)
+
+
+def _upsert_row(
+    value: Any,
+    tag: Optional[str],
+    tag_name: Optional[str],
+    on: Optional[str],
+    t: int,
+    expires_at: float,
+) -> List[Any]:
+    """parameters of `upsert_doc` for one doc (tag as in `insert_many`)"""
+    if on is not None:
+        # a missing `on` field is NULL in the index and never conflicts
+        found = value
+        for part in str(on).split("."):
+            if not isinstance(found, dict) or found.get(part) is None:
+                raise KudbError(f"`upsert` needs the `{on}` field in every doc.")
+            found = found[part]
+    if tag is None:
+        tag = ""
+        if isinstance(value, dict) and tag_name in value:
+            tag = value[tag_name]
+    return [_dumps(value), tag, t, t, expires_at]
+
+
+def upsert(
+    value: Any,
+    tag: Optional[str] = None,
+    on: Optional[str] = None,
+    tag_name: Optional[str] = None,
+    ttl: Optional[float] = None,
+    file: Optional[str] = None,
+) -> int:
+    """
+    insert a doc, or replace the doc with the same tag (or the same `on` field)
+    in one statement; return its id
+    needs the unique index made by `create_index(unique=True)`
+    (or `create_index(on, unique=True)`)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> create_index('email', unique=True)
+    >>> create_index(unique=True)
+    >>> upsert({'email': 'a@example.com', 'name': 'A'}, on='email')
+    1
+    >>> upsert({'email': 'a@example.com', 'name': 'A2'}, on='email')
+    1
+    >>> get_by_id(1)['name']
+    'A2'
+    >>> upsert({'name': 'banana', 'price': 30}, tag='banana')
+    2
+    >>> upsert({'name': 'banana', 'price': 35}, tag='banana')
+    2
+    >>> get_by_tag('banana')[0]['price']
+    35
+    >>> drop_index('email', unique=True)
+    >>> drop_index(unique=True)
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `upsert` method.")
+    _need_returning("upsert")
+    if tag_name is None:
+        tag_name = get_tag_name()
+    row = _upsert_row(value, tag, tag_name, on, int(time.time()), _expires_at(ttl))
+    if on is None and row[1] == "":
+        raise KudbError("`upsert` needs a tag (or `on` field) to find the doc.")
+    try:
+        with db_lock:
+            sql = SQLS["upsert_doc"].replace("__TARGET__", _unique_index(on))
+            new_id = db.execute(sql, row).fetchone()[0]
+            _commit()
+        return int(new_id)
+    except KudbError:
+        raise
+    except Exception as err:
+        raise KudbError("database upsert error: " + str(err)) from err
+
+
+def upsert_many(
+    value_list: List[Any],
+    on: Optional[str] = None,
+    tag_name: Optional[str] = None,
+    ttl: Optional[float] = None,
+    chunk_size: int = 1000,
+    file: Optional[str] = None,
+) -> None:
+    """
+    `upsert` many docs with executemany, one transaction per chunk_size docs
+    (docs are matched by their tag, from tag_name, or by the `on` field)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> create_index('sku', unique=True)
+    >>> upsert_many([{'sku': 'a', 'stock': 1}, {'sku': 'b', 'stock': 2}], on='sku')
+    >>> upsert_many([{'sku': 'b', 'stock': 5}, {'sku': 'c', 'stock': 0}], on='sku')
+    >>> [(d['sku'], d['stock']) for d in get_all()]
+    [('a', 1), ('b', 5), ('c', 0)]
+    >>> drop_index('sku', unique=True)
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `upsert_many` method.")
+    if not isinstance(value_list, list):
+        raise KudbError("please set the list type arguments to `upsert_many` method.")
+    if chunk_size <= 0:
+        raise KudbError("chunk_size must be positive in `upsert_many` method.")
+    if tag_name is None:
+        tag_name = get_tag_name()
+    t = int(time.time())
+    expires_at = _expires_at(ttl)
+    rows = [_upsert_row(v, None, tag_name, on, t, expires_at) for v in value_list]
+    if on is None and any(row[1] == "" for row in rows):
+        raise KudbError("`upsert_many` needs a tag (or `on` field) for every doc.")
+    try:
+        with db_lock:
+            sql = SQLS["upsert_many_doc"].replace("__TARGET__", _unique_index(on))
+            for i in range(0, len(rows), chunk_size):
+                db.executemany(sql, rows[i : i + chunk_size])
+                _commit()
+    except KudbError:
+        raise
+    except Exception as err:
+        raise KudbError("database upsert error: " + str(err)) from err
+
+
 def update(
     id: Optional[int] = None, new_value: Any = None, tag: Optional[str] = None
 ) -> None:
@@ -694,7 +2012,7 @@ def update(
         raise KudbError("please connect before using `update_doc` method.")
     # check tag
     if tag is None:
-        tag_name = get_key("_tag", "tag")
+        tag_name = get_tag_name()
         tag_value = ""
         if isinstance(new_value, dict):
             if tag_name in new_value:
@@ -704,32 +2022,33 @@ def update(
         tag_value = tag
     # update
     try:
-        cur = db.cursor()
-        sql = ""
-        if id is not None:
-            sql = SQLS["update_doc"]
-            cur.execute(
-                sql,
-                [
-                    json.dumps(new_value, ensure_ascii=False),
-                    tag_value,
-                    int(time.time()),
-                    id,
-                ],
-            )
-        elif tag is not None:
-            sql = SQLS["update_doc_by_tag"]
-            cur.execute(
-                sql,
-                [
-                    json.dumps(new_value, ensure_ascii=False),
-                    tag_value,
-                    int(time.time()),
-                    tag,
-                ],
-            )
-        cur.close()
-        db.commit()
+        with db_lock:
+            cur = db.cursor()
+            sql = ""
+            if id is not None:
+                sql = SQLS["update_doc"]
+                cur.execute(
+                    sql,
+                    [
+                        _dumps(new_value),
+                        tag_value,
+                        int(time.time()),
+                        id,
+                    ],
+                )
+            elif tag is not None:
+                sql = SQLS["update_doc_by_tag"]
+                cur.execute(
+                    sql,
+                    [
+                        _dumps(new_value),
+                        tag_value,
+                        int(time.time()),
+                        tag,
+                    ],
+                )
+            cur.close()
+            _commit()
     except Exception as err:
         raise KudbError("database update error:" + str(err)) from err
 
@@ -801,16 +2120,18 @@ def delete(
     if db is None:
         raise KudbError("please connect before using `delete` method.")
     if id is not None:
-        cur = db.cursor()
-        cur.execute(SQLS["delete_doc"], [id])
-        cur.close()
-        db.commit()
+        with db_lock:
+            cur = db.cursor()
+            cur.execute(SQLS["delete_doc"], [id])
+            cur.close()
+            _commit()
         return
     if tag is not None:
-        cur = db.cursor()
-        cur.execute(SQLS["delete_doc_by_tag"], [tag])
-        cur.close()
-        db.commit()
+        with db_lock:
+            cur = db.cursor()
+            cur.execute(SQLS["delete_doc_by_tag"], [tag])
+            cur.close()
+            _commit()
         return
     if key is not None:
         delete_key(key)
@@ -840,10 +2161,11 @@ def clear_doc(file: Optional[str] = None) -> None:
         connect(file)
     if db is None:
         raise KudbError("please connect before using `clear_doc` method.")
-    cur = db.cursor()
-    cur.execute(SQLS["clear_doc"], [])
-    cur.close()
-    db.commit()
+    with db_lock:
+        cur = db.cursor()
+        cur.execute(SQLS["clear_doc"], [])
+        cur.close()
+        _commit()
 
 
 def clear(file: Optional[str] = None) -> None:
@@ -864,101 +2186,1896 @@ def clear(file: Optional[str] = None) -> None:
     clear_doc()
 
 
-def find(
-    callback: Optional[Callable[[Any], bool]] = None,
-    keys: Optional[Dict[str, Any]] = None,
-    limit: Optional[int] = None,
-) -> List[Any]:
+def purge_expired(batch_size: int = 1000, file: Optional[str] = None) -> int:
     """
-    find doc by lambda
-    >>> clear(file=MEMORY_FILE)
-    >>> insert_many([{"name": "Taro", "age":30},{"name": "Bob", "age":19},{"name": "Coo", "age": 21}])
-    >>> [a['name'] for a in find(lambda v: v['age'] == 19)]
-    ['Bob']
-    >>> [a['name'] for a in find(lambda v: v['age'] < 22)]
-    ['Bob', 'Coo']
-    >>> clear()
-    >>> insert_many([1,2,3,4,5])
-    >>> [v for v in find(lambda c: c>=2, limit=3)]
-    [2, 3, 4]
+    delete expired keys and docs in small batches, return deleted count
+
     >>> clear(file=MEMORY_FILE)
-    >>> insert_many([{"name": "Taro", "age":30},{"name": "Bob", "age":19},{"name": "Coo", "age": 21}])
-    >>> find(keys={"name": "Taro"})[0]["age"]
-    30
-    >>> find(keys={"age": 30})[0]["name"]
-    'Taro'
+    >>> set_key('a', 1, ttl=0.01)
+    >>> insert_many([1, 2, 3], ttl=0.01)
+    >>> _ = insert(4)
+    >>> time.sleep(0.02)
+    >>> purge_expired(batch_size=2)
+    4
+    >>> count_doc()
+    1
     """
+    if file is not None:
+        connect(file)
     if db is None:
-        raise KudbError("please connect before using `find` method.")
-    result = []
-    cur = db.cursor()
-    # callback
-    if (callback is None) and (keys is not None):
-        callback = lambda values: (
-            True
-            if sum([(0 if (values[k] == v) else 1) for k, v in keys.items()]) == 0
-            else False
-        )
-    # find
-    for row in cur.execute(SQLS["select_doc"]):
-        values = json.loads(row[0])
-        if isinstance(values, dict):
-            values["id"] = row[1]
-        if callback is not None and callback(values):
-            result.append(values)
-            if (limit is not None) and (len(result) >= limit):
-                break
-    cur.close()
-    return result
+        raise KudbError("please connect before using `purge_expired` method.")
+    _need_returning("purge_expired")
+    if batch_size <= 0:
+        raise KudbError("batch_size must be positive in `purge_expired` method.")
+    return _purge(db, SQLS, batch_size)
 
 
-def find_one(
-    callback: Optional[Callable[[Any], bool]] = None,
-    keys: Optional[Dict[str, Any]] = None,
-    limit: Optional[int] = None,
-) -> Any:
+def _purge(conn: sqlite3.Connection, sqls: Dict[str, str], batch_size: int) -> int:
+    """delete expired rows with `conn` (each batch is a short transaction)"""
+    total = 0
+    try:
+        for sql in ("purge", "purge_doc"):
+            while True:
+                with db_lock:
+                    cur = conn.cursor()
+                    cur.execute(sqls[sql], [batch_size])
+                    if sql == "purge":
+                        deleted = cur.fetchall()
+                        if conn is db:
+                            for row in deleted:
+                                CACHE_KEYS.pop(row[0], None)
+                                CACHE_META.pop(row[0], None)
+                        count = len(deleted)
+                    else:
+                        count = cur.rowcount
+                    cur.close()
+                    if conn is not db or not _in_batch():
+                        conn.commit()
+                        if instrumented:
+                            _count_commit()
+                total += count
+                if count < batch_size:
+                    break
+    except Exception as err:
+        raise KudbError("could not purge expired data: " + str(err)) from err
+    return total
+
+
+sweeper_thread: Optional[threading.Thread] = None
+sweeper_stop = threading.Event()
+
+
+def start_sweeper(interval: float = 60.0, batch_size: int = 1000) -> None:
     """
-    find one doc by lambda
-    >> clear(file=MEMORY_FILE)
-    >> insert_many([{'name': 'Taro', 'age': 30}, {'name': 'Jiro', 'age': 18}])
-    >> find_one(keys={'name': 'Jiro'})['age']
-    18
+    start a background thread that purges expired data of the current database
+    every interval seconds
     """
-    r = find(callback=callback, keys=keys, limit=limit)
-    if len(r) == 0:
-        return None
-    return r[0]
+    global sweeper_thread
+    if db is None:
+        raise KudbError("please connect before using `start_sweeper` method.")
+    _need_returning("start_sweeper")
+    stop_sweeper()
+    conn, sqls = db, SQLS
 
+    def sweep() -> None:
+        while not sweeper_stop.wait(interval):
+            try:
+                _purge(conn, sqls, batch_size)
+            except KudbError:
+                pass
 
-def set_tag_name(tag_name: str) -> None:
-    """set tag name"""
-    set_key("_tag", tag_name)
+    sweeper_stop.clear()
+    sweeper_thread = threading.Thread(target=sweep, name="kudb-sweeper", daemon=True)
+    sweeper_thread.start()
 
 
-def get_tag_name(def_tag_name: str = "tag") -> Any:
-    """get tag name"""
-    return get_key("_tag", def_tag_name)
+def stop_sweeper() -> None:
+    """stop the background sweeper thread"""
+    global sweeper_thread
+    if sweeper_thread is not None:
+        sweeper_stop.set()
+        sweeper_thread.join()
+        sweeper_thread = None
 
 
-def get_high_score(limit: int = 10, score_key: str = "score") -> List[Any]:
+def compact(
+    max_pages: Optional[int] = None,
+    time_budget: Optional[float] = None,
+    file: Optional[str] = None,
+) -> int:
     """
-    get high score docs
-    >>> clear(file=MEMORY_FILE)
-    >>> insert_many([{'name': 'A', 'score': 50}, {'name': 'B', 'score': 80}, {'name': 'C', 'score': 70}])
-    >>> [a['name'] for a in get_high_score(2)]
-    ['B', 'C']
+    give free pages back to the OS with `PRAGMA incremental_vacuum`
+    in small slices (one short write each), stopping after `max_pages`
+    pages or `time_budget` seconds; return the number of pages freed
+    (always 0 unless the file was made with `connect(auto_vacuum="incremental")`)
     """
-    result = get_all()
-    result.sort(key=lambda x: x.get(score_key, 0), reverse=True)
-    return result[:limit]
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `compact` method.")
+    if _in_batch():
+        raise KudbError("`compact` can not be used in `batch()`.")
+    return _compact(db, max_pages, time_budget)
 
 
-def insert_score(
-    score: int,
-    name: str,
-    meta: Optional[Dict[str, Any]] = None,
-    score_key: str = "score",
-    file: Optional[str] = None,
+def _compact(
+    conn: sqlite3.Connection, max_pages: Optional[int], time_budget: Optional[float]
+) -> int:
+    """run incremental_vacuum on `conn` COMPACT_STEP pages at a time"""
+    start = time.perf_counter()
+    total = 0
+    try:
+        while max_pages is None or total < max_pages:
+            with db_lock:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free == 0:
+                    break
+                step = min(free, COMPACT_STEP)
+                if max_pages is not None:
+                    step = min(step, max_pages - total)
+                # the pragma frees pages while it is stepped, so fetch all
+                conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+                freed = free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if freed <= 0:
+                break  # auto_vacuum is not incremental
+            total += freed
+            if time_budget is not None and time.perf_counter() - start >= time_budget:
+                break
+    except Exception as err:
+        raise KudbError("could not compact database: " + str(err)) from err
+    return total
+
+
+compactor_thread: Optional[threading.Thread] = None
+compactor_stop = threading.Event()
+
+
+def start_compactor(
+    interval: float = 60.0, max_pages: int = 1000, time_budget: float = 0.05
+) -> None:
+    """
+    start a background thread that runs `compact` on the current database
+    every interval seconds, but only when nothing was written since the last check
+    """
+    global compactor_thread
+    if db is None:
+        raise KudbError("please connect before using `start_compactor` method.")
+    stop_compactor()
+    conn = db
+
+    def run() -> None:
+        changes = conn.total_changes
+        while not compactor_stop.wait(interval):
+            if conn.total_changes != changes:  # busy, try again later
+                changes = conn.total_changes
+                continue
+            try:
+                _compact(conn, max_pages, time_budget)
+            except KudbError:
+                pass
+
+    compactor_stop.clear()
+    compactor_thread = threading.Thread(target=run, name="kudb-compactor", daemon=True)
+    compactor_thread.start()
+
+
+def stop_compactor() -> None:
+    """stop the background compactor thread"""
+    global compactor_thread
+    if compactor_thread is not None:
+        compactor_stop.set()
+        compactor_thread.join()
+        compactor_thread = None
+
+
+def _json_path(field: str) -> str:
+    """
+    field name to a quoted JSON path literal ('a.b' means nested key b in a)
+
+    >>> print(_json_path('price'))
+    '$."price"'
+    >>> print(_json_path('user.name'))
+    '$."user"."name"'
+    """
+    parts = ['"' + p.replace('"', '\\"') + '"' for p in str(field).split(".")]
+    return "'" + ("$." + ".".join(parts)).replace("'", "''") + "'"
+
+
+def _project(sql: str, fields: Optional[List[str]]) -> str:
+    """
+    select only `fields` of the doc (`SELECT value, id ...` -> json_object)
+
+    >>> print(_project("SELECT value, id FROM doc", ["name"]))
+    SELECT json_object('name', json_extract(value, '$."name"')), id FROM doc
+    """
+    if fields is None:
+        return sql
+    if isinstance(fields, str):
+        fields = [fields]
+    pairs = ", ".join(
+        "'"
+        + str(f).replace("'", "''")
+        + "', json_extract(value, "
+        + _json_path(f)
+        + ")"
+        for f in fields
+    )
+    return sql.replace("SELECT value,", f"SELECT json_object({pairs}),", 1)
+
+
+def _order_by(
+    sql: str, order_by: Union[str, List[Any], Tuple[str, str]], desc: bool = False
+) -> str:
+    """
+    replace the ORDER BY of a doc query with `order_by` fields (ties by id)
+    the terms are json_extract(value, path), same as `create_index`,
+    so an index on them can be used
+
+    >>> print(_order_by("SELECT value, id FROM doc ORDER BY id ASC LIMIT ?",
+    ...                 [("city", "asc"), ("age", "desc")]))
+    SELECT value, id FROM doc ORDER BY json_extract(value, '$."city"') ASC, json_extract(value, '$."age"') DESC, id DESC LIMIT ?
+    """
+    if isinstance(order_by, (str, tuple)):
+        order_by = [order_by]
+    terms = []
+    direction = "DESC" if desc else "ASC"
+    for item in order_by:
+        if isinstance(item, str):
+            field, direction = item, "DESC" if desc else "ASC"
+        else:
+            field, direction = item[0], str(item[1]).upper()
+        if direction not in ("ASC", "DESC"):
+            raise KudbError(f"order must be 'asc' or 'desc': {item}")
+        expr = "id" if field == "id" else f"json_extract(value, {_json_path(field)})"
+        terms.append(f"{expr} {direction}")
+    # the last direction for id: an index on the fields (+ rowid) can be walked
+    terms.append(f"id {direction}")
+    head, _, tail = sql.partition(" ORDER BY ")
+    limit = tail[tail.find(" LIMIT") :] if " LIMIT" in tail else ""
+    return head + " ORDER BY " + ", ".join(terms) + limit
+
+
+def _where_keys(keys: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """compile {field: value} equality filter to SQL (AND-ed)"""
+    if not keys:
+        return "", []
+    if not isinstance(keys, dict):
+        raise KudbError("filter must be a dictionary of field and value.")
+    sql = []
+    params: List[Any] = []
+    for field, val in keys.items():
+        expr = f"json_extract(value, {_json_path(field)})"
+        if val is None:
+            sql.append(f"json_type(value, {_json_path(field)}) = 'null'")
+        elif isinstance(val, (dict, list)):
+            sql.append(f"{expr} = json(?)")
+            params.append(json.dumps(val, ensure_ascii=False))
+        else:
+            sql.append(f"{expr} = ?")
+            params.append(val)
+    return " AND " + " AND ".join(sql), params
+
+
+def _doc_table() -> str:
+    """name of the doc table of the current connection"""
+    return "doc" + cur_tablename
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_regexp(pattern: str) -> "re.Pattern[str]":
+    """compiled pattern for `_regexp`"""
+    return re.compile(pattern)
+
+
+def _regexp(pattern: Optional[str], text: Optional[str]) -> bool:
+    """SQLite `text REGEXP pattern` (registered on every connection)"""
+    if pattern is None or text is None:
+        return False
+    return _compile_regexp(pattern).search(text) is not None
+
+
+def _prefilter(
+    sql: str,
+    contains: Union[str, List[str], None] = None,
+    like: Optional[str] = None,
+    regexp: Optional[str] = None,
+) -> Tuple[str, List[Any]]:
+    """
+    add conditions on the stored JSON text to a doc query (before ORDER BY)
+
+    >>> _prefilter("SELECT value, id FROM doc WHERE 1 ORDER BY id", "Taro", regexp="^x")
+    ('SELECT value, id FROM doc WHERE 1 AND instr(value, ?) > 0 AND value REGEXP ? ORDER BY id', ['Taro', '^x'])
+    """
+    where = ""
+    params: List[Any] = []
+    if isinstance(contains, str):
+        contains = [contains]
+    for text in contains or []:
+        where += " AND instr(value, ?) > 0"
+        # stored as JSON: '"', '\\' and control characters are escaped there
+        params.append(json.dumps(text, ensure_ascii=False)[1:-1])
+    if like is not None:
+        where += " AND value LIKE ?"
+        params.append(like)
+    if regexp is not None:
+        where += " AND value REGEXP ?"
+        params.append(regexp)
+    head, order, tail = sql.partition(" ORDER BY")
+    return head + where + order + tail, params
+
+
+# a JSON string literal (used to skip strings when scanning raw JSON)
+JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+json_decoder = json.JSONDecoder()
+# `LazyDoc._value` before decoding
+UNDECODED = object()
+
+
+@functools.lru_cache(maxsize=256)
+def _field_pattern(key: str) -> "re.Pattern[str]":
+    """regex that finds `"key":` in JSON text written by `_dumps`"""
+    return re.compile(re.escape(json.dumps(key, ensure_ascii=False)) + r"\s*:\s*")
+
+
+def _scan_field(raw: str, key: str) -> Optional[Tuple[Any]]:
+    """
+    decode only the value of top-level `key` of a JSON object text
+    return (value,) or None when it is not found that way
+
+    >>> _scan_field('{"a": {"b": 1}, "b": [2, 3]}', 'b')
+    ([2, 3],)
+    >>> _scan_field('{"a": {"b": 1}}', 'b') is None
+    True
+    """
+    if not raw.startswith("{"):
+        return None
+    for m in _field_pattern(key).finditer(raw):
+        prefix = JSON_STRING.sub("", raw[: m.start()])
+        if '"' in prefix:
+            continue  # inside a string
+        depth = prefix.count("{") + prefix.count("[")
+        depth -= prefix.count("}") + prefix.count("]")
+        if depth == 1:
+            return (json_decoder.raw_decode(raw, m.end())[0],)
+    return None
+
+
+class LazyDoc:
+    """
+    a doc row that decodes its JSON text only when needed (`lazy=True`)
+    doc['field'] decodes just that top-level field; `value` decodes everything
+    `id` is an attribute (doc['id'] also works when the doc has no 'id' field)
+    """
+
+    __slots__ = ("raw", "id", "ctime", "mtime", "_value")
+
+    def __init__(self, raw: str, id: int, ctime: int = 0, mtime: int = 0):
+        self.raw = raw
+        self.id = id
+        self.ctime = ctime
+        self.mtime = mtime
+        self._value: Any = UNDECODED
+
+    @property
+    def value(self) -> Any:
+        """the whole decoded doc"""
+        if self._value is UNDECODED:
+            self._value = json.loads(self.raw)
+        return self._value
+
+    def __getitem__(self, key: Any) -> Any:
+        if self._value is UNDECODED and isinstance(key, str):
+            found = _scan_field(self.raw, key)
+            if found is not None:
+                return found[0]
+        value = self.value
+        if key == "id" and isinstance(value, dict) and "id" not in value:
+            return self.id
+        return value[key]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """doc[key] or default"""
+        try:
+            return self[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.value
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.value)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def keys(self) -> Any:
+        """keys of the doc"""
+        return self.value.keys()
+
+    def items(self) -> Any:
+        """items of the doc"""
+        return self.value.items()
+
+    def to_dict(self) -> Any:
+        """decoded doc with "id" (same as a row of `lazy=False`)"""
+        value = self.value
+        if isinstance(value, dict):
+            return {**value, "id": self.id}
+        return value
+
+    def __reduce__(self) -> Any:
+        return (LazyDoc, (self.raw, self.id, self.ctime, self.mtime))
+
+    def __repr__(self) -> str:
+        return f"LazyDoc(id={self.id}, {self.raw[:60]})"
+
+
+def _lazy_sql(sql: str, lazy: bool) -> str:
+    """add ctime and mtime to `SELECT value, id ...` for `LazyDoc` rows"""
+    if not lazy:
+        return sql
+    return sql.replace("SELECT value, id", "SELECT value, id, ctime, mtime", 1)
+
+
+def _make_row(row: Any, lazy: bool) -> Any:
+    """doc of a `SELECT value, id ...` row (a dict gets "id")"""
+    if lazy:
+        return LazyDoc(*row)
+    values = json.loads(row[0])
+    if isinstance(values, dict):
+        values["id"] = row[1]
+    return values
+
+
+class _MatchKeys:
+    """picklable predicate for `find(keys=...)`"""
+
+    def __init__(self, keys: Dict[str, Any]):
+        self.keys = keys
+
+    def __call__(self, values: Any) -> bool:
+        return all(values[k] == v for k, v in self.keys.items())
+
+
+def _resolve_predicate(
+    callback: Union[Callable[[Any], bool], str, None],
+) -> Optional[Callable[[Any], bool]]:
+    """resolve 'module:function' (or 'module.function') to a callable"""
+    if not isinstance(callback, str):
+        return callback
+    if ":" in callback:
+        module_name, func_name = callback.split(":", 1)
+    else:
+        module_name, _, func_name = callback.rpartition(".")
+    try:
+        func = getattr(importlib.import_module(module_name), func_name)
+    except (ImportError, AttributeError, ValueError) as err:
+        raise KudbError(f"could not import predicate `{callback}`: {str(err)}") from err
+    if not callable(func):
+        raise KudbError(f"predicate `{callback}` is not callable")
+    return func
+
+
+worker_db: Optional[sqlite3.Connection] = None
+
+
+def _init_find_worker(uri: str) -> None:
+    """open a read-only connection once per worker process"""
+    global worker_db
+    worker_db = sqlite3.connect(uri, uri=True)
+    worker_db.create_function("regexp", 2, _regexp, **FUNCTION_FLAGS)
+
+
+def _find_chunk(
+    sql: str,
+    callback: Union[Callable[[Any], bool], str],
+    id_from: int,
+    id_to: int,
+    limit: Optional[int],
+    lazy: bool = False,
+    params: Optional[List[Any]] = None,
+) -> List[Any]:
+    """scan one id range in a worker process"""
+    predicate = _resolve_predicate(callback)
+    assert predicate is not None and worker_db is not None
+    result = []
+    for row in worker_db.execute(sql, [id_from, id_to] + (params or [])):
+        values = _make_row(row, lazy)
+        if predicate(values):
+            result.append(values)
+            if (limit is not None) and (len(result) >= limit):
+                break
+    return result
+
+
+def _find_parallel(
+    callback: Union[Callable[[Any], bool], str],
+    limit: Optional[int],
+    workers: int,
+    fields: Optional[List[str]] = None,
+    lazy: bool = False,
+    prefilter: Optional[Dict[str, Any]] = None,
+) -> List[Any]:
+    """split the id range into chunks and scan them in a process pool"""
+    assert db is not None
+    if not isinstance(callback, str):
+        try:
+            pickle.dumps(callback)
+        except Exception as err:
+            raise KudbError(
+                "callback must be picklable (or 'module:function') "
+                "when using `find(workers=...)`: " + str(err)
+            ) from err
+    id_min, id_max = db.execute(SQLS["doc_id_range"]).fetchone()
+    if id_min is None:
+        return []
+    # several chunks per worker, so a slow chunk does not idle the pool
+    chunks = workers * 4
+    step = max(1, (id_max - id_min + 1 + chunks - 1) // chunks)
+    uri = Path(cur_filename).resolve().as_uri() + "?mode=ro"
+    sql, params = _prefilter(SQLS["select_doc_range"], **(prefilter or {}))
+    sql = _project(_lazy_sql(sql, lazy), fields)
+    result: List[Any] = []
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_find_worker, initargs=(uri,)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _find_chunk,
+                sql,
+                callback,
+                lo,
+                min(lo + step - 1, id_max),
+                limit,
+                lazy,
+                params,
+            )
+            for lo in range(id_min, id_max + 1, step)
+        ]
+        # merge in id order and stop early when limit is reached
+        for i, future in enumerate(futures):
+            result.extend(future.result())
+            if (limit is not None) and (len(result) >= limit):
+                for rest in futures[i + 1 :]:
+                    rest.cancel()
+                return result[:limit]
+    return result
+
+
+def find(
+    callback: Union[Callable[[Any], bool], str, None] = None,
+    keys: Optional[Dict[str, Any]] = None,
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+    lazy: bool = False,
+    contains: Union[str, List[str], None] = None,
+    like: Optional[str] = None,
+    regexp: Optional[str] = None,
+    order_by: Union[str, List[Any], None] = None,
+    desc: bool = False,
+) -> List[Any]:
+    """
+    find doc by lambda
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{"name": "Taro", "age":30},{"name": "Bob", "age":19},{"name": "Coo", "age": 21}])
+    >>> [a['name'] for a in find(lambda v: v['age'] == 19)]
+    ['Bob']
+    >>> [a['name'] for a in find(lambda v: v['age'] < 22)]
+    ['Bob', 'Coo']
+    >>> clear()
+    >>> insert_many([1,2,3,4,5])
+    >>> [v for v in find(lambda c: c>=2, limit=3)]
+    [2, 3, 4]
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{"name": "Taro", "age":30},{"name": "Bob", "age":19},{"name": "Coo", "age": 21}])
+    >>> find(keys={"name": "Taro"})[0]["age"]
+    30
+    >>> find(keys={"age": 30})[0]["name"]
+    'Taro'
+
+    find by predicate path ('module:function')
+    >>> [a['name'] for a in find('operator:truth')]
+    ['Taro', 'Bob', 'Coo']
+
+    workers: scan the id range in a process pool (file database only;
+    inside an open transaction such as `batch()` the scan is serial).
+    The callback must be picklable (a module-level function) or a 'module:function' path.
+
+    fields: select only these fields in SQL (the callback sees only them)
+    >>> find(keys={"name": "Bob"}, fields=["age"])
+    [{'age': 19, 'id': 2}]
+
+    lazy: return `LazyDoc` rows; the callback decodes only the fields it reads
+    >>> [(d.id, d['name']) for d in find(lambda v: v['age'] > 20, lazy=True)]
+    [(1, 'Taro'), (3, 'Coo')]
+
+    contains / like / regexp: coarse filters on the stored JSON text run in SQL,
+    only the matching rows are decoded and passed to the callback (if any)
+    >>> [a['name'] for a in find(contains='Bob')]
+    ['Bob']
+    >>> [a['name'] for a in find(lambda v: v['age'] < 25, regexp='"name": "[BC]')]
+    ['Bob', 'Coo']
+
+    order_by: return docs in this order (see `get_all`; always a serial scan)
+    >>> [a['name'] for a in find(lambda v: v['age'] > 20, order_by='age', desc=True)]
+    ['Taro', 'Coo']
+    """
+    if db is None:
+        raise KudbError("please connect before using `find` method.")
+    # fields needed only to match keys are selected and dropped afterwards
+    hidden: List[str] = []
+    if isinstance(fields, str):
+        fields = [fields]
+    if fields is not None and callback is None and keys is not None:
+        hidden = [k for k in keys if k not in fields]
+        fields = list(fields) + hidden
+        if lazy:  # lazy rows keep them
+            hidden = []
+    # callback
+    if (callback is None) and (keys is not None):
+        callback = _MatchKeys(keys)
+    prefilter = {"contains": contains, "like": like, "regexp": regexp}
+    if (
+        callback is not None
+        and workers is not None
+        and workers > 1
+        and cur_filename != MEMORY_FILE
+        and order_by is None
+        and not db.in_transaction  # workers see only committed rows
+    ):
+        result = _find_parallel(callback, limit, workers, fields, lazy, prefilter)
+    else:
+        predicate = _resolve_predicate(callback)
+        if predicate is None and any(v is not None for v in prefilter.values()):
+            predicate = lambda _: True  # the prefilter alone
+        result = []
+        scanned = 0
+        cur = db.cursor()
+        # find
+        sql, params = _prefilter(SQLS["select_doc"], **prefilter)
+        if order_by is not None:
+            sql = _order_by(sql, order_by, desc)
+        sql = _project(_lazy_sql(sql, lazy), fields)
+        for scanned, row in enumerate(cur.execute(sql, params), 1):
+            values = _make_row(row, lazy)
+            if predicate is not None and predicate(values):
+                result.append(values)
+                if (limit is not None) and (len(result) >= limit):
+                    break
+        cur.close()
+        if instrumented:
+            _count_rows_scanned(scanned)
+    for values in result if hidden else []:
+        for k in hidden:
+            values.pop(k, None)
+    return result
+
+
+def find_one(
+    callback: Union[Callable[[Any], bool], str, None] = None,
+    keys: Optional[Dict[str, Any]] = None,
+    limit: Optional[int] = None,
+) -> Any:
+    """
+    find one doc by lambda
+    >> clear(file=MEMORY_FILE)
+    >> insert_many([{'name': 'Taro', 'age': 30}, {'name': 'Jiro', 'age': 18}])
+    >> find_one(keys={'name': 'Jiro'})['age']
+    18
+    """
+    r = find(callback=callback, keys=keys, limit=limit)
+    if len(r) == 0:
+        return None
+    return r[0]
+
+
+def to_columns(
+    fields: List[str],
+    filter: Optional[Dict[str, Any]] = None,
+    dtype: str = "d",
+    use_numpy: Optional[bool] = None,
+    file: Optional[str] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    extract numeric fields of docs into columns (array.array or numpy.ndarray)
+    return (columns, masks), mask is 1 where the field is a number
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'price': 100, 'qty': 2}, {'price': 250.5}, {'price': 'free', 'qty': 1}])
+    >>> cols, masks = to_columns(['price', 'qty'], use_numpy=False)
+    >>> cols['price'].tolist(), masks['price'].tolist()
+    ([100.0, 250.5, 0.0], [1, 1, 0])
+    >>> cols['qty'].tolist(), masks['qty'].tolist()
+    ([2.0, 0.0, 1.0], [1, 0, 1])
+    >>> cols, _ = to_columns(['price'], filter={'qty': 2}, dtype='q', use_numpy=False)
+    >>> cols['price']
+    array('q', [100])
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `to_columns` method.")
+    if isinstance(fields, str):
+        fields = [fields]
+    np: Any = None
+    if use_numpy is not False:
+        try:
+            import numpy as np  # pylint: disable=import-outside-toplevel
+        except ImportError as err:
+            if use_numpy:
+                raise KudbError("numpy is not installed.") from err
+    if np is not None:
+        is_int = np.dtype(dtype).kind in "iu"
+    else:
+        if len(dtype) != 1 or dtype not in "bBhHiIlLqQfd":
+            raise KudbError(f"dtype must be an array typecode: {dtype}")
+        is_int = dtype in "bBhHiIlLqQ"
+    # only numbers are extracted, other values become NULL (masked)
+    cast = "INTEGER" if is_int else "REAL"
+    columns_sql = ", ".join(
+        f"CASE WHEN json_type(value, {_json_path(f)}) IN ('integer', 'real') "
+        f"THEN CAST(json_extract(value, {_json_path(f)}) AS {cast}) END"
+        for f in fields
+    )
+    where, params = _where_keys(filter)
+    table = _doc_table()
+    try:
+        cur = db.cursor()
+        cur.execute(
+            f"SELECT count(id) FROM {table} WHERE {SQLS['live']}{where}", params
+        )
+        size = cur.fetchone()[0]
+        # preallocate buffers
+        if np is not None:
+            cols = [np.zeros(size, dtype=dtype) for _ in fields]
+            masks = [np.zeros(size, dtype=bool) for _ in fields]
+        else:
+            cols = [array(dtype, bytes(array(dtype).itemsize * size)) for _ in fields]
+            masks = [array("B", bytes(size)) for _ in fields]
+        i = 0
+        cur.execute(
+            f"SELECT {columns_sql} FROM {table} WHERE {SQLS['live']}{where} ORDER BY id",
+            params,
+        )
+        while True:
+            rows = cur.fetchmany(4096)
+            if not rows:
+                break
+            for row in rows:
+                if i >= size:  # ignore rows inserted after counting
+                    break
+                for j, v in enumerate(row):
+                    if v is not None:
+                        cols[j][i] = v
+                        masks[j][i] = 1
+                i += 1
+        cur.close()
+    except Exception as err:
+        raise KudbError("could not extract columns: " + str(err)) from err
+    if i < size:  # rows were deleted after counting
+        cols = [c[:i] for c in cols]
+        masks = [m[:i] for m in masks]
+    return dict(zip(fields, cols)), dict(zip(fields, masks))
+
+
+AGGREGATE_FUNCTIONS = ("count", "sum", "avg", "min", "max")
+
+
+def aggregate(
+    group_by: Union[str, List[str], None] = None,
+    metrics: Optional[Dict[str, Any]] = None,
+    filter: Optional[Dict[str, Any]] = None,
+    limit: Optional[int] = None,
+    stream: bool = False,
+    file: Optional[str] = None,
+) -> Any:
+    """
+    aggregate docs in SQLite (count / sum / avg / min / max)
+    metrics: {name: "count"} or {name: (function, field)}
+    (a field metric skips docs where the field is not a number, as `to_columns` does)
+    group_by "tag" groups by the tag column (uses the tag index, which
+    files made by older versions build at the first call)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([
+    ...     {'name': 'A', 'city': 'Tokyo', 'age': 30},
+    ...     {'name': 'B', 'city': 'Osaka', 'age': 20},
+    ...     {'name': 'C', 'city': 'Tokyo', 'age': 40}], tag_name='city')
+    >>> aggregate(metrics={'n': 'count', 'max_age': ('max', 'age')})
+    [{'n': 3, 'max_age': 40}]
+    >>> aggregate(group_by='city', metrics={'n': 'count', 'avg_age': ('avg', 'age')})
+    [{'city': 'Osaka', 'n': 1, 'avg_age': 20.0}, {'city': 'Tokyo', 'n': 2, 'avg_age': 35.0}]
+    >>> aggregate(group_by='tag', metrics={'n': 'count'}, filter={'age': 30})
+    [{'tag': 'Tokyo', 'n': 1}]
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `aggregate` method.")
+    if metrics is None:
+        metrics = {"count": "count"}
+    if group_by is None:
+        group_fields: List[str] = []
+    elif isinstance(group_by, str):
+        group_fields = [group_by]
+    else:
+        group_fields = list(group_by)
+    if "tag" in group_fields:
+        _ensure_index("create_doc_tag_index")
+    # compile to SQL
+    group_exprs = [
+        "tag" if f == "tag" else f"json_extract(value, {_json_path(f)})"
+        for f in group_fields
+    ]
+    metric_exprs = []
+    for name, spec in metrics.items():
+        func, field = (spec, None) if isinstance(spec, str) else spec
+        func = str(func).lower()
+        if func not in AGGREGATE_FUNCTIONS:
+            raise KudbError(
+                f"unknown aggregate function `{func}` in `aggregate` method."
+            )
+        if field is None:
+            if func != "count":
+                raise KudbError(
+                    f"`{name}` needs a field for `{func}` in `aggregate` method."
+                )
+            metric_exprs.append("count(*)")
+        else:
+            path = _json_path(field)
+            metric_exprs.append(
+                f"{func}(CASE WHEN json_type(value, {path}) IN ('integer', 'real')"
+                f" THEN json_extract(value, {path}) END)"
+            )
+    where, params = _where_keys(filter)
+    sql = f"SELECT {', '.join(group_exprs + metric_exprs)} FROM {_doc_table()} WHERE {SQLS['live']}{where}"
+    if group_exprs:
+        sql += f" GROUP BY {', '.join(group_exprs)} ORDER BY {', '.join(group_exprs)}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    names = group_fields + list(metrics.keys())
+    try:
+        cur = db.cursor()
+        cur.execute(sql, params)
+    except Exception as err:
+        raise KudbError("could not aggregate docs: " + str(err)) from err
+
+    def rows() -> Iterator[Dict[str, Any]]:
+        try:
+            while True:
+                chunk = cur.fetchmany(1000)
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield dict(zip(names, row))
+        finally:
+            cur.close()
+
+    if stream:
+        return rows()
+    return list(rows())
+
+
+def _timestamp(t: Any) -> float:
+    """epoch seconds of a number or a datetime"""
+    if hasattr(t, "timestamp"):
+        return float(t.timestamp())
+    return float(t)
+
+
+def get_range(
+    created_after: Any = None,
+    created_before: Any = None,
+    modified_after: Any = None,
+    modified_before: Any = None,
+    limit: Optional[int] = None,
+    kvs: bool = False,
+    stream: bool = False,
+    lazy: bool = False,
+    file: Optional[str] = None,
+) -> Union[List[Any], Iterator[Any]]:
+    """
+    get docs (or kvs items with kvs=True) by ctime / mtime (epoch seconds or datetime)
+    `*_after` is inclusive and `*_before` is exclusive; rows come in time order
+    (by mtime when a modified_* bound is given, else by ctime) using the indexes
+    (files made by older versions build them at the first call: a one-time scan)
+    dict docs get "_ctime" and "_mtime", kvs items are
+    {"key": ..., "value": ..., "_ctime": ..., "_mtime": ...}
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'name': 'A'}, {'name': 'B'}])
+    >>> set_key('k', 1)
+    >>> [d['name'] for d in get_range(created_after=time.time() - 3600)]
+    ['A', 'B']
+    >>> get_range(created_after=time.time() + 3600)
+    []
+    >>> [i['key'] for i in get_range(modified_after=time.time() - 3600, kvs=True)]
+    ['k']
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `get_range` method.")
+    _ensure_index("create_time_index" if kvs else "create_doc_time_index")
+    where = ""
+    params: List[Any] = []
+    for column, op, t in (
+        ("ctime", ">=", created_after),
+        ("ctime", "<", created_before),
+        ("mtime", ">=", modified_after),
+        ("mtime", "<", modified_before),
+    ):
+        if t is not None:
+            where += f" AND {column} {op} ?"
+            params.append(_timestamp(t))
+    by_mtime = modified_after is not None or modified_before is not None
+    order = "mtime" if by_mtime else "ctime"
+    if kvs:
+        sql = f"SELECT key, value, ctime, mtime FROM {cur_tablename}"
+        tiebreak = "key_id"
+    else:
+        sql = f"SELECT value, id, ctime, mtime FROM {_doc_table()}"
+        tiebreak = "id"
+    sql += f" WHERE {SQLS['live']}{where} ORDER BY {order}, {tiebreak} LIMIT ?"
+    params.append(-1 if limit is None else limit)
+    try:
+        cur = db.cursor()
+        cur.execute(sql, params)
+    except Exception as err:
+        raise KudbError("could not read range: " + str(err)) from err
+
+    def rows() -> Iterator[Any]:
+        try:
+            while True:
+                chunk = cur.fetchmany(1000)
+                if not chunk:
+                    break
+                for row in chunk:
+                    if kvs:
+                        yield {
+                            "key": row[0],
+                            "value": json.loads(row[1]),
+                            "_ctime": row[2],
+                            "_mtime": row[3],
+                        }
+                        continue
+                    values = _make_row(row, lazy)
+                    if isinstance(values, dict):
+                        values["_ctime"] = row[2]
+                        values["_mtime"] = row[3]
+                    yield values
+        finally:
+            cur.close()
+
+    if stream:
+        return rows()
+    return list(rows())
+
+
+def _index_name(fields: List[str]) -> str:
+    """name of the expression index on `fields`"""
+    return _doc_table() + "_ix_" + "_".join(re.sub(r"\W", "_", f) for f in fields)
+
+
+def create_index(
+    fields: Union[str, List[str], None] = None,
+    file: Optional[str] = None,
+    unique: bool = False,
+) -> None:
+    """
+    make an index on document fields
+    (used by `order_by` and by the `filter` of `aggregate` / `to_columns`)
+    unique=True makes the unique index `upsert` needs, on one field
+    (or on the tag when fields is None); duplicated values are rejected from then on
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'name': 'A', 'price': 30}, {'name': 'B', 'price': 10}])
+    >>> create_index('price')
+    >>> [a['name'] for a in get_all(order_by='price', limit=1)]
+    ['B']
+    >>> drop_index('price')
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `create_index` method.")
+    if unique:
+        if isinstance(fields, list):
+            raise KudbError("a unique index for `upsert` is made on one field only.")
+        name = _unique_index_name(fields)
+        sql = f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {_doc_table()} "
+        sql += _unique_target(fields)
+    else:
+        if fields is None:
+            raise KudbError("please set the fields to `create_index` method.")
+        if isinstance(fields, str):
+            fields = [fields]
+        exprs = ", ".join(f"json_extract(value, {_json_path(f)})" for f in fields)
+        name = _index_name(fields)
+        sql = f"CREATE INDEX IF NOT EXISTS {name} ON {_doc_table()} ({exprs})"
+    try:
+        with db_lock:
+            db.execute(sql)
+            _commit()
+    except Exception as err:
+        hint = " (are there duplicated values?)" if unique else ""
+        raise KudbError(f"could not create index{hint}: {err}") from err
+    if unique:
+        unique_indexes.add(name)
+
+
+def drop_index(
+    fields: Union[str, List[str], None] = None,
+    file: Optional[str] = None,
+    unique: bool = False,
+) -> None:
+    """
+    drop the index made by `create_index`
+    (unique=True: the unique index on the field, or on the tag when fields is None)
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `drop_index` method.")
+    if unique:
+        if isinstance(fields, list):
+            raise KudbError("a unique index for `upsert` is made on one field only.")
+        name = _unique_index_name(fields)
+        unique_indexes.discard(name)
+    else:
+        if fields is None:
+            raise KudbError("please set the fields to `drop_index` method.")
+        if isinstance(fields, str):
+            fields = [fields]
+        name = _index_name(fields)
+    with db_lock:
+        db.execute(f"DROP INDEX IF EXISTS {name}")
+        _commit()
+
+
+def _fulltext_state() -> Optional[Tuple[List[str], int, int]]:
+    """(fields, max_id, progress) of the fulltext index, or None"""
+    assert db is not None
+    table = _doc_table()
+    found = db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+        [table + "_fts_state"],
+    ).fetchone()
+    if found is None:
+        return None
+    row = db.execute(
+        f"SELECT fields, max_id, progress FROM {table}_fts_state"
+    ).fetchone()
+    return json.loads(row[0]), row[1], row[2]
+
+
+def disable_fulltext(file: Optional[str] = None) -> None:
+    """drop the fulltext index and its triggers"""
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `disable_fulltext` method.")
+    if _in_batch():
+        raise KudbError("`disable_fulltext` can not be used in `batch()`.")
+    table = _doc_table()
+    with db_lock:
+        db.executescript(f"""
+            DROP TRIGGER IF EXISTS {table}_fts_ai;
+            DROP TRIGGER IF EXISTS {table}_fts_ad;
+            DROP TRIGGER IF EXISTS {table}_fts_au;
+            DROP TABLE IF EXISTS {table}_fts;
+            DROP VIEW IF EXISTS {table}_fts_src;
+            DROP TABLE IF EXISTS {table}_fts_state;
+            """)
+
+
+def enable_fulltext(
+    fields: List[str], batch_size: int = 1000, file: Optional[str] = None
+) -> int:
+    """
+    make a FTS5 index over document fields (kept in sync by triggers)
+    existing docs are indexed in batches of batch_size, one transaction each,
+    and calling it again resumes an interrupted indexing
+    return the number of docs indexed by this call
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'title': 'Red apple', 'body': 'sweet fruit'},
+    ...              {'title': 'Green tea', 'body': 'bitter drink'}])
+    >>> enable_fulltext(['title', 'body'], batch_size=1)
+    2
+    >>> _ = insert({'title': 'Apple pie', 'body': 'apple and sugar'})
+    >>> [d['title'] for d in search('apple')]
+    ['Apple pie', 'Red apple']
+    >>> disable_fulltext()
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `enable_fulltext` method.")
+    if _in_batch():
+        raise KudbError("`enable_fulltext` can not be used in `batch()`.")
+    if isinstance(fields, str):
+        fields = [fields]
+    if len(fields) == 0:
+        raise KudbError("fields must not be empty in `enable_fulltext` method.")
+    table = _doc_table()
+    state = _fulltext_state()
+    if state is not None and state[0] != list(fields):
+        disable_fulltext()
+        state = None
+    # FTS columns are c0, c1, ... (field names may not be valid identifiers)
+    cols = ", ".join(f"c{i}" for i in range(len(fields)))
+    paths = [_json_path(f) for f in fields]
+    extract = ", ".join(f"json_extract(value, {p})" for p in paths)
+    extract_new = ", ".join(f"json_extract(new.value, {p})" for p in paths)
+    extract_old = ", ".join(f"json_extract(old.value, {p})" for p in paths)
+    extract_as = ", ".join(
+        f"json_extract(value, {p}) AS c{i}" for i, p in enumerate(paths)
+    )
+    if state is None:
+        with db_lock:
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                max_id = db.execute(f"SELECT max(id) FROM {table}").fetchone()[0] or 0
+                # a row is indexed when id > max_id or id <= progress
+                indexed = "{row}.id > %d OR {row}.id <= "
+                indexed += f"(SELECT progress FROM {table}_fts_state)"
+                indexed %= max_id
+                new_ok = indexed.format(row="new")
+                old_ok = indexed.format(row="old")
+                for sql in [
+                    f"CREATE TABLE {table}_fts_state "
+                    "(fields TEXT, max_id INTEGER, progress INTEGER)",
+                    f"INSERT INTO {table}_fts_state VALUES (?, ?, 0)",
+                    f"CREATE VIEW {table}_fts_src AS SELECT id, {extract_as} FROM {table}",
+                    f"CREATE VIRTUAL TABLE {table}_fts USING fts5("
+                    f"{cols}, content='{table}_fts_src', content_rowid='id')",
+                    f"""CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table}
+                    WHEN {new_ok} BEGIN
+                        INSERT INTO {table}_fts (rowid, {cols})
+                        VALUES (new.id, {extract_new});
+                    END""",
+                    f"""CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table}
+                    WHEN {old_ok} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, {cols})
+                        VALUES ('delete', old.id, {extract_old});
+                    END""",
+                    f"""CREATE TRIGGER {table}_fts_au AFTER UPDATE ON {table}
+                    WHEN {old_ok} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, {cols})
+                        VALUES ('delete', old.id, {extract_old});
+                        INSERT INTO {table}_fts (rowid, {cols})
+                        VALUES (new.id, {extract_new});
+                    END""",
+                ]:
+                    if "?" in sql:
+                        db.execute(sql, [json.dumps(list(fields)), max_id])
+                    else:
+                        db.execute(sql)
+                db.commit()
+            except Exception as err:
+                db.rollback()
+                raise KudbError("could not enable fulltext: " + str(err)) from err
+        state = (list(fields), max_id, 0)
+    # index existing docs in bounded batches
+    _, max_id, progress = state
+    total = 0
+    while progress < max_id:
+        with db_lock:
+            try:
+                upper = db.execute(
+                    f"SELECT max(id), count(id) FROM (SELECT id FROM {table} "
+                    "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+                    [progress, max_id, batch_size],
+                ).fetchone()
+                upper_id = upper[0] if upper[0] is not None else max_id
+                db.execute(
+                    f"INSERT INTO {table}_fts (rowid, {cols}) "
+                    f"SELECT id, {extract} FROM {table} WHERE id > ? AND id <= ?",
+                    [progress, upper_id],
+                )
+                db.execute(f"UPDATE {table}_fts_state SET progress=?", [upper_id])
+                db.commit()
+            except Exception as err:
+                db.rollback()
+                raise KudbError("could not build fulltext index: " + str(err)) from err
+        total += upper[1]
+        progress = upper_id
+    return total
+
+
+def search(
+    query: str,
+    limit: int = 20,
+    highlight: Optional[Tuple[str, str]] = None,
+    file: Optional[str] = None,
+) -> List[Any]:
+    """
+    fulltext search (FTS5 query syntax), docs are ordered by BM25 rank
+    highlight=(open, close) adds `_highlight` {field: marked text} to dict docs
+
+    >>> clear(file=MEMORY_FILE)
+    >>> _ = enable_fulltext(['title'])
+    >>> insert_many([{'title': 'Red apple'}, {'title': 'Green tea'}])
+    >>> search('tea', highlight=('[', ']'))[0]['_highlight']
+    {'title': 'Green [tea]'}
+    >>> disable_fulltext()
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `search` method.")
+    state = _fulltext_state()
+    if state is None:
+        raise KudbError("please call `enable_fulltext` before using `search` method.")
+    fields = state[0]
+    table = _doc_table()
+    marks = ""
+    if highlight is not None:
+        marks = "".join(
+            f", highlight({table}_fts, {i}, ?, ?)" for i in range(len(fields))
+        )
+    params: List[Any] = []
+    if highlight is not None:
+        params += list(highlight) * len(fields)
+    params += [query, limit]
+    result = []
+    try:
+        cur = db.cursor()
+        cur.execute(
+            f"SELECT d.value, d.id{marks} FROM {table}_fts "
+            f"JOIN {table} AS d ON d.id = {table}_fts.rowid "
+            f"WHERE {table}_fts MATCH ? AND {SQLS['live']} "
+            "ORDER BY rank LIMIT ?",
+            params,
+        )
+        for row in cur:
+            values = json.loads(row[0])
+            if isinstance(values, dict):
+                values["id"] = row[1]
+                if highlight is not None:
+                    values["_highlight"] = {
+                        f: v for f, v in zip(fields, row[2:]) if v is not None
+                    }
+            result.append(values)
+        cur.close()
+    except Exception as err:
+        raise KudbError("fulltext search error: " + str(err)) from err
+    return result
+
+
+def _changes_enabled() -> bool:
+    """check that the change log of the current table exists"""
+    return _table_exists(cur_tablename + "_changes")
+
+
+def disable_changes(file: Optional[str] = None) -> None:
+    """drop the change log and its triggers"""
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `disable_changes` method.")
+    if _in_batch():
+        raise KudbError("`disable_changes` can not be used in `batch()`.")
+    log = cur_tablename + "_changes"
+    with db_lock:
+        db.executescript(
+            "".join(f"DROP TRIGGER IF EXISTS {log}_{n};" for n in CHANGE_TRIGGERS)
+            + f"DROP TABLE IF EXISTS {log};"
+        )
+
+
+def enable_changes(file: Optional[str] = None) -> None:
+    """
+    record every insert, update and delete of keys and docs in a change log
+    (kept by triggers; the log holds one row per key/doc, deletes stay as tombstones)
+    existing keys and docs are logged as changes, so `changes_since(0)` is a full sync
+
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'name': 'A'}, {'name': 'B'}])
+    >>> enable_changes()
+    >>> changes, token = changes_since(0)
+    >>> [(c['type'], c['id'], c['op']) for c in changes]
+    [('doc', 1, 'set'), ('doc', 2, 'set')]
+    >>> update_by_id(1, {'name': 'A2'})
+    >>> delete(id=2)
+    >>> set_key('k', 1)
+    >>> changes, token = changes_since(token)
+    >>> [(c['type'], c.get('id', c.get('key')), c['op']) for c in changes]
+    [('doc', 1, 'set'), ('doc', 2, 'delete'), ('key', 'k', 'set')]
+    >>> changes[0]['value']['name']
+    'A2'
+    >>> changes_since(token)[0]
+    []
+    >>> disable_changes()
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `enable_changes` method.")
+    if _in_batch():
+        raise KudbError("`enable_changes` can not be used in `batch()`.")
+    kvs = cur_tablename
+    doc = _doc_table()
+    log = kvs + "_changes"
+    if _changes_enabled():
+        return
+    # REPLACE moves the row of a key/doc to the end of the log (new seq)
+    upsert = f"INSERT OR REPLACE INTO {log} (kind, ref, deleted, time) VALUES"
+    now = "(julianday('now') - 2440587.5) * 86400.0"
+    with db_lock:
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for sql in [
+                f"""CREATE TABLE {log} (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT,
+                    ref,
+                    deleted INTEGER DEFAULT 0,
+                    time REAL DEFAULT 0,
+                    UNIQUE (kind, ref)
+                )""",
+                f"INSERT INTO {log} (kind, ref, time) "
+                f"SELECT 'key', key, mtime FROM {kvs} ORDER BY key_id",
+                f"INSERT INTO {log} (kind, ref, time) "
+                f"SELECT 'doc', id, mtime FROM {doc} ORDER BY id",
+                f"""CREATE TRIGGER {log}_key_ai AFTER INSERT ON {kvs} BEGIN
+                    {upsert} ('key', new.key, 0, {now});
+                END""",
+                f"""CREATE TRIGGER {log}_key_au AFTER UPDATE ON {kvs} BEGIN
+                    {upsert} ('key', new.key, 0, {now});
+                END""",
+                f"""CREATE TRIGGER {log}_key_ad AFTER DELETE ON {kvs} BEGIN
+                    {upsert} ('key', old.key, 1, {now});
+                END""",
+                f"""CREATE TRIGGER {log}_doc_ai AFTER INSERT ON {doc} BEGIN
+                    {upsert} ('doc', new.id, 0, {now});
+                END""",
+                f"""CREATE TRIGGER {log}_doc_au AFTER UPDATE ON {doc} BEGIN
+                    {upsert} ('doc', new.id, 0, {now});
+                END""",
+                f"""CREATE TRIGGER {log}_doc_ad AFTER DELETE ON {doc} BEGIN
+                    {upsert} ('doc', old.id, 1, {now});
+                END""",
+            ]:
+                db.execute(sql)
+            db.commit()
+        except Exception as err:
+            db.rollback()
+            raise KudbError("could not enable changes: " + str(err)) from err
+
+
+def changes_since(
+    token: int = 0, limit: int = 1000, file: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    get keys and docs changed after `token` (at most `limit`, oldest first)
+    return (changes, new_token); call again with new_token until changes is empty
+    each change is {'type': 'doc', 'id': ..., 'op': 'set'|'delete', 'value': ..., 'token': ...}
+    (or 'type': 'key' with 'key' instead of 'id'); 'value' is None for 'delete'
+    """
+    if file is not None:
+        connect(file)
+    if db is None:
+        raise KudbError("please connect before using `changes_since` method.")
+    if not _changes_enabled():
+        raise KudbError(
+            "please call `enable_changes` before using `changes_since` method."
+        )
+    log = cur_tablename + "_changes"
+    sql = f"""
+    SELECT c.seq, c.kind, c.ref, c.deleted, coalesce(d.value, k.value)
+    FROM {log} AS c
+    LEFT JOIN {_doc_table()} AS d ON c.kind = 'doc' AND d.id = c.ref
+    LEFT JOIN {cur_tablename} AS k ON c.kind = 'key' AND k.key = c.ref
+    WHERE c.seq > ? ORDER BY c.seq LIMIT ?
+    """
+    changes = []
+    for seq, kind, ref, deleted, value in db.execute(sql, [token, limit]):
+        change: Dict[str, Any] = {"type": kind, "id" if kind == "doc" else "key": ref}
+        if deleted or value is None:
+            change.update(op="delete", value=None)
+        else:
+            values = json.loads(value)
+            if kind == "doc" and isinstance(values, dict):
+                values["id"] = ref
+            change.update(op="set", value=values)
+        change["token"] = seq
+        changes.append(change)
+        token = seq
+    if instrumented:
+        _count_rows_scanned(len(changes))
+    return changes, token
+
+
+def _cap_table() -> str:
+    """name of the table with the caps and size of a capped collection"""
+    return _doc_table() + "_cap"
+
+
+def _cap_trim_sqls(step: int, count: bool, size: bool) -> List[str]:
+    """
+    delete the oldest docs (at most `step`) over the caps, using the primary key
+    (`count` / `size`: the collection is capped by docs / by bytes)
+    """
+    table = _doc_table()
+    cap = _cap_table()
+    sqls = []
+    if count:
+        sqls.append(f"""DELETE FROM {table} WHERE id IN (
+            SELECT id FROM {table} ORDER BY id LIMIT min({step},
+                max(0, (SELECT doc_count - max_count FROM {cap}))))""")
+    if size:
+        # walk from the oldest doc until the walked bytes cover the excess
+        sqls.append(f"""DELETE FROM {table} WHERE id IN (
+            WITH RECURSIVE walk(id, total) AS (
+                SELECT id, length(CAST(value AS BLOB)) FROM {table}
+                WHERE id = (SELECT min(id) FROM {table})
+                    AND (SELECT doc_bytes > max_bytes FROM {cap})
+                UNION ALL
+                SELECT d.id, walk.total + length(CAST(d.value AS BLOB)) FROM walk
+                JOIN {table} AS d ON d.id = (SELECT min(id) FROM {table} WHERE id > walk.id)
+                WHERE walk.total < (SELECT doc_bytes - max_bytes FROM {cap})
+                LIMIT {step})
+            SELECT id FROM walk)""")
+    return sqls
+
+
+def create_collection(
+    name: str,
+    capped: Optional[int] = None,
+    capped_bytes: Optional[int] = None,
+    file: Optional[str] = None,
+) -> None:
+    """
+    connect to the collection (table) `name` and make it capped:
+    a ring buffer that keeps only the newest `capped` docs
+    (and/or the newest docs that fit in `capped_bytes` bytes of JSON)
+    triggers delete the oldest docs in the statement that inserts new ones,
+    so the table size and `recent` stay the same however long it runs
+    without caps, the collection is (made) an ordinary one
+
+    >>> create_collection('events', capped=3, file=MEMORY_FILE)
+    >>> insert_many([{'n': i} for i in range(5)])
+    >>> [e['n'] for e in recent(10)]
+    [2, 3, 4]
+    >>> insert({'n': 5})
+    6
+    >>> [e['id'] for e in get_all()]
+    [4, 5, 6]
+    >>> create_collection('events')
+    >>> insert({'n': 6})
+    7
+    >>> count_doc()
+    4
+    """
+    if file is None:
+        if db is None:
+            raise KudbError("please connect before using `create_collection` method.")
+        file = cur_filename
+    if _in_batch():
+        raise KudbError("`create_collection` can not be used in `batch()`.")
+    for cap_value in (capped, capped_bytes):
+        if cap_value is not None and cap_value < 1:
+            raise KudbError("the caps of a collection must be positive numbers.")
+    connect(file, name)
+    assert db is not None
+    table = _doc_table()
+    cap = _cap_table()
+    with db_lock:
+        db.executescript(
+            "".join(f"DROP TRIGGER IF EXISTS {cap}_{n};" for n in CAP_TRIGGERS)
+            + f"DROP TABLE IF EXISTS {cap};"
+        )
+        if capped is None and capped_bytes is None:
+            return
+        length = "length(CAST({}.value AS BLOB))"
+        by_count, by_size = capped is not None, capped_bytes is not None
+        trim = ";".join(_cap_trim_sqls(CAP_STEP, by_count, by_size))
+        try:
+            for sql in [
+                f"""CREATE TABLE {cap} (
+                    max_count INTEGER, max_bytes INTEGER,
+                    doc_count INTEGER, doc_bytes INTEGER)""",
+                f"""INSERT INTO {cap} SELECT ?, ?,
+                    count(id), coalesce(sum({length.format(table)}), 0) FROM {table}""",
+                f"""CREATE TRIGGER {cap}_ai AFTER INSERT ON {table} BEGIN
+                    UPDATE {cap} SET doc_count = doc_count + 1,
+                        doc_bytes = doc_bytes + {length.format('new')};
+                    {trim};
+                END""",
+                f"""CREATE TRIGGER {cap}_au AFTER UPDATE OF value ON {table} BEGIN
+                    UPDATE {cap} SET doc_bytes = doc_bytes
+                        + {length.format('new')} - {length.format('old')};
+                    {trim};
+                END""",
+                f"""CREATE TRIGGER {cap}_ad AFTER DELETE ON {table} BEGIN
+                    UPDATE {cap} SET doc_count = doc_count - 1,
+                        doc_bytes = doc_bytes - {length.format('old')};
+                END""",
+            ]:
+                if "?" in sql:
+                    db.execute(sql, [capped, capped_bytes])
+                else:
+                    db.execute(sql)
+            db.commit()
+        except Exception as err:
+            db.rollback()
+            raise KudbError("could not make capped collection: " + str(err)) from err
+    # trim the docs that are already there, one small transaction at a time
+    while True:
+        with db_lock:
+            before = db.total_changes
+            for sql in _cap_trim_sqls(1000, by_count, by_size):
+                db.execute(sql)
+            db.commit()
+            if db.total_changes == before:
+                break
+
+
+# --- sharded storage ---
+SHARDS_FILE = "shards.json"
+# rows read from one shard at a time by scans
+SHARD_PAGE = 1000
+
+
+class ShardedDB:
+    """
+    kvs and docs spread over `shards` SQLite files (see `connect_sharded`)
+
+    Keys are routed by crc32, documents are written round-robin.
+    A document id encodes its shard: `id = rowid * shards + shard`.
+    New ids continue from the largest id in the files, so ids follow
+    insertion order across reopens (and `get_all` is oldest-first).
+    """
+
+    def __init__(self, dirname: str, shards: int = 16, table_name: str = "kudb"):
+        if shards < 1:
+            raise KudbError("shards must be 1 or more.")
+        path = Path(dirname)
+        path.mkdir(parents=True, exist_ok=True)
+        info_file = path / SHARDS_FILE
+        if info_file.exists():
+            info = json.loads(info_file.read_text())
+            if info["shards"] != shards:
+                raise KudbError(
+                    f"{dirname} has {info['shards']} shards (not {shards})."
+                )
+        else:
+            info_file.write_text(json.dumps({"shards": shards}))
+        self.shards = shards
+        self.sqls = _make_sqls(table_name)
+        self.conns: List[sqlite3.Connection] = []
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.id_lock = threading.Lock()
+        for i in range(shards):
+            conn = sqlite3.connect(
+                str(path / f"shard-{i:03d}.db"), check_same_thread=False
+            )
+            conn.executescript(self.sqls["create"] + ";" + self.sqls["create_doc"])
+            conn.executescript(
+                ";".join(
+                    self.sqls[kind]
+                    for kind in ("create_index", "create_doc_index") + LAZY_INDEXES
+                )
+            )
+            self.conns.append(conn)
+        self.next_id = self._max_id() + 1
+
+    def _max_id(self) -> int:
+        """largest (global) doc id in the files (shards - 1 if there is none)"""
+        max_id = self.shards - 1
+        for i, conn in enumerate(self.conns):
+            with self.locks[i]:
+                rowid = conn.execute(self.sqls["doc_id_range"]).fetchone()[1]
+            if rowid is not None:
+                max_id = max(max_id, rowid * self.shards + i)
+        return max_id
+
+    def _insert_rows(self, rows: List[List[Any]]) -> List[int]:
+        """
+        insert rows ([value, tag, ctime, mtime, expires_at]) with consecutive
+        global ids (one transaction per shard) and return the ids
+        """
+        ids = [0] * len(rows)
+        todo = list(range(len(rows)))
+        while todo:
+            with self.id_lock:
+                first = self.next_id
+                self.next_id += len(todo)
+            parts: Dict[int, List[Tuple[int, int]]] = {}
+            for n, pos in enumerate(todo):
+                doc_id = first + n
+                parts.setdefault(doc_id % self.shards, []).append((pos, doc_id))
+            todo = []
+            for i, part in parts.items():
+                with self.locks[i]:
+                    try:
+                        self.conns[i].executemany(
+                            self.sqls["insert_doc_id"],
+                            [
+                                [doc_id // self.shards] + rows[pos]
+                                for pos, doc_id in part
+                            ],
+                        )
+                        self.conns[i].commit()
+                    except sqlite3.IntegrityError:
+                        # another process took these ids: retry with new ones
+                        self.conns[i].rollback()
+                        todo.extend(pos for pos, _ in part)
+                        continue
+                for pos, doc_id in part:
+                    ids[pos] = doc_id
+            if todo:
+                todo.sort()
+                with self.id_lock:
+                    self.next_id = max(self.next_id, self._max_id() + 1)
+        return ids
+
+    def _key_shard(self, key: Any) -> int:
+        """shard number of kvs key (stable across processes)"""
+        return zlib.crc32(str(key).encode("utf-8")) % self.shards
+
+    def _rows(self, i: int, sql: str, params: List[Any]) -> Iterator[Any]:
+        """docs of shard `i` with global ids"""
+        with self.locks[i]:
+            rows = self.conns[i].execute(sql, params).fetchall()
+        for value, rowid in rows:
+            values = json.loads(value)
+            if isinstance(values, dict):
+                values["id"] = rowid * self.shards + i
+            yield rowid * self.shards + i, values
+
+    def set_key(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """set data by key"""
+        i = self._key_shard(key)
+        t = int(time.time())
+        with self.locks[i]:
+            self.conns[i].execute(
+                self.sqls["upsert"], [key, _dumps(value), t, t, _expires_at(ttl)]
+            )
+            self.conns[i].commit()
+
+    def get_key(self, key: str, default: Any = "") -> Any:
+        """get data by key"""
+        i = self._key_shard(key)
+        with self.locks[i]:
+            row = self.conns[i].execute(self.sqls["select"], [key]).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def delete_key(self, key: str) -> None:
+        """delete key"""
+        i = self._key_shard(key)
+        with self.locks[i]:
+            self.conns[i].execute(self.sqls["delete"], [key])
+            self.conns[i].commit()
+
+    def get_keys(self) -> List[str]:
+        """get live keys of all shards"""
+        now = time.time()
+        keys = []
+        for i, conn in enumerate(self.conns):
+            with self.locks[i]:
+                rows = conn.execute(self.sqls["keys"]).fetchall()
+            keys.extend(k for k, exp in rows if exp == 0 or exp > now)
+        return keys
+
+    def insert(
+        self, value: Any, tag: Optional[str] = None, ttl: Optional[float] = None
+    ) -> int:
+        """insert doc and return its (global) id"""
+        t = int(time.time())
+        row = [_dumps(value), tag or "", t, t, _expires_at(ttl)]
+        return self._insert_rows([row])[0]
+
+    def insert_many(
+        self,
+        value_list: List[Any],
+        tag: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """insert many doc (one transaction per shard)"""
+        t = int(time.time())
+        expires_at = _expires_at(ttl)
+        self._insert_rows(
+            [[_dumps(value), tag or "", t, t, expires_at] for value in value_list]
+        )
+
+    def update(self, id: int, new_value: Any, tag: Optional[str] = None) -> None:
+        """update doc by (global) id (tag=None keeps the tag)"""
+        i = id % self.shards
+        t = int(time.time())
+        with self.locks[i]:
+            if tag is None:
+                params = [_dumps(new_value), t, id // self.shards]
+                self.conns[i].execute(self.sqls["update_doc_value"], params)
+            else:
+                params = [_dumps(new_value), tag, t, id // self.shards]
+                self.conns[i].execute(self.sqls["update_doc"], params)
+            self.conns[i].commit()
+
+    def delete(self, id: int) -> None:
+        """delete doc by (global) id"""
+        i = id % self.shards
+        with self.locks[i]:
+            self.conns[i].execute(self.sqls["delete_doc"], [id // self.shards])
+            self.conns[i].commit()
+
+    def get_by_id(self, id: int, def_value: Any = None) -> Any:
+        """get doc by (global) id"""
+        i = id % self.shards
+        for _, values in self._rows(i, self.sqls["get_doc_by_id"], [id // self.shards]):
+            return values
+        return def_value
+
+    def _scan(self, i: int, desc: bool, page: int) -> Iterator[Any]:
+        """all docs of shard `i` in id order, read `page` rows at a time"""
+        sql = self.sqls["select_doc_desc" if desc else "select_doc_asc"]
+        from_id = SQLITE_MAX_INT if desc else 1
+        while True:
+            rows = list(self._rows(i, sql, [from_id, page]))
+            yield from rows
+            if len(rows) < page:
+                return
+            last = rows[-1][0] // self.shards
+            from_id = last - 1 if desc else last + 1
+
+    def _merge(
+        self,
+        streams: List[Iterator[Any]],
+        limit: Optional[int] = None,
+        desc: bool = False,
+        predicate: Optional[Callable[[Any], bool]] = None,
+    ) -> List[Any]:
+        """merge the docs of every shard by id"""
+        merged = heapq.merge(*streams, key=lambda r: r[0], reverse=desc)
+        docs = (values for _, values in merged)
+        if predicate is not None:
+            docs = (values for values in docs if predicate(values))
+        return list(itertools.islice(docs, limit))
+
+    def get_by_tag(self, tag: str, limit: Optional[int] = None) -> List[Any]:
+        """get docs by tag (all shards, id order)"""
+        n = -1 if limit is None else limit
+        sql = self.sqls["get_doc_by_tag"]
+        streams = [self._rows(i, sql, [tag, n]) for i in range(self.shards)]
+        return self._merge(streams, limit)
+
+    def get_all(self, limit: Optional[int] = None, order_asc: bool = True) -> List[Any]:
+        """get all docs (all shards, id order)"""
+        page = SHARD_PAGE if limit is None else limit
+        streams = [self._scan(i, not order_asc, page) for i in range(self.shards)]
+        return self._merge(streams, limit, desc=not order_asc)
+
+    def find(
+        self,
+        callback: Union[Callable[[Any], bool], str, None] = None,
+        keys: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Any]:
+        """find docs in all shards (id order, stops at `limit`)"""
+        if (callback is None) and (keys is not None):
+            callback = _MatchKeys(keys)
+        predicate = _resolve_predicate(callback)
+        if predicate is None:
+            return []
+        streams = [self._scan(i, False, SHARD_PAGE) for i in range(self.shards)]
+        return self._merge(streams, limit, predicate=predicate)
+
+    def count_doc(self) -> int:
+        """count docs of all shards"""
+        total = 0
+        for i, conn in enumerate(self.conns):
+            with self.locks[i]:
+                total += conn.execute(self.sqls["count_doc"]).fetchone()[0]
+        return total
+
+    def clear(self) -> None:
+        """clear kvs and docs of all shards"""
+        for i, conn in enumerate(self.conns):
+            with self.locks[i]:
+                conn.execute(self.sqls["clear"])
+                conn.execute(self.sqls["clear_doc"])
+                conn.commit()
+
+    def close(self) -> None:
+        """close all shards"""
+        for i, conn in enumerate(self.conns):
+            with self.locks[i]:
+                conn.close()
+        self.conns = []
+
+
+def connect_sharded(
+    dirname: str, shards: int = 16, table_name: str = "kudb"
+) -> ShardedDB:
+    """
+    open (or create) `shards` database files in `dirname`
+
+    Every shard has its own connection and writer lock, so writes to
+    different shards from different threads run in parallel.
+    The shard count of a directory can not be changed later.
+
+    >>> import tempfile
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> sdb = connect_sharded(tmp.name, shards=4)
+    >>> sdb.set_key('name', 'Taro')
+    >>> sdb.get_key('name')
+    'Taro'
+    >>> sdb.insert_many([{'name': 'A'}, {'name': 'B'}, {'name': 'C'}])
+    >>> [d['name'] for d in sdb.get_all()]
+    ['A', 'B', 'C']
+    >>> sdb.find(keys={'name': 'B'})[0]['id'] == sdb.get_all()[1]['id']
+    True
+    >>> sdb.close()
+    >>> tmp.cleanup()
+    """
+    try:
+        return ShardedDB(dirname, shards, table_name)
+    except KudbError:
+        raise
+    except Exception as err:
+        raise KudbError("could not open sharded database: " + str(err)) from err
+
+
+def set_tag_name(tag_name: str) -> None:
+    """set tag name (skip writing when it is not changed)"""
+    if "_tag" in CACHE_KEYS and CACHE_META.get("_tag") == tag_name:
+        return
+    set_key("_tag", tag_name)
+    CACHE_META["_tag"] = tag_name
+
+
+def get_tag_name(def_tag_name: str = "tag") -> Any:
+    """
+    get tag name (cached in memory until the `_tag` key is changed)
+
+    >>> clear(file=MEMORY_FILE)
+    >>> get_tag_name()
+    'tag'
+    >>> set_tag_name('name')
+    >>> get_tag_name()
+    'name'
+    """
+    if "_tag" not in CACHE_META:
+        CACHE_META["_tag"] = get_key("_tag", None)
+    tag_name = CACHE_META["_tag"]
+    return def_tag_name if tag_name is None else tag_name
+
+
+def get_high_score(limit: int = 10, score_key: str = "score") -> List[Any]:
+    """
+    get high score docs
+    >>> clear(file=MEMORY_FILE)
+    >>> insert_many([{'name': 'A', 'score': 50}, {'name': 'B', 'score': 80}, {'name': 'C', 'score': 70}])
+    >>> [a['name'] for a in get_high_score(2)]
+    ['B', 'C']
+
+    docs without score_key rank as score 0, ties keep insertion order
+    >>> clear()
+    >>> insert_many([{'name': 'A', 'score': -5}, {'name': 'B'}, {'name': 'C', 'score': 3}])
+    >>> [a['name'] for a in get_high_score()]
+    ['C', 'B', 'A']
+    """
+    if db is None:
+        raise KudbError("please connect before using `get_high_score` method.")
+    sql = (
+        f"SELECT value, id FROM {_doc_table()} WHERE {SQLS['live']} "
+        f"ORDER BY coalesce(json_extract(value, {_json_path(score_key)}), 0) DESC, "
+        "id ASC LIMIT ?"
+    )
+    return [_make_row(row, False) for row in db.execute(sql, [limit])]
+
+
+def insert_score(
+    score: int,
+    name: str,
+    meta: Optional[Dict[str, Any]] = None,
+    score_key: str = "score",
+    file: Optional[str] = None,
 ) -> Optional[int]:
     """
     insert score doc
@@ -990,12 +4107,22 @@ __all__ = [
     "connect",
     "change_db",
     "close",
+    "batch",
+    "connect_sharded",
+    "backup",
+    "snapshot_to_memory",
+    "restore_from",
     # KVS functions
     "get_key",
     "set_key",
     "set_keys_from_dict",
+    "incr",
+    "decr",
+    "compare_and_set",
     "delete_key",
     "get_keys",
+    "scan",
+    "items",
     "get_info",
     "kvs_json",
     "clear_keys",
@@ -1003,20 +4130,48 @@ __all__ = [
     "count_doc",
     "get_all",
     "recent",
+    "get_range",
     "get_by_id",
+    "get_by_ids",
     "get_by_tag",
     "get",
     "get_one",
     "insert",
     "insert_many",
+    "upsert",
+    "upsert_many",
     "update",
     "update_by_tag",
     "update_by_id",
     "delete",
     "clear_doc",
     "clear",
+    "purge_expired",
+    "start_sweeper",
+    "stop_sweeper",
+    "compact",
+    "start_compactor",
+    "stop_compactor",
     "find",
     "find_one",
+    "create_index",
+    "drop_index",
+    "to_columns",
+    "aggregate",
+    "enable_fulltext",
+    "disable_fulltext",
+    "search",
+    "enable_changes",
+    "disable_changes",
+    "changes_since",
+    "create_collection",
+    # Instrumentation
+    "enable_metrics",
+    "disable_metrics",
+    "get_metrics",
+    "metrics_text",
+    "enable_slow_log",
+    "disable_slow_log",
     "set_tag_name",
     "get_tag_name",
     # Score functions
@@ -1024,6 +4179,11 @@ __all__ = [
     "insert_score",
 ]
 
+# record metrics for public functions (see `enable_metrics`)
+for _name in __all__:
+    if callable(globals()[_name]) and _name not in NOT_INSTRUMENTED:
+        globals()[_name] = _instrument(globals()[_name])
+
 if __name__ == "__main__":
     import doctest
 
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+aggregate test script
+"""
+
+import time
+
+import pytest
+
+import kudb
+
+
+def _fill():
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'name': 'A', 'city': 'Tokyo', 'age': 30, 'score': 1.5},
+        {'name': 'B', 'city': 'Osaka', 'age': 20},
+        {'name': 'C', 'city': 'Tokyo', 'age': 40, 'score': 2.5},
+        {'name': 'D', 'city': 'Nagoya', 'age': 'unknown', 'score': 4},
+        {'name': 'E', 'age': 50},
+    ], tag_name='city')
+
+
+def test_aggregate_metrics():
+    """count / sum / avg / min / max をまとめて計算する"""
+    _fill()
+    rows = kudb.aggregate(metrics={
+        'n': 'count',
+        'total': ('sum', 'score'),
+        'avg': ('avg', 'score'),
+        'min': ('MIN', 'age'),
+        'max': ('max', 'score'),
+    })
+    assert rows == [{'n': 5, 'total': 8.0, 'avg': 8.0 / 3, 'min': 20, 'max': 4}]
+
+
+def test_aggregate_numbers_only():
+    """数値以外の値は集計に混ぜない"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'age': 30}, {'age': 'unknown'}, {'age': 50}, {'age': True}, {'name': 'X'}])
+    metrics = {'n': ('count', 'age'), 'sum': ('sum', 'age'), 'avg': ('avg', 'age'), 'max': ('max', 'age')}
+    assert kudb.aggregate(metrics=metrics) == [{'n': 2, 'sum': 80, 'avg': 40.0, 'max': 50}]
+    cols, masks = kudb.to_columns('age', use_numpy=False)
+    assert sum(masks['age']) == 2
+
+def test_aggregate_group_by():
+    """フィールドやタグで集計し、キーの順に返す"""
+    _fill()
+    rows = kudb.aggregate(group_by='city', metrics={'n': 'count', 'total': ('sum', 'age')})
+    assert rows == [
+        {'city': None, 'n': 1, 'total': 50},
+        {'city': 'Nagoya', 'n': 1, 'total': None},
+        {'city': 'Osaka', 'n': 1, 'total': 20},
+        {'city': 'Tokyo', 'n': 2, 'total': 70},
+    ]
+    assert kudb.aggregate(group_by='tag', filter={'city': 'Tokyo'}) == [{'tag': 'Tokyo', 'count': 2}]
+    # 複数キー・件数制限・ストリーム
+    rows = kudb.aggregate(group_by=['city', 'name'], limit=2)
+    assert [(r['city'], r['name']) for r in rows] == [(None, 'E'), ('Nagoya', 'D')]
+    stream = kudb.aggregate(group_by='city', stream=True)
+    assert [r['count'] for r in stream] == [1, 1, 1, 2]
+
+
+def test_aggregate_skips_expired():
+    """期限切れのドキュメントは集計しない"""
+    _fill()
+    kudb.insert({'name': 'F', 'city': 'Tokyo', 'age': 99}, tag_name='city', ttl=0.01)
+    time.sleep(0.02)
+    assert kudb.aggregate(group_by='tag', filter={'city': 'Tokyo'}, metrics={'max': ('max', 'age')}) == [
+        {'tag': 'Tokyo', 'max': 40}
+    ]
+
+
+def test_aggregate_errors():
+    """未知の関数やフィールドのない sum はエラー"""
+    _fill()
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.aggregate(metrics={'x': ('median', 'age')})
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.aggregate(metrics={'x': 'sum'})
+
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+backup / snapshot test script
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+import kudb
+
+
+def test_backup_while_writing():
+    """書き込み中でもバックアップでき、復元できる"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'main.db')
+        dest = os.path.join(tmp, 'backup.db')
+        kudb.connect(path)
+        kudb.clear()
+        kudb.insert_many([{'no': i, 'text': 'x' * 200} for i in range(2000)])
+        kudb.set_key('name', 'Taro')
+        stop = threading.Event()
+
+        def writer():
+            while not stop.is_set():
+                kudb.incr('counter')
+
+        t = threading.Thread(target=writer)
+        t.start()
+        steps = []
+        try:
+            kudb.backup(dest, pages_per_step=16, progress=lambda s, r, total: steps.append(r))
+        finally:
+            stop.set()
+            t.join()
+        assert len(steps) > 1 and steps[-1] == 0
+        kudb.set_key('name', 'Jiro')
+        kudb.clear_doc()
+        # バックアップから復元
+        kudb.restore_from(dest)
+        assert kudb.get_key('name') == 'Taro'
+        assert kudb.count_doc() == 2000
+        kudb.close()
+
+
+def test_snapshot_to_memory():
+    """メモリ上のスナップショットに戻せる"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert({'name': 'A'})
+    snap = kudb.snapshot_to_memory()
+    kudb.insert({'name': 'B'})
+    kudb.set_key('new_key', 1)
+    kudb.restore_from(snap)
+    assert [d['name'] for d in kudb.get_all()] == ['A']
+    assert kudb.get_key('new_key', None) is None
+    snap.close()
+
+
+def test_restore_from_bad_source():
+    """存在しないファイルや kudb 以外のファイルからは復元せず、データも消さない"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'main.db')
+        kudb.connect(path)
+        kudb.set_key('name', 'Taro')
+        kudb.insert({'name': 'A'})
+        missing = os.path.join(tmp, 'typo.db')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.restore_from(missing)
+        assert not os.path.exists(missing)
+        other = os.path.join(tmp, 'other.db')
+        conn = sqlite3.connect(other)
+        conn.execute('CREATE TABLE t (x)')
+        conn.commit()
+        conn.close()
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.restore_from(other)
+        assert kudb.get_key('name') == 'Taro'
+        assert kudb.count_doc() == 1
+        kudb.close()
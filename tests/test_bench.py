@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+kudb.bench test script
+"""
+
+import json
+import os
+import tempfile
+
+import kudb
+from kudb import bench
+
+
+def test_all_functions_have_cases():
+    """公開関数すべてにベンチマークがある"""
+    assert bench.missing_cases() == []
+
+
+def test_run_and_diff():
+    """小さいデータで実行して結果を比較"""
+    result = bench.run(
+        sizes=[50],
+        storages=['memory', 'file'],
+        threads_list=[1, 2],
+        budget=0.01,
+        max_iter=3,
+    )
+    names = {r['name'] for r in result['results']}
+    assert 'find' in names and 'insert' in names
+    for r in result['results']:
+        assert r['ops'] > 0
+        assert r['p50_us'] <= r['p99_us']
+    with tempfile.TemporaryDirectory() as tmp:
+        old = os.path.join(tmp, 'old.json')
+        with open(old, 'w', encoding='utf-8') as fp:
+            json.dump(result, fp)
+        assert bench.main(['diff', old, old]) == 0
+    kudb.connect()
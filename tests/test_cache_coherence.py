@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+key cache coherence test script
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import kudb
+
+
+def test_other_connection_changes():
+    """他のプロセス(接続)の追加・削除がキャッシュに反映される"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'shared.db')
+        kudb.connect(path)
+        kudb.set_key('a', 1)
+        other = sqlite3.connect(path)
+        # 他の接続でキーを追加
+        other.execute("INSERT INTO kudb (key, value) VALUES ('b', '2')")
+        other.commit()
+        assert kudb.get_key('b') == 2
+        assert sorted(kudb.get_keys(False)) == ['a', 'b']
+        # 他の接続でキーを削除してから set_key しても消えない
+        other.execute("DELETE FROM kudb WHERE key='a'")
+        other.commit()
+        kudb.set_key('a', 10)
+        assert other.execute("SELECT value FROM kudb WHERE key='a'").fetchone() == ('10',)
+        # 他の接続でキーを追加してから set_keys_from_dict しても重複エラーにならない
+        other.execute("INSERT INTO kudb (key, value) VALUES ('c', '3')")
+        other.commit()
+        kudb.set_keys_from_dict({'c': 30, 'd': 40})
+        assert kudb.get_key('c') == 30
+        other.close()
+        kudb.close()
+
+
+def test_switch_cached_connection():
+    """キャッシュ済みの接続に戻るとキー一覧も戻る"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path1 = os.path.join(tmp, 'a.db')
+        path2 = os.path.join(tmp, 'b.db')
+        kudb.set_key('x', 1, file=path1)
+        kudb.set_key('y', 2, file=path2)
+        assert kudb.get_keys() == ['y']
+        kudb.connect(path1)
+        assert kudb.get_key('x') == 1
+        assert kudb.get_key('y', None) is None
+        kudb.close()
+        kudb.connect(path2)
+        kudb.close()
+
+
+def test_delta_refresh():
+    """他の接続がコミットしてもキー一覧を全部読み直さず、読んだキーだけ更新する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'shared.db')
+        kudb.connect(path)
+        kudb.set_keys_from_dict({f'k{i}': i for i in range(100)})
+        other = sqlite3.connect(path)
+        other.execute("INSERT INTO kudb (key, value) VALUES ('new', '1')")
+        other.execute("DELETE FROM kudb WHERE key='k1'")
+        other.commit()
+        statements = []
+        kudb.kudb.db.set_trace_callback(statements.append)
+        assert kudb.get_key('new') == 1
+        assert kudb.get_key('k1', None) is None
+        assert kudb.get_key('k2') == 2
+        kudb.kudb.db.set_trace_callback(None)
+        assert not any(s.startswith('SELECT key, expires_at FROM') for s in statements), statements
+        assert 'new' in kudb.kudb.CACHE_KEYS and 'k1' not in kudb.kudb.CACHE_KEYS
+        # get_keys(False) は追加分だけ読む
+        other.execute("INSERT INTO kudb (key, value) VALUES ('new2', '2')")
+        other.commit()
+        assert 'new2' in kudb.get_keys(False)
+        # 全部読み直すと否定キャッシュに戻る
+        assert 'k1' not in kudb.get_keys(True)
+        assert not kudb.kudb.cache_stale
+        other.close()
+        kudb.close()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+capped collection test script
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import kudb
+
+
+def test_capped_by_count():
+    """件数の上限を超えると古いドキュメントから消える"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'capped.db')
+        kudb.connect(path)
+        # 既存のデータも上限まで削られる
+        kudb.create_collection('events')
+        kudb.insert_many([{'n': i} for i in range(5000)])
+        kudb.create_collection('events', capped=100)
+        assert kudb.count_doc() == 100
+        for i in range(50):
+            kudb.insert_many([{'n': 5000 + i * 10 + j} for j in range(10)])
+            assert kudb.count_doc() == 100
+        kudb.insert({'n': 5500})
+        docs = kudb.get_all()
+        assert [d['n'] for d in docs] == list(range(5401, 5501))
+        assert [d['n'] for d in kudb.recent(3)] == [5498, 5499, 5500]
+        # 別の接続からの書き込みもトリガーで削られる
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO docevents (value, tag) VALUES (?, '')", [json.dumps({'n': 5501})])
+        conn.commit()
+        conn.close()
+        assert kudb.count_doc() == 100
+        assert kudb.get_all()[0]['n'] == 5402
+        # 上限を外す
+        kudb.create_collection('events')
+        kudb.insert_many([{'n': i} for i in range(10)])
+        assert kudb.count_doc() == 110
+        kudb.close()
+
+
+def test_capped_by_bytes():
+    """バイト数の上限を超えないように古いドキュメントから消える"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'capped.db'), 'logs')
+        kudb.create_collection('logs', capped_bytes=1000)
+        for i in range(300):
+            kudb.insert({'msg': 'x' * (i % 40)})
+
+        def size():
+            return kudb.kudb.db.execute('SELECT count(*), sum(length(CAST(value AS BLOB))) FROM doclogs').fetchone()
+
+        assert 900 < size()[1] <= 1000
+        # 更新で大きくなった場合も削られる
+        last = kudb.get_all()[-1]['id']
+        kudb.update_by_id(last, {'msg': 'y' * 500})
+        assert size()[1] <= 1000
+        assert kudb.get_by_id(last)['msg'] == 'y' * 500
+        # 削除すると件数とサイズも減る
+        kudb.delete(id=last)
+        assert kudb.kudb.db.execute('SELECT doc_count, doc_bytes FROM doclogs_cap').fetchone() == size()
+        kudb.close()
+
+
+def test_capped_errors():
+    """上限が正でなければエラー"""
+    kudb.connect()
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.create_collection('events', capped=0)
+    kudb.close()
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.create_collection('events', capped=10)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+change feed test script
+"""
+
+import pytest
+
+import kudb
+
+
+def test_changes_since():
+    """変更されたキーとドキュメントだけをバッチで取得できる"""
+    kudb.connect()
+    kudb.clear()
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.changes_since(0)
+    kudb.insert_many([{'no': i} for i in range(25)])
+    kudb.enable_changes()
+    # 既存のデータは最初の同期で全件返す (limit ごとのバッチ)
+    token = 0
+    synced = []
+    while True:
+        changes, token = kudb.changes_since(token, limit=10)
+        if not changes:
+            break
+        assert len(changes) <= 10
+        synced.extend(c['value']['no'] for c in changes)
+    assert synced == list(range(25))
+    # 更新・削除・キー
+    kudb.update_by_id(3, {'no': 300})
+    kudb.update_by_id(3, {'no': 301})
+    kudb.delete(id=5)
+    kudb.set_key('a', 1)
+    kudb.delete_key('a')
+    changes, token2 = kudb.changes_since(token)
+    assert [(c['type'], c.get('id', c.get('key')), c['op']) for c in changes] == [
+        ('doc', 3, 'set'), ('doc', 5, 'delete'), ('key', 'a', 'delete')]
+    assert changes[0]['value'] == {'no': 301, 'id': 3}
+    assert token2 == changes[-1]['token']
+    assert kudb.changes_since(token2) == ([], token2)
+    # 二度目の enable は何もしない
+    kudb.enable_changes()
+    assert kudb.changes_since(token2) == ([], token2)
+    kudb.disable_changes()
+    kudb.insert({'no': 99})
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.changes_since(0)
+
+
+def test_disable_in_batch():
+    """batch() の中では使えず、途中の書き込みもコミットしない"""
+    kudb.connect()
+    kudb.clear()
+    kudb.enable_changes()
+    with pytest.raises(kudb.kudb.KudbError):
+        with kudb.batch():
+            kudb.insert({'no': 1})
+            kudb.disable_changes()
+    assert kudb.count_doc() == 0
+    kudb.disable_changes()
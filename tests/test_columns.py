@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+to_columns test script
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import kudb
+
+
+def _fill():
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'price': 100, 'qty': 2, 'shop': 'a'},
+        {'price': 250.5, 'shop': 'b'},
+        {'price': 'free', 'qty': 1, 'shop': 'a'},
+        {'price': None, 'qty': 3.5, 'shop': 'a'},
+    ])
+
+
+def test_columns_array():
+    """numpy なしでは array.array に取り出し、数値以外はマスクする"""
+    _fill()
+    cols, masks = kudb.to_columns(['price', 'qty'], use_numpy=False)
+    assert cols['price'].typecode == 'd'
+    assert cols['price'].tolist() == [100.0, 250.5, 0.0, 0.0]
+    assert masks['price'].tolist() == [1, 1, 0, 0]
+    assert cols['qty'].tolist() == [2.0, 0.0, 1.0, 3.5]
+    assert masks['qty'].tolist() == [1, 0, 1, 1]
+    # 整数型と絞り込み
+    cols, masks = kudb.to_columns('qty', filter={'shop': 'a'}, dtype='q', use_numpy=False)
+    assert cols['qty'].tolist() == [2, 1, 3]
+    # 不正な型コード
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.to_columns(['price'], dtype='float64', use_numpy=False)
+
+
+def test_columns_numpy():
+    """numpy があれば ndarray とブール型のマスクを返す"""
+    np = pytest.importorskip('numpy')
+    _fill()
+    cols, masks = kudb.to_columns(['price', 'qty'])
+    assert isinstance(cols['price'], np.ndarray)
+    assert cols['price'].dtype == np.float64
+    assert masks['price'].dtype == np.bool_
+    assert cols['price'].tolist() == [100.0, 250.5, 0.0, 0.0]
+    assert masks['price'].tolist() == [True, True, False, False]
+    assert cols['qty'][masks['qty']].sum() == 6.5
+    cols, _ = kudb.to_columns(['qty'], filter={'shop': 'a'}, dtype='int64', use_numpy=True)
+    assert cols['qty'].dtype == np.int64
+    assert cols['qty'].tolist() == [2, 1, 3]
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_columns_rows_deleted_while_reading(use_numpy):
+    """件数を数えた後に削除された行の分は切り詰める"""
+    if use_numpy:
+        pytest.importorskip('numpy')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cols.db')
+        kudb.connect(path)
+        kudb.insert_many([{'v': i} for i in range(10)])
+        other = sqlite3.connect(path)
+
+        def delete_before_select(sql):
+            # 件数を数えた後、読み出しの前に別の接続が削除する
+            if sql.startswith('SELECT CASE'):
+                other.execute('DELETE FROM dockudb WHERE id > 7')
+                other.commit()
+
+        kudb.kudb.db.set_trace_callback(delete_before_select)
+        try:
+            cols, masks = kudb.to_columns(['v'], use_numpy=use_numpy)
+        finally:
+            kudb.kudb.db.set_trace_callback(None)
+        assert list(cols['v']) == [float(i) for i in range(7)]
+        assert len(masks['v']) == 7
+        other.close()
+        kudb.close()
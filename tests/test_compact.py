@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+compact (incremental vacuum) test script
+"""
+
+import os
+import tempfile
+import time
+
+import kudb
+
+
+def test_compact_incremental():
+    """削除後に compact すると少しずつファイルが小さくなる"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'vacuum.db')
+        kudb.connect(path, auto_vacuum='incremental')
+        db = kudb.kudb.db
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        kudb.insert_many([{'no': i, 'text': 'x' * 500} for i in range(3000)])
+        size = os.path.getsize(path)
+        kudb.clear_doc()
+        free = db.execute('PRAGMA freelist_count').fetchone()[0]
+        assert free > 200
+        # max_pages ごとに少しずつ
+        assert kudb.compact(max_pages=100) == 100
+        assert db.execute('PRAGMA freelist_count').fetchone()[0] == free - 100
+        assert kudb.compact() == free - 100
+        assert os.path.getsize(path) < size / 2
+        assert kudb.compact() == 0
+        kudb.close()
+
+
+def test_compact_without_auto_vacuum():
+    """auto_vacuum なしのファイルでは何もしない"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'plain.db')
+        kudb.connect(path)
+        kudb.insert_many([{'no': i, 'text': 'x' * 500} for i in range(500)])
+        kudb.clear_doc()
+        assert kudb.compact() == 0
+        kudb.close()
+        # 既存のファイルの設定は変えない
+        kudb.connect(path, auto_vacuum='incremental')
+        assert kudb.kudb.db.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+        kudb.close()
+
+
+def test_compactor_thread():
+    """書き込みがない間にバックグラウンドで compact する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'idle.db')
+        kudb.connect(path, auto_vacuum='incremental')
+        db = kudb.kudb.db
+        kudb.insert_many([{'no': i, 'text': 'x' * 500} for i in range(1000)])
+        kudb.clear_doc()
+        kudb.start_compactor(interval=0.01, max_pages=10000, time_budget=1.0)
+        for _ in range(200):
+            if db.execute('PRAGMA freelist_count').fetchone()[0] == 0:
+                break
+            time.sleep(0.01)
+        kudb.stop_compactor()
+        assert db.execute('PRAGMA freelist_count').fetchone()[0] == 0
+        kudb.close()
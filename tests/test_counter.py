@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+incr / decr / compare_and_set test script
+"""
+
+import os
+import tempfile
+import threading
+import multiprocessing
+import sqlite3
+
+import pytest
+
+import kudb
+
+
+def _worker(filename, count):
+    kudb.connect(filename)
+    for _ in range(count):
+        kudb.incr('hits')
+    kudb.close()
+
+
+def test_incr_threads():
+    """スレッドから同時にカウントアップ"""
+    kudb.connect()
+    kudb.clear()
+    threads = [
+        threading.Thread(target=lambda: [kudb.incr('hits') for _ in range(200)])
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert kudb.get_key('hits') == 1600
+
+
+def test_incr_processes():
+    """複数プロセスから同じファイルをカウントアップ"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'counter.db')
+        kudb.connect(filename)
+        procs = [
+            multiprocessing.Process(target=_worker, args=(filename, 50))
+            for _ in range(4)
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        kudb.get_keys(True)
+        assert kudb.get_key('hits') == 200
+        kudb.close()
+
+
+def test_incr_not_number():
+    """数値以外のキーはエラー"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('name', 'Taro')
+    try:
+        kudb.incr('name')
+        assert False, "例外が発生すべき"
+    except kudb.kudb.KudbError as e:
+        assert "not a number" in str(e)
+    assert kudb.get_key('name') == 'Taro'
+
+
+def test_compare_and_set():
+    """compare_and_set の基本動作"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('v', {'a': 1})
+    assert kudb.compare_and_set('v', {'a': 2}, 3) is False
+    assert kudb.compare_and_set('v', {'a': 1}, 3) is True
+    assert kudb.get_key('v') == 3
+
+
+def test_batch_rollback():
+    """batch() 内の例外はまとめてロールバック"""
+    kudb.connect()
+    kudb.clear()
+    try:
+        with kudb.batch():
+            kudb.incr('n')
+            kudb.insert({'name': 'A'})
+            raise ValueError('stop')
+    except ValueError:
+        pass
+    assert kudb.get_key('n', None) is None
+    assert kudb.count_doc() == 0
+
+
+def test_batch_other_thread():
+    """batch() 中の別スレッドの書き込みは巻き込まず、終わるまで待つ"""
+    kudb.connect()
+    kudb.clear()
+    writer = threading.Thread(target=lambda: kudb.set_key('other', 1))
+    try:
+        with kudb.batch():
+            kudb.incr('n')
+            writer.start()
+            writer.join(0.1)
+            assert writer.is_alive()
+            raise ValueError('stop')
+    except ValueError:
+        pass
+    writer.join()
+    assert kudb.get_key('n', None) is None
+    assert kudb.get_key('other') == 1
+    assert not kudb.kudb.db.in_transaction
+
+def test_incr_precision_and_range():
+    """実数は精度を落とさず保存し、範囲外の結果はエラー"""
+    kudb.connect()
+    kudb.clear()
+    assert kudb.incr('x', 1 / 3) == 1 / 3
+    assert kudb.incr('x', 0) == 1 / 3
+    assert kudb.incr('x', 0.1) == 1 / 3 + 0.1
+    # Python で計算した値で compare_and_set できる
+    assert kudb.compare_and_set('x', 1 / 3 + 0.1, 1.5)
+    assert kudb.get_key('x') == 1.5
+    kudb.set_key('big', 2 ** 63 - 1)
+    try:
+        kudb.incr('big')
+        assert False, "例外が発生すべき"
+    except kudb.kudb.KudbError as e:
+        assert 'range' in str(e)
+    assert kudb.get_key('big') == 2 ** 63 - 1
+    kudb.set_key('huge', 1e308)
+    try:
+        kudb.incr('huge', 1e308)
+        assert False, "例外が発生すべき"
+    except kudb.kudb.KudbError as e:
+        assert 'range' in str(e)
+    assert kudb.get_key('huge') == 1e308
+
+
+def test_incr_error_releases_lock():
+    """失敗した incr は書き込みロックを残さず、decr の n も検査する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'counter.db')
+        kudb.connect(filename)
+        kudb.set_key('name', 'Taro')
+        kudb.set_key('big', 2 ** 63 - 1)
+        other = sqlite3.connect(filename, timeout=0)
+        for key in ('name', 'big'):
+            with pytest.raises(kudb.kudb.KudbError):
+                kudb.incr(key)
+            other.execute("INSERT INTO kudb (key, value) VALUES (?, '1')", ['other:' + key])
+            other.commit()
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.decr('n', 'a')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.decr('n', True)
+        other.close()
+        kudb.close()
+
+
+def test_old_sqlite(monkeypatch):
+    """RETURNING のない古い SQLite でも基本の読み書きはでき、incr などはエラー"""
+    monkeypatch.setattr(sqlite3, 'sqlite_version_info', (3, 31, 1))
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('a', 1)
+    kudb.insert({'name': 'A'})
+    assert kudb.get_key('a') == 1
+    assert kudb.count_doc() == 1
+    for call in (lambda: kudb.incr('a'), lambda: kudb.compare_and_set('a', 1, 2),
+                 lambda: kudb.upsert({'name': 'A'}, tag='A'), kudb.purge_expired):
+        with pytest.raises(kudb.kudb.KudbError) as e:
+            call()
+        assert '3.35' in str(e.value)
+    assert kudb.get_key('a') == 1
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+field projection test script
+"""
+
+import kudb
+
+
+def _insert_wide_docs():
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'name': 'apple', 'price': 100, 'meta': {'color': 'red'}, 'payload': ['x' * 100] * 10},
+        {'name': 'banana', 'price': 80, 'meta': {'color': 'yellow'}, 'payload': ['y' * 100] * 10},
+        {'name': 'cherry', 'price': 300, 'payload': []},
+    ], tag_name='name')
+
+
+def test_fields_projection():
+    """指定したフィールドだけを返す"""
+    _insert_wide_docs()
+    assert kudb.get_all(fields=['name', 'price']) == [
+        {'name': 'apple', 'price': 100, 'id': 1},
+        {'name': 'banana', 'price': 80, 'id': 2},
+        {'name': 'cherry', 'price': 300, 'id': 3}]
+    assert kudb.recent(1, fields=['name']) == [{'name': 'cherry', 'id': 3}]
+    assert kudb.get_by_tag('banana', fields=['price']) == [{'price': 80, 'id': 2}]
+    # ネストしたオブジェクトと存在しないフィールド
+    assert kudb.get_all(limit=1, fields=['meta', 'meta.color', 'none']) == [
+        {'meta': {'color': 'red'}, 'meta.color': 'red', 'none': None, 'id': 1}]
+
+
+def test_find_fields():
+    """find は条件に使ったキーを結果から除く"""
+    _insert_wide_docs()
+    assert kudb.find(keys={'name': 'apple'}, fields=['price']) == [{'price': 100, 'id': 1}]
+    assert kudb.find(lambda v: v['price'] < 200, fields=['name', 'price']) == [
+        {'name': 'apple', 'price': 100, 'id': 1},
+        {'name': 'banana', 'price': 80, 'id': 2}]
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+enable_fulltext / search test script
+"""
+
+import kudb
+
+
+def _integrity_check():
+    db = kudb.kudb.db
+    db.execute("INSERT INTO dockudb_fts (dockudb_fts) VALUES ('integrity-check')")
+
+
+def test_search_follows_changes():
+    """挿入・更新・削除が全文検索に反映される"""
+    kudb.connect()
+    kudb.clear()
+    kudb.disable_fulltext()
+    kudb.insert_many([{'title': f'item {i}', 'body': 'common'} for i in range(10)])
+    assert kudb.enable_fulltext(['title', 'body'], batch_size=3) == 10
+    kudb.update(id=2, new_value={'title': 'special', 'body': 'changed'})
+    kudb.delete(id=3)
+    kudb.insert({'title': 'special new', 'body': 'common'}, tag='x')
+    assert [d['id'] for d in kudb.search('special')] == [2, 11]
+    assert len(kudb.search('common', limit=100)) == 9
+    _integrity_check()
+    kudb.clear_doc()
+    assert kudb.search('common') == []
+    _integrity_check()
+    kudb.disable_fulltext()
+
+
+def test_resume_indexing():
+    """途中で止まったインデックス作成を再開できる"""
+    kudb.connect()
+    kudb.clear()
+    kudb.disable_fulltext()
+    kudb.insert_many([{'title': f'doc {i}'} for i in range(10)])
+    kudb.enable_fulltext(['title'])
+    # 途中で止まった状態を再現
+    db = kudb.kudb.db
+    db.execute("INSERT INTO dockudb_fts (dockudb_fts) VALUES ('delete-all')")
+    db.execute("UPDATE dockudb_fts_state SET progress=0")
+    db.commit()
+    # 未インデックスの行を更新・削除しても壊れない
+    kudb.update(id=5, new_value={'title': 'updated'})
+    kudb.delete(id=6)
+    kudb.insert({'title': 'doc new'})
+    assert kudb.enable_fulltext(['title'], batch_size=4) == 9
+    assert [d['title'] for d in kudb.search('updated')] == ['updated']
+    assert len(kudb.search('doc', limit=100)) == 9
+    _integrity_check()
+    kudb.disable_fulltext()
+
+
+def test_search_without_index():
+    """インデックスがない時はエラー"""
+    kudb.connect()
+    kudb.disable_fulltext()
+    try:
+        kudb.search('x')
+        assert False, "例外が発生すべき"
+    except kudb.kudb.KudbError as e:
+        assert "enable_fulltext" in str(e)
+
+
+def test_disable_in_batch():
+    """batch() の中では使えず、途中の書き込みもコミットしない"""
+    kudb.connect()
+    kudb.clear()
+    kudb.enable_fulltext(['title'])
+    try:
+        with kudb.batch():
+            kudb.insert({'title': 'tea'})
+            kudb.disable_fulltext()
+        assert False, "例外が発生すべき"
+    except kudb.kudb.KudbError as e:
+        assert "batch" in str(e)
+    assert kudb.count_doc() == 0
+    kudb.disable_fulltext()
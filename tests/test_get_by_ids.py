@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+get_by_ids test script
+"""
+
+import time
+
+import kudb
+
+
+def test_get_by_ids_order():
+    """入力と同じ順番で返し、見つからない ID はプレースホルダー"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'no': i} for i in range(1, 2001)])
+    kudb.delete(id=10)
+    ids = [2000, 5, 10, 99999, 5, 1]
+    docs = kudb.get_by_ids(ids, missing={})
+    assert [d.get('no') for d in docs] == [2000, 5, None, None, 5, 1]
+    assert [d.get('id') for d in docs] == [2000, 5, None, None, 5, 1]
+    # 同じ ID でも別の dict
+    assert docs[1] is not docs[4]
+    assert kudb.get_by_ids([]) == []
+    # 大量の ID も1回で
+    ids = list(range(2000, 0, -1))
+    assert [d['no'] if d else None for d in kudb.get_by_ids(ids)] == [
+        None if i == 10 else i for i in ids]
+    # fields / lazy
+    assert kudb.get_by_ids([3], fields=['no']) == [{'no': 3, 'id': 3}]
+    assert kudb.get_by_ids([3], lazy=True)[0].id == 3
+
+
+def test_get_by_ids_ttl():
+    """期限切れのドキュメントは missing"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert({'no': 1}, ttl=0.01)
+    kudb.insert({'no': 2})
+    time.sleep(0.02)
+    assert kudb.get_by_ids([1, 2], missing='x') == ['x', {'no': 2, 'id': 2}]
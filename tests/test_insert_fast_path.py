@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+insert hot path test script
+"""
+
+import os
+import tempfile
+
+import kudb
+
+
+def _trace_statements(func):
+    """func の実行中に発行された SQL 文を返す"""
+    statements = []
+    db = kudb.kudb.db
+    db.set_trace_callback(statements.append)
+    try:
+        func()
+    finally:
+        db.set_trace_callback(None)
+    return statements
+
+
+def test_insert_one_statement():
+    """タグ名が決まった後の insert は INSERT 1回だけ"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert({'name': 'A', 'age': 1})  # タグ名を自動設定
+    sqls = _trace_statements(lambda: kudb.insert({'name': 'B', 'age': 2}))
+    sqls = [s for s in sqls if s not in ('BEGIN ', 'COMMIT')]
+    assert len(sqls) == 1 and sqls[0].startswith('INSERT'), sqls
+    assert kudb.get_one(tag='B')['age'] == 2
+
+
+def test_tag_name_cache_invalidation():
+    """タグ名を変更するとキャッシュも更新される"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_tag_name('name')
+    kudb.set_key('_tag', 'city')
+    kudb.insert({'name': 'A', 'city': 'Tokyo'})
+    assert kudb.get_one(tag='Tokyo')['name'] == 'A'
+    kudb.clear_keys()
+    assert kudb.get_tag_name() == 'tag'
+
+
+def test_insert_statements_with_file():
+    """file= で同じファイルに繋ぎ直しても insert は INSERT 1回だけ"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'insert.db')
+        kudb.connect(path)
+        kudb.set_tag_name('name')
+        kudb.insert({'name': 'A'}, file=path)
+
+        def insert_many_times():
+            for i in range(100):
+                kudb.insert({'name': f'user{i}', 'age': i}, file=path)
+
+        sqls = _trace_statements(insert_many_times)
+        sqls = [s for s in sqls if s not in ('BEGIN ', 'COMMIT')]
+        assert len(sqls) == 100 and all(s.startswith('INSERT') for s in sqls), sqls[:5]
+        assert kudb.count_doc() == 101
+        # 別のファイルに切り替えても、そのファイルの設定は残る
+        kudb.connect(os.path.join(tmp, 'other.db'))
+        assert kudb.get_tag_name() == 'tag'
+        kudb.connect(path)
+        assert kudb.get_tag_name() == 'name'
+        kudb.close()
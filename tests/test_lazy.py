@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+lazy document (LazyDoc) test script
+"""
+
+import os
+import tempfile
+
+import kudb
+
+
+def is_adult(v):
+    """並列検索用の述語"""
+    return v['age'] >= 20
+
+
+def test_lazy_find():
+    """lazy=True の行は必要なフィールドだけデコードする"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'name': 'Taro', 'age': 30, 'note': '"age": 99', 'sub': {'age': 1}},
+        {'name': 'Jiro', 'age': 19, 'sub': {'age': 50}},
+        {'sub': {'age': 70}, 'name': 'Hana', 'age': 21},
+    ])
+    rows = kudb.find(lambda v: v['age'] > 20, lazy=True)
+    assert [(d.id, d['name']) for d in rows] == [(1, 'Taro'), (3, 'Hana')]
+    # 述語だけではドキュメント全体はデコードしない
+    assert all(d._value is kudb.kudb.UNDECODED for d in rows)
+    assert rows[0]['sub'] == {'age': 1}
+    assert rows[0]['id'] == 1
+    assert rows[0].get('none', 'x') == 'x'
+    assert rows[1].to_dict() == {'sub': {'age': 70}, 'name': 'Hana', 'age': 21, 'id': 3}
+    assert sorted(rows[1]) == ['age', 'name', 'sub']
+    # ユーザーの dict に id を書き込まない
+    assert 'id' not in rows[0].value
+    assert rows[0].ctime > 0 and rows[0].mtime > 0
+    # keys でも使える
+    assert [d.id for d in kudb.find(keys={'name': 'Jiro'}, lazy=True)] == [2]
+
+
+def test_lazy_non_dict():
+    """dict 以外のドキュメントもそのまま扱える"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([[1, 2, 3], 'text', 5])
+    rows = kudb.get_all(lazy=True)
+    assert [d.value for d in rows] == [[1, 2, 3], 'text', 5]
+    assert rows[0][1] == 2
+    assert rows[2].to_dict() == 5
+
+
+def test_lazy_parallel_find():
+    """並列検索でも LazyDoc を返せる"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'lazy.db'))
+        kudb.insert_many([{'name': f'user{i}', 'age': i % 40} for i in range(500)])
+        expected = [d['id'] for d in kudb.find(is_adult)]
+        rows = kudb.find(is_adult, workers=2, lazy=True)
+        assert [d.id for d in rows] == expected
+        assert rows[0]['name'] == 'user20'
+        kudb.close()
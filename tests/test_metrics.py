@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+enable_metrics test script
+"""
+
+import kudb
+
+
+def test_statements_and_commits():
+    """1回の API 呼び出しで発行された SQL とコミットを数える"""
+    kudb.connect()
+    kudb.clear()
+    traced = []
+    calls = []
+    m = kudb.enable_metrics(
+        on_call=lambda name, sec, stat: calls.append(name), trace=traced.append
+    )
+    try:
+        kudb.set_tag_name('name')
+        kudb.insert({'name': 'A', 'age': 1})
+        kudb.get_all()
+        kudb.get(id=1)  # 内部で get_by_id を呼ぶ (get として1回)
+    finally:
+        kudb.disable_metrics()
+    f = m.functions['insert']
+    assert f['calls'] == 1 and f['commits'] == 1
+    assert f['bytes_serialized'] == len('{"name": "A", "age": 1}')
+    assert f['statements'] >= 1
+    assert m.functions['get_all']['rows_returned'] == 1
+    assert 'get_by_id' not in m.functions
+    assert calls == ['set_tag_name', 'insert', 'get_all', 'get']
+    assert any(sql.startswith('INSERT') for sql in traced)
+
+
+def test_errors_and_prometheus():
+    """エラーも数えて Prometheus 形式で出力"""
+    kudb.connect()
+    kudb.enable_metrics()
+    try:
+        try:
+            kudb.get()
+        except kudb.kudb.KudbError:
+            pass
+        text = kudb.metrics_text()
+    finally:
+        kudb.disable_metrics()
+    assert 'kudb_errors_total{function="get"} 1' in text
+    assert 'kudb_call_duration_seconds_bucket{function="get",le="+Inf"} 1' in text
+    assert 'kudb_call_duration_seconds_count{function="get"} 1' in text
+    assert kudb.metrics_text() == ''
+
+
+def test_disabled():
+    """無効の時は何も記録しない"""
+    kudb.connect()
+    kudb.disable_metrics()
+    kudb.insert(1)
+    assert kudb.get_metrics() is None
+
+
+def test_slow_log():
+    """遅い呼び出しを EXPLAIN QUERY PLAN 付きで記録"""
+    import logging
+
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = Handler()
+    logging.getLogger('kudb').addHandler(handler)
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'name': 'A', 'age': 30}, {'name': 'B', 'age': 20}])
+    kudb.enable_slow_log(threshold=0)
+    try:
+        kudb.get_all()
+        kudb.get_by_id(1)
+    finally:
+        kudb.disable_slow_log()
+        logging.getLogger('kudb').removeHandler(handler)
+    entries = [r.kudb_slow for r in records]
+    assert [e['function'] for e in entries] == ['get_all', 'get_by_id']
+    assert entries[0]['rows_scanned'] == 2
+    plan = entries[1]['statements'][0]['plan']
+    assert any('INTEGER PRIMARY KEY' in p for p in plan), plan
+    assert entries[1]['full_scan'] is False
+
+
+def test_slow_log_old_plan_wording(monkeypatch):
+    """SQLite 3.35 以前の "SCAN TABLE" の表記も全件走査として記録"""
+    import logging
+
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = Handler()
+    logging.getLogger('kudb').addHandler(handler)
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'name': 'A'}])
+    plans = {'old': ['SCAN TABLE dockudb'], 'other': ['SCAN TABLE dockudb_fts'],
+             'index': ['SCAN TABLE dockudb USING INDEX dockudb_tag']}
+    kudb.enable_slow_log(threshold=0)
+    try:
+        for plan in plans.values():
+            monkeypatch.setattr(kudb.kudb, '_explain', lambda sql, plan=plan: plan)
+            kudb.get_all()
+    finally:
+        kudb.disable_slow_log()
+        logging.getLogger('kudb').removeHandler(handler)
+    assert [r.kudb_slow['full_scan'] for r in records] == [True, False, False]
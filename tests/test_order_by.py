@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+order_by test script
+"""
+
+import pytest
+
+import kudb
+
+
+def _insert_people():
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'name': 'A', 'city': 'Osaka', 'age': 30},
+        {'name': 'B', 'city': 'Tokyo', 'age': 20},
+        {'name': 'C', 'city': 'Osaka', 'age': 25},
+        {'name': 'D', 'city': 'Tokyo', 'age': 40},
+        {'name': 'E', 'city': 'Osaka', 'age': 25},
+    ])
+
+
+def test_get_all_order_by():
+    """フィールドで並べ替える (同じ値は最後の項目と同じ向きの ID 順)"""
+    _insert_people()
+    names = lambda rows: [r['name'] for r in rows]
+    assert names(kudb.get_all(order_by='age')) == ['B', 'C', 'E', 'A', 'D']
+    assert names(kudb.get_all(order_by='age', desc=True)) == ['D', 'A', 'E', 'C', 'B']
+    assert names(kudb.get_all(order_by=[('city', 'asc'), ('age', 'desc')])) == [
+        'A', 'E', 'C', 'D', 'B']
+    assert names(kudb.get_all(order_by=['city', 'age'], limit=2)) == ['C', 'E']
+    assert names(kudb.get_all(order_by='age', from_id=3)) == ['C', 'E', 'D']
+    with pytest.raises(kudb.kudb.KudbError):
+        kudb.get_all(order_by=[('age', 'up')])
+
+
+def test_find_order_by_with_index():
+    """インデックスがあっても結果は同じ"""
+    _insert_people()
+    expected = [r['name'] for r in kudb.find(lambda v: v['city'] == 'Osaka', order_by='age', limit=2)]
+    kudb.create_index('age')
+    kudb.create_index(['city', 'age'])
+    sql = kudb.kudb._order_by(kudb.kudb.SQLS['select_doc_asc'], 'age')
+    plan = kudb.kudb.db.execute('EXPLAIN QUERY PLAN ' + sql, [1, 3]).fetchall()
+    assert 'dockudb_ix_age' in str(plan)
+    assert [r['name'] for r in kudb.find(lambda v: v['city'] == 'Osaka', order_by='age', limit=2)] == expected == ['C', 'E']
+    assert [r['name'] for r in kudb.get_all(order_by=['city', 'age'])] == ['C', 'E', 'A', 'B', 'D']
+    kudb.drop_index('age')
+    kudb.drop_index(['city', 'age'])
+    assert 'ix_' not in str(kudb.kudb.db.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall())
+
+
+def test_high_score_missing_key():
+    """スコアのないドキュメントは 0 点として並べる (以前と同じ)"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'name': 'A', 'score': -5}, {'name': 'B'}, {'name': 'C', 'score': 3}, {'name': 'D', 'score': 0}])
+    assert [d['name'] for d in kudb.get_high_score()] == ['C', 'B', 'D', 'A']
+    assert [d['name'] for d in kudb.get_high_score(1)] == ['C']
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+find(workers=N) test script
+"""
+
+import os
+import tempfile
+
+import kudb
+
+
+def is_adult(v):
+    """並列検索用の述語 (pickle できるようにモジュールレベルで定義)"""
+    return v['age'] >= 20
+
+
+def test_parallel_find():
+    """並列検索の結果は逐次検索と同じ順番"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'find.db'))
+        kudb.insert_many([{'name': f'user{i}', 'age': i % 40} for i in range(2000)])
+        kudb.delete(id=25)
+        expected = kudb.find(is_adult)
+        assert kudb.find(is_adult, workers=4) == expected
+        assert kudb.find(is_adult, workers=4, limit=30) == expected[:30]
+        assert kudb.find('tests.test_parallel_find:is_adult', workers=2) == expected
+        assert kudb.find(keys={'age': 21}, workers=3) == kudb.find(keys={'age': 21})
+        kudb.close()
+
+
+def test_parallel_find_in_batch():
+    """batch() の中ではコミット前の行も見えるように逐次検索する"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'find.db'))
+        kudb.insert_many([{'age': 30} for _ in range(1000)])
+        with kudb.batch():
+            kudb.insert({'age': 40})
+            assert len(kudb.find(is_adult, workers=2)) == 1001
+        assert len(kudb.find(is_adult, workers=2)) == 1001
+        kudb.close()
+
+def test_parallel_find_lambda():
+    """lambda は pickle できないのでエラー"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'find.db'))
+        kudb.insert_many([1, 2, 3])
+        try:
+            kudb.find(lambda v: v > 1, workers=2)
+            assert False, "例外が発生すべき"
+        except kudb.kudb.KudbError as e:
+            assert "picklable" in str(e)
+        kudb.close()
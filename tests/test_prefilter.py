@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+find(contains= / like= / regexp=) test script
+"""
+
+import os
+import tempfile
+
+import kudb
+
+
+def is_adult(v):
+    """並列検索用の述語"""
+    return v['age'] >= 20
+
+
+def _insert_docs():
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'name': 'Taro', 'age': 30, 'city': 'Tokyo'},
+        {'name': 'Jiro', 'age': 19, 'city': 'Osaka'},
+        {'name': 'Taroko', 'age': 15, 'city': 'Tokyo'},
+        {'name': 'Hana', 'age': 21, 'friend': 'Taro'},
+        {},
+    ])
+
+
+def test_prefilter_only_candidates():
+    """SQL で絞り込んだ行だけがコールバックに渡る"""
+    _insert_docs()
+    seen = []
+
+    def callback(v):
+        seen.append(v['name'])
+        return v.get('name', '').startswith('Taro')
+
+    assert [a['name'] for a in kudb.find(callback, contains='Taro')] == ['Taro', 'Taroko']
+    assert seen == ['Taro', 'Taroko', 'Hana']
+    # 複数の文字列は AND
+    assert [a['name'] for a in kudb.find(contains=['Taro', 'Tokyo'])] == ['Taro', 'Taroko']
+    # コールバックなしなら候補をそのまま返す
+    assert [a['id'] for a in kudb.find(like='%"city": "osaka"%')] == [2]
+    assert [a['name'] for a in kudb.find(regexp=r'"age": [12]\d,')] == ['Jiro', 'Taroko', 'Hana']
+    assert kudb.find(regexp='^{}$') == [{'id': 5}]
+    assert kudb.find(contains='Nobody') == []
+    # 他のオプションと組み合わせる
+    assert kudb.find(is_adult, contains='Tokyo', fields=['name', 'age']) == [{'name': 'Taro', 'age': 30, 'id': 1}]
+    assert [d.id for d in kudb.find(is_adult, regexp='Taro', lazy=True, limit=1)] == [1]
+
+
+def test_prefilter_escaped_text():
+    """JSON でエスケープされる文字を含む文字列も見つかる"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([
+        {'memo': 'say "hi"\nbye'},
+        {'memo': 'C:\\temp\tdir'},
+        {'memo': 'plain'},
+    ])
+    assert [a['id'] for a in kudb.find(contains='"hi"')] == [1]
+    assert [a['id'] for a in kudb.find(contains='hi"\nbye')] == [1]
+    assert [a['id'] for a in kudb.find(contains='C:\\temp\t')] == [2]
+    assert [a['id'] for a in kudb.find(lambda v: 'bye' in v['memo'], contains='\n')] == [1]
+
+
+def test_prefilter_parallel():
+    """並列検索でも同じ結果"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'pre.db'))
+        kudb.insert_many([{'name': f'user{i}', 'age': i % 40} for i in range(500)])
+        expected = kudb.find(is_adult, contains='user1')
+        assert len(expected) > 0
+        assert kudb.find(is_adult, contains='user1', workers=2) == expected
+        assert kudb.find(is_adult, regexp='user1', workers=2) == expected
+        kudb.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+get_range (ctime / mtime) test script
+"""
+
+import datetime
+import os
+import sqlite3
+import tempfile
+
+import kudb
+
+
+def _set_times(table, rows):
+    """ctime / mtime を書き換える"""
+    db = kudb.kudb.db
+    key = 'id' if table.startswith('doc') else 'key'
+    for k, ctime, mtime in rows:
+        db.execute(f'UPDATE {table} SET ctime=?, mtime=? WHERE {key}=?', [ctime, mtime, k])
+    db.commit()
+
+
+def test_get_range_docs():
+    """作成・更新時刻の範囲で時刻順に取得できる"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([{'name': n} for n in 'ABCD'])
+    _set_times('dockudb', [(1, 400, 400), (2, 100, 500), (3, 300, 300), (4, 200, 900)])
+    names = lambda rows: [r['name'] for r in rows]
+    assert names(kudb.get_range(created_after=150)) == ['D', 'C', 'A']
+    assert names(kudb.get_range(created_after=150, created_before=400)) == ['D', 'C']
+    assert names(kudb.get_range(modified_after=400)) == ['A', 'B', 'D']
+    assert names(kudb.get_range(modified_before=500, limit=1)) == ['C']
+    row = kudb.get_range(created_before=150)[0]
+    assert (row['id'], row['_ctime'], row['_mtime']) == (2, 100, 500)
+    # datetime も使える
+    when = datetime.datetime.fromtimestamp(250, tz=datetime.timezone.utc)
+    assert names(kudb.get_range(created_after=when)) == ['C', 'A']
+    # stream / lazy
+    rows = kudb.get_range(created_after=0, stream=True, lazy=True)
+    assert [(d.id, d.ctime) for d in rows] == [(2, 100), (4, 200), (3, 300), (1, 400)]
+
+
+def test_get_range_kvs_index():
+    """キーの範囲検索はインデックスを使う"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('a', 1)
+    kudb.set_key('b', 2)
+    _set_times('kudb', [('a', 100, 100), ('b', 200, 200)])
+    items = kudb.get_range(modified_after=150, kvs=True)
+    assert items == [{'key': 'b', 'value': 2, '_ctime': 200, '_mtime': 200}]
+    plan = kudb.kudb.db.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM dockudb WHERE ctime >= ? ORDER BY ctime, id', [0]).fetchall()
+    assert 'dockudb_ctime' in str(plan)
+
+
+def test_indexes_for_old_files():
+    """古いファイルでは接続時に索引を作らず、get_range の初回に作る"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+        CREATE TABLE kudb (key_id INTEGER PRIMARY KEY, key TEXT UNIQUE,
+            value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+        CREATE TABLE dockudb (id INTEGER PRIMARY KEY, tag TEXT DEFAULT '',
+            value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+        INSERT INTO dockudb (value, ctime) VALUES ('{"name": "A"}', 100);
+        """)
+        conn.close()
+
+        def indexes():
+            rows = kudb.kudb.db.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL")
+            return sorted(row[0] for row in rows)
+
+        kudb.connect(path)
+        assert indexes() == ['dockudb_expires', 'kudb_expires']
+        assert [d['name'] for d in kudb.get_range(created_after=50)] == ['A']
+        assert 'dockudb_ctime' in indexes() and 'kudb_ctime' not in indexes()
+        kudb.aggregate(group_by='tag')
+        assert 'dockudb_tag' in indexes()
+        kudb.close()
+        # 新しいファイルは最初から作る
+        kudb.connect(os.path.join(tmp, 'new.db'))
+        assert {'dockudb_tag', 'dockudb_ctime', 'kudb_mtime'} <= set(indexes())
+        kudb.close()
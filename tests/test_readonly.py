@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+readonly connection test script
+"""
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+import kudb
+
+
+def test_readonly_reader():
+    """読み取り専用接続はスキーマを作らず、他の接続の書き込みを読める"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ro.db')
+        kudb.connect(path)
+        kudb.set_key('name', 'Taro')
+        kudb.insert({'name': 'Jiro'})
+        kudb.close()
+        kudb.connect(path, readonly=True, mmap_size=1 << 20)
+        assert kudb.get_key('name') == 'Taro'
+        assert [d['name'] for d in kudb.get_all()] == ['Jiro']
+        # 書き込みはエラー
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.set_key('name', 'Hanako')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.insert({'name': 'Saburo'})
+        # キーのキャッシュを持たないので他の接続の書き込みが見える
+        writer = sqlite3.connect(path)
+        writer.execute("INSERT INTO kudb (key, value) VALUES ('age', '30')")
+        writer.commit()
+        writer.close()
+        assert kudb.get_key('age') == 30
+        assert sorted(kudb.get_keys()) == ['_tag', 'age', 'name']
+        kudb.close()
+
+
+def test_readonly_no_schema():
+    """読み取り専用接続は存在しないファイルやテーブルを作らない"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'none.db')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.connect(path, readonly=True)
+        assert not os.path.exists(path)
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.connect(':memory:', readonly=True)
+
+
+def test_immutable_old_file():
+    """immutable で古い形式 (expires_at なし) のファイルも読める"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'old.db')
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+        CREATE TABLE kudb (key_id INTEGER PRIMARY KEY, key TEXT UNIQUE,
+            value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+        CREATE TABLE dockudb (id INTEGER PRIMARY KEY, tag TEXT DEFAULT '',
+            value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+        INSERT INTO kudb (key, value) VALUES ('name', '"Taro"');
+        INSERT INTO dockudb (value) VALUES ('{"name": "Jiro"}');
+        """)
+        conn.close()
+        kudb.connect(path, immutable=True)
+        assert kudb.get_key('name') == 'Taro'
+        assert kudb.get_keys() == ['name']
+        assert kudb.count_doc() == 1
+        assert kudb.find(keys={'name': 'Jiro'})[0]['id'] == 1
+        # 実行時に SQL を組み立てる関数も使える
+        assert kudb.scan(prefix='na') == ['name']
+        assert kudb.aggregate(metrics={'n': 'count'}) == [{'n': 1}]
+        assert [d['name'] for d in kudb.get_range()] == ['Jiro']
+        values, valid = kudb.to_columns(['name'], use_numpy=False)
+        assert list(valid['name']) == [0]  # 数値ではない
+        kudb.close()
+        # 読み取り専用なので古い形式のまま
+        conn = sqlite3.connect(path)
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(kudb)')]
+        conn.close()
+        assert 'expires_at' not in columns
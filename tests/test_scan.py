@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+scan / items (key range) test script
+"""
+
+import time
+
+import kudb
+
+
+def test_scan_prefix_and_range():
+    """プレフィックスと範囲でキーを順番に取得できる"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_keys_from_dict({f'user:{i:03d}:name': f'name{i}' for i in range(250)})
+    kudb.set_keys_from_dict({'user;': 1, 'user': 2, 'cfg:a': 3, 'cfg:b': 4})
+    keys = kudb.scan(prefix='user:')
+    assert keys == [f'user:{i:03d}:name' for i in range(250)]
+    assert kudb.scan(start='cfg:', end='cfg:b') == ['cfg:a']
+    assert kudb.scan(start='user') == ['user'] + keys + ['user;']
+    # 続きから読む
+    pages = []
+    after = None
+    while True:
+        page = kudb.scan(prefix='user:', limit=100, after=after)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]
+    assert [len(p) for p in pages] == [100, 100, 50]
+    assert sum(pages, []) == keys
+    # items は (key, value) を返す
+    assert list(kudb.items(prefix='cfg:')) == [('cfg:a', 3), ('cfg:b', 4)]
+    assert next(kudb.items(prefix='user:', after='user:009:name')) == ('user:010:name', 'name10')
+
+
+def test_scan_skips_expired():
+    """期限切れのキーは返さない"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('s:1', 1, ttl=0.01)
+    kudb.set_key('s:2', 2)
+    time.sleep(0.02)
+    assert kudb.scan(prefix='s:') == ['s:2']
+    assert list(kudb.items(prefix='s:')) == [('s:2', 2)]
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+sharded storage test script
+"""
+
+import tempfile
+import threading
+
+import pytest
+
+import kudb
+
+
+def test_sharded_kvs_and_docs():
+    """シャードに分けて保存しても ID 順に読める"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = kudb.connect_sharded(tmp, shards=4)
+        for i in range(20):
+            sdb.set_key(f'key{i}', i)
+        assert sdb.get_key('key7') == 7
+        assert sorted(sdb.get_keys()) == sorted(f'key{i}' for i in range(20))
+        sdb.delete_key('key7')
+        assert sdb.get_key('key7', None) is None
+        ids = [sdb.insert({'no': i}, tag='even' if i % 2 == 0 else 'odd') for i in range(10)]
+        assert ids == sorted(ids)
+        assert [d['no'] for d in sdb.get_all()] == list(range(10))
+        assert [d['no'] for d in sdb.get_all(limit=3, order_asc=False)] == [9, 8, 7]
+        assert sdb.get_by_id(ids[3])['no'] == 3
+        assert [d['no'] for d in sdb.get_by_tag('odd', limit=2)] == [1, 3]
+        assert [d['no'] for d in sdb.find(lambda v: v['no'] >= 5, limit=2)] == [5, 6]
+        assert sdb.find(keys={'no': 4})[0]['id'] == ids[4]
+        assert sdb.count_doc() == 10
+        sdb.close()
+        # 再接続しても同じシャードに振り分けられる
+        sdb = kudb.connect_sharded(tmp, shards=4)
+        assert sdb.get_key('key3') == 3
+        assert sdb.count_doc() == 10
+        sdb.close()
+        # シャード数は変更できない
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.connect_sharded(tmp, shards=8)
+
+
+def test_sharded_scan_pages():
+    """ページ単位で読んでも全件を ID 順に返す"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = kudb.connect_sharded(tmp, shards=3)
+        sdb.insert_many([{'no': i} for i in range(kudb.kudb.SHARD_PAGE * 2 + 10)])
+        docs = sdb.get_all()
+        assert [d['no'] for d in docs] == list(range(kudb.kudb.SHARD_PAGE * 2 + 10))
+        assert [d['no'] for d in sdb.get_all(order_asc=False)][:2] == [
+            kudb.kudb.SHARD_PAGE * 2 + 9, kudb.kudb.SHARD_PAGE * 2 + 8]
+        sdb.close()
+
+
+def test_sharded_threads():
+    """複数スレッドから同時に書き込める"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = kudb.connect_sharded(tmp, shards=4)
+
+        def work(n):
+            for i in range(50):
+                sdb.set_key(f'{n}-{i}', i)
+                sdb.insert({'n': n, 'i': i})
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(sdb.get_keys()) == 200
+        assert sdb.count_doc() == 200
+        sdb.close()
+
+
+def test_sharded_ids_after_reopen():
+    """開き直しても ID は挿入順に増え、更新・削除もできる"""
+    with tempfile.TemporaryDirectory() as tmp:
+        sdb = kudb.connect_sharded(tmp, shards=4)
+        sdb.insert_many([{'n': i} for i in range(3)])
+        sdb.close()
+        sdb = kudb.connect_sharded(tmp, shards=4)
+        ids = [sdb.insert({'n': i}) for i in range(3, 7)]
+        assert [d['n'] for d in sdb.get_all()] == list(range(7))
+        assert [d['n'] for d in sdb.get_all(limit=2, order_asc=False)] == [6, 5]
+        # 同じディレクトリを別の接続からも書き込む (ID が重なれば取り直す)
+        other = kudb.connect_sharded(tmp, shards=4)
+        other.insert({'n': 7})
+        sdb.insert({'n': 8})
+        assert sorted(d['n'] for d in sdb.get_all()) == list(range(9))
+        assert len({d['id'] for d in sdb.get_all()}) == 9
+        other.close()
+        # 更新と削除
+        sdb.update(ids[0], {'n': 30})
+        assert sdb.get_by_id(ids[0]) == {'n': 30, 'id': ids[0]}
+        sdb.delete(ids[1])
+        assert sdb.get_by_id(ids[1]) is None
+        assert sdb.count_doc() == 8
+        sdb.close()
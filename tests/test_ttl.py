@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+ttl / purge_expired test script
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+
+import kudb
+
+
+def test_ttl_key_and_doc():
+    """期限切れのキーとドキュメントは読めない"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('session', 'abc', ttl=0.05)
+    kudb.set_key('config', 1)
+    kudb.set_tag_name('name')
+    kudb.insert({'name': 'cache'}, ttl=0.05)
+    kudb.insert({'name': 'keep'})
+    assert sorted(kudb.get_keys()) == ['_tag', 'config', 'session']
+    assert kudb.count_doc() == 2
+    time.sleep(0.1)
+    assert kudb.get_key('session', None) is None
+    assert sorted(kudb.get_keys()) == ['_tag', 'config']
+    assert [d['name'] for d in kudb.get_all()] == ['keep']
+    assert kudb.count_doc() == 1
+    # 期限切れのキーは上書きできる
+    kudb.set_key('session', 'xyz')
+    assert kudb.get_key('session') == 'xyz'
+
+
+def test_get_info_columns():
+    """get_info は以前と同じ 5 列を返し、期限切れは None"""
+    kudb.connect()
+    kudb.clear()
+    kudb.set_key('a', 'x', ttl=0.05)
+    key_id, key, value, ctime, mtime = kudb.get_info('a')
+    assert (key, value) == ('a', '"x"')
+    assert ctime == mtime
+    time.sleep(0.1)
+    assert kudb.get_info('a', None) is None
+
+def test_incr_ttl_window():
+    """期限切れのカウンターは0から数え直す"""
+    kudb.connect()
+    kudb.clear()
+    assert kudb.incr('rate', ttl=0.05) == 1
+    assert kudb.incr('rate', ttl=0.05) == 2
+    time.sleep(0.1)
+    assert kudb.incr('rate', ttl=0.05) == 1
+
+
+def test_purge_uses_index():
+    """期限切れの削除はインデックスを使う"""
+    kudb.connect()
+    plan = kudb.kudb.db.execute(
+        'EXPLAIN QUERY PLAN ' + kudb.kudb.SQLS['purge_doc'], [10]
+    ).fetchall()
+    assert any('doc' + 'kudb_expires' in row[-1] for row in plan), plan
+
+
+def test_sweeper():
+    """バックグラウンドで期限切れを削除"""
+    kudb.connect()
+    kudb.clear()
+    kudb.insert_many([1, 2, 3], ttl=0.01)
+    kudb.start_sweeper(interval=0.05)
+    time.sleep(0.2)
+    kudb.stop_sweeper()
+    assert kudb.kudb.db.execute('SELECT count(*) FROM dockudb').fetchone()[0] == 0
+
+
+def test_upgrade_old_file():
+    """旧バージョンのファイルに expires_at 列を追加"""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'old.db')
+        conn = sqlite3.connect(filename)
+        conn.executescript('''
+            CREATE TABLE kudb (key_id INTEGER PRIMARY KEY, key TEXT UNIQUE,
+                value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+            CREATE TABLE dockudb (id INTEGER PRIMARY KEY, tag TEXT DEFAULT '',
+                value TEXT DEFAULT '', ctime INTEGER DEFAULT 0, mtime INTEGER DEFAULT 0);
+            INSERT INTO kudb (key, value) VALUES ('a', '1');
+            INSERT INTO dockudb (value) VALUES ('{"name": "A"}');
+        ''')
+        conn.close()
+        kudb.connect(filename)
+        assert kudb.get_key('a') == 1
+        assert kudb.get_by_id(1)['name'] == 'A'
+        kudb.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+upsert / upsert_many test script
+"""
+
+import os
+import tempfile
+
+import pytest
+
+import kudb
+
+
+def test_upsert_by_tag():
+    """同じタグのドキュメントは置き換え、id と ctime は変わらない"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'upsert.db'))
+        # 一意インデックスがなければエラーで、勝手には作らない
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'name': 'banana', 'price': 30}, tag='banana')
+        kudb.insert({'name': 'banana'}, tag='banana')
+        kudb.insert({'name': 'banana'}, tag='banana')
+        kudb.delete(tag='banana')
+        kudb.create_index(unique=True)
+        id1 = kudb.upsert({'name': 'banana', 'price': 30}, tag='banana')
+        ctime = kudb.get_range(kvs=False)[0]['_ctime']
+        id2 = kudb.upsert({'name': 'banana', 'price': 35}, tag='banana')
+        assert id1 == id2
+        assert kudb.count_doc() == 1
+        assert kudb.get_by_tag('banana')[0]['price'] == 35
+        assert kudb.get_range(kvs=False)[0]['_ctime'] == ctime
+        # tag_name からタグを取る
+        kudb.upsert({'name': 'apple', 'price': 10}, tag_name='name')
+        kudb.upsert({'name': 'apple', 'price': 12}, tag_name='name')
+        assert kudb.get_by_tag('apple')[0]['price'] == 12
+        assert kudb.count_doc() == 2
+        # タグがなければエラー
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'fruit': 'melon'})
+        # タグなしの insert はそのまま使える
+        kudb.insert('melon')
+        kudb.insert('melon')
+        assert kudb.count_doc() == 4
+        # 一意インデックスを消せば同じタグを入れられる
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.insert({'name': 'banana'}, tag='banana')
+        kudb.drop_index(unique=True)
+        kudb.insert({'name': 'banana'}, tag='banana')
+        assert len(kudb.get_by_tag('banana')) == 2
+        kudb.close()
+
+
+def test_upsert_many_on_field():
+    """on のフィールドで照合して、まとめて挿入・更新できる"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'upsert.db'))
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert_many([{'sku': 's0', 'stock': 0}], on='sku')
+        kudb.create_index('sku', unique=True)
+        kudb.upsert_many([{'sku': f's{i}', 'stock': i} for i in range(2500)], on='sku', chunk_size=1000)
+        kudb.upsert_many([{'sku': f's{i}', 'stock': -i} for i in range(2000, 3000)], on='sku')
+        assert kudb.count_doc() == 3000
+        docs = kudb.get_all()
+        assert docs[0] == {'id': 1, 'sku': 's0', 'stock': 0}
+        assert docs[2400] == {'id': 2401, 'sku': 's2400', 'stock': -2400}
+        assert docs[-1] == {'id': 3000, 'sku': 's2999', 'stock': -2999}
+        assert kudb.upsert({'sku': 's5', 'stock': 50}, on='sku') == 6
+        assert kudb.get_by_id(6) == {'id': 6, 'sku': 's5', 'stock': 50}
+        assert kudb.find(keys={'sku': 's5'})[0]['stock'] == 50
+        kudb.close()
+
+
+def test_upsert_duplicated_values():
+    """重複した値が既にあれば一意インデックスを作れずエラー"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'upsert.db'))
+        kudb.insert_many([{'email': 'a@example.com'}, {'email': 'a@example.com'}])
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.create_index('email', unique=True)
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'email': 'a@example.com', 'name': 'A'}, on='email')
+        kudb.close()
+
+
+def test_upsert_bad_arguments():
+    """on のフィールドがないドキュメントや不正な chunk_size はエラー"""
+    with tempfile.TemporaryDirectory() as tmp:
+        kudb.connect(os.path.join(tmp, 'upsert.db'))
+        kudb.create_index('sku', unique=True)
+        kudb.create_index('user.id', unique=True)
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'name': 'no sku'}, on='sku')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'sku': None}, on='sku')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert_many([{'sku': 'a'}, {'name': 'no sku'}], on='sku')
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert_many([{'sku': 'a'}], on='sku', chunk_size=0)
+        assert kudb.count_doc() == 0
+        # 入れ子のフィールド
+        assert kudb.upsert({'user': {'id': 1}, 'n': 1}, on='user.id') == 1
+        assert kudb.upsert({'user': {'id': 1}, 'n': 2}, on='user.id') == 1
+        with pytest.raises(kudb.kudb.KudbError):
+            kudb.upsert({'user': 1}, on='user.id')
+        kudb.close()